@@ -1,14 +1,10 @@
 import streamlit as st
+from verden_pa_norsk.admin import is_admin, show_admin
+from verden_pa_norsk.streamlit_tools import get_text_file
 
 DOC_PATH = "resources/markdown/Document.md"
 
 
-def get_file(file_path, method="r"):
-    with open(file_path, "r") as file:
-        data = file.read()
-    return data
-
-
 def main():
     st.set_page_config(
         page_title="Verden på norsk",
@@ -16,7 +12,11 @@ def main():
         layout="wide",
     )
 
-    md = get_file("resources/markdown/Document.md")
+    if is_admin():
+        show_admin()
+        return
+
+    md = get_text_file(DOC_PATH)
     st.markdown(md, unsafe_allow_html=True)
 
 
@@ -0,0 +1,115 @@
+"""Benchmark Boksøk result formatting: row-wise pandas apply against SQL expressions
+
+Run from the app directory:
+
+    python -m benchmarks.bench_formatting
+"""
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from verden_pa_norsk.formatting import metadata_link_sql, review_link_sql, urn_link_sql
+from verden_pa_norsk.utils import feltnavn_norsk
+
+SIZES = (10_000, 100_000)
+REPEAT = 3
+
+
+# Row-wise formatting as it was done in pages/1_Boksøk.py, kept as the baseline
+def switch_author_name(author: str | None) -> str | None:
+    if author is None:
+        return None
+    else:
+        return " ".join(author.split(", ")[::-1])
+
+
+def remove_subtitle(title: str | None) -> str | None:
+    return title.split(":")[0].strip()
+
+
+def sub_space_and_punct(text: str) -> str:
+    return text.replace(".", "").replace(" ", "%20")
+
+
+def generate_dhlab_review_link(author: str, title: str, publication_year_int: int) -> str:
+    link = f"Omtaler?author={sub_space_and_punct(author)}&title={sub_space_and_punct(title)}&publication_year={publication_year_int}"
+    return link
+
+
+def get_dhlab_review_links(df: DataFrame) -> Series:
+    authors = df["main_author"].apply(switch_author_name)
+    titles = df["title"].apply(remove_subtitle)
+    publication_year_int = df["publication_year_int"]
+
+    target = pd.concat([authors, titles, publication_year_int], axis=1).dropna()
+
+    return target.apply(
+        lambda x: generate_dhlab_review_link(x["main_author"], x["title"], x["publication_year_int"]), axis=1
+    )
+
+
+def format_rowwise(res: DataFrame) -> DataFrame:
+    res = res.copy()
+    res["links"] = get_dhlab_review_links(res)
+    res.urn = res.urn.apply(lambda x: f"https://urn.nb.no/{x}" if x else None)
+    res.columns = [feltnavn_norsk[x].lower() for x in res.columns]
+    res["mmsid"] = res["mmsid"].apply(lambda x: f"Metadata?mmsid={x}")
+    return res[["urn", "forfatter", "oversatt tittel", "publikasjonsår oversettelse", "lenker", "mmsid"]]
+
+
+def format_sql(res: DataFrame) -> DataFrame:
+    return duckdb.sql(
+        f"""SELECT {urn_link_sql('urn')} AS urn,
+            main_author AS forfatter,
+            title AS "oversatt tittel",
+            publication_year_int AS "publikasjonsår oversettelse",
+            {review_link_sql('main_author', 'title', 'publication_year_int')} AS lenker,
+            {metadata_link_sql('mmsid')} AS mmsid
+        FROM res"""
+    ).df()
+
+
+def make_results(n: int, seed: int = 0) -> DataFrame:
+    """Search results shaped like the books table, without missing values"""
+    rng = np.random.default_rng(seed)
+    first = np.array(["Agatha", "Fjodor M.", "Jane", "Gabriel García", "Haruki", "J.R.R.", "Selma"])
+    last = np.array(["Christie", "Dostojevskij", "Austen", "Márquez", "Murakami", "Tolkien", "Lagerlöf"])
+    words = np.array(["Mord", "på", "Orientekspressen", "Forbrytelse", "og", "straff", "Stolthet", "fordom", "Ringenes", "herre"])
+    authors = [f"{last[i]}, {first[i]}" for i in rng.integers(0, len(first), n)]
+    titles = [
+        " ".join(words[rng.integers(0, len(words), 3)]) + (": roman" if rng.random() < 0.3 else "")
+        for _ in range(n)
+    ]
+    return DataFrame({
+        "mmsid": [str(990000000000000000 + i) for i in range(n)],
+        "main_author": authors,
+        "title": titles,
+        "publication_year_int": rng.integers(1800, 2025, n),
+        "urn": [f"URN:NBN:no-nb_digibok_{i}" for i in range(n)],
+    })
+
+
+def best_of(func, res: DataFrame) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        func(res)
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    print(f"{'rows':>8}{'row-wise':>12}{'sql':>12}{'speedup':>10}")
+    for n in SIZES:
+        res = make_results(n)
+        assert format_rowwise(res).equals(format_sql(res)), "formatting differs"
+        rowwise = best_of(format_rowwise, res)
+        sql = best_of(format_sql, res)
+        print(f"{n:>8}{rowwise:>11.3f}s{sql:>11.3f}s{rowwise / sql:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Benchmark the query paths of the app pages, outside Streamlit
+
+Runs the Boksøk, Kart and Metadata queries and the snippet sanitizer against one or more data
+directories, each laid out like the app directory (data/translations_map_data.db), such as
+the synthetic catalogs from verden_pa_norsk.synthetic. Every data directory is benchmarked in
+a fresh process. Run from the app directory:
+
+    python -m verden_pa_norsk.synthetic --scale 1 10
+    python -m benchmarks.bench_queries [--data data/synthetic/1x data/synthetic/10x] [--save results.json] [--baseline old.json]
+
+Latencies are the 50th and 95th percentile over varied inputs. Peak memory is the Python heap,
+including fetched DataFrames, as traced by tracemalloc; memory held inside DuckDB is not
+included, but shows in the max RSS of each process.
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import pathlib
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent
+REPEAT = 20
+# slower than the baseline by more than this factor is flagged
+REGRESSION = 1.2
+
+
+def load_page(filename: str):
+    """Import a page script as a module, without running its main()"""
+    path = APP_DIR / "pages" / filename
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def uncached(func):
+    "The function behind st.cache_data"
+    return getattr(func, "__wrapped__", func)
+
+
+def sample(query: str, n: int) -> list:
+    from verden_pa_norsk.database import fetch_all
+
+    return [row[0] for row in fetch_all(f"SELECT * FROM ({query}) USING SAMPLE {int(n)} ROWS (reservoir, 42)")]
+
+
+def workloads(repeat: int) -> dict:
+    """Benchmarked calls, each a list of argument-free callables with varied inputs"""
+    from verden_pa_norsk.snippets import sanitize_snippets
+    from verden_pa_norsk.streamlit_tools import get_metadata_service, get_person_index
+    from benchmarks.bench_snippets import load_golden, make_snippets
+
+    boksok = load_page("1_Boksøk.py")
+    kart = load_page("4_Kart.py")
+    metadata = load_page("2_Metadata.py")
+    run_query = uncached(boksok.run_query)
+    get_facets = uncached(boksok.get_facets)
+    query_builder = uncached(kart.query_builder)
+    load_city_data = uncached(kart.load_city_data)
+
+    defaults = {"ddc800": {"input": True, "type": "BOOLEAN"}, "publication_year_int": {"input": (1800, 2024), "type": "INTEGER"}}
+    words = sample("SELECT DISTINCT term FROM search_postings WHERE field = 'title' AND length(term) > 3", repeat)
+    surnames = sample("SELECT DISTINCT split_part(main_author, ',', 1) FROM translations WHERE main_author IS NOT NULL", repeat)
+    translators = sample("SELECT name FROM persons WHERE translator_books > 0", repeat)
+    addresses = sample("SELECT address FROM places", repeat)
+    mmsids = sample("SELECT mmsid FROM ol_first_editions", repeat * 5)
+    years = [(int(y), int(y) + 20) for y in np.random.default_rng(0).integers(1800, 2005, repeat)]
+    snippets = make_snippets(100, load_golden())
+
+    def search(col, value):
+        return {**defaults, col: {"input": value, "type": "VARCHAR"}}
+
+    def next_page(inputs):
+        first = run_query(inputs)
+        return run_query(inputs, boksok.page_cursor(first.to_pandas())) if len(first) else first
+
+    def book_data(ids):
+        get_metadata_service().clear()
+        return metadata.get_book_data(ids)
+
+    return {
+        "run_query, first page": [lambda y=y: run_query({**defaults, "publication_year_int": {"input": y, "type": "INTEGER"}}) for y in years],
+        "run_query, title search": [lambda w=w: run_query(search("title", w)) for w in words],
+        "run_query, author search": [lambda s=s: run_query(search("main_author", s)) for s in surnames],
+        "run_query, two pages": [lambda w=w: next_page(search("title", w)) for w in words],
+        "run_query, translator": [lambda t=t: run_query({**defaults, "translators": {"input": t, "type": "VARCHAR[]"}}) for t in translators],
+        "get_facets": [lambda y=y: get_facets({**defaults, "publication_year_int": {"input": y, "type": "INTEGER"}}) for y in years],
+        "person autocomplete": [lambda t=t: get_person_index().complete(t[:4], "translator") for t in translators],
+        "load_city_data": [lambda y=y: load_city_data(*query_builder(publication_year=y)) for y in years],
+        "get_address_books": [lambda a=a: kart.get_address_books(*query_builder(address=a)) for a in addresses],
+        "get_book_data, 1 mmsid": [lambda m=m: book_data([m]) for m in mmsids[:repeat]],
+        "get_book_data, 5 mmsids": [lambda i=i: book_data(mmsids[i : i + 5]) for i in range(0, len(mmsids), 5)],
+        "sanitize_snippets, 100": [lambda: sanitize_snippets(snippets)] * repeat,
+    }
+
+
+def measure(calls: list) -> dict:
+    calls[0]()  # warm up
+    timings = []
+    for call in calls:
+        t0 = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    calls[-1]()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "peak_kb": peak / 1024,
+    }
+
+
+def run_single(repeat: int) -> dict:
+    """Benchmark the data directory in the working directory"""
+    from verden_pa_norsk.database import fetch_all
+
+    results = {name: measure(calls) for name, calls in workloads(repeat).items()}
+    return {
+        "books": fetch_all("SELECT count(*) FROM books")[0][0],
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "results": results,
+    }
+
+
+def print_report(data_dir: str, report: dict, baseline: dict | None):
+    print(f"\n{data_dir}: {report['books']} books, max RSS {report['max_rss_mb']:.0f} MB")
+    print(f"{'':<28}{'p50':>10}{'p95':>10}{'peak':>12}" + (f"{'vs baseline':>14}" if baseline else ""))
+    for name, result in report["results"].items():
+        line = f"{name:<28}{result['p50_ms']:>8.1f}ms{result['p95_ms']:>8.1f}ms{result['peak_kb']:>9.0f} kB"
+        old = (baseline or {}).get("results", {}).get(name)
+        if old:
+            ratio = result["p50_ms"] / old["p50_ms"]
+            line += f"{ratio:>13.2f}x" + (" !" if ratio > REGRESSION else "")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's query paths")
+    parser.add_argument("--data", nargs="+", help="data directories, by default every synthetic catalog in data/synthetic")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="calls per query path")
+    parser.add_argument("--save", help="write the results to a JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.repeat)))
+        return
+
+    data_dirs = args.data or sorted(glob.glob(str(APP_DIR / "data" / "synthetic" / "*x")), key=lambda d: float(os.path.basename(d)[:-1]))
+    if not data_dirs:
+        parser.error("no data directories, generate them with python -m verden_pa_norsk.synthetic")
+    baselines = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baselines = json.load(file)
+
+    reports = {}
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(APP_DIR), os.environ.get("PYTHONPATH", "")])}
+    for data_dir in data_dirs:
+        # Streamlit warns about running without a server, so stderr is only shown on failure
+        process = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_queries", "--single", "--repeat", str(args.repeat)],
+            cwd=data_dir, env=env, capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            sys.exit(f"benchmark failed for {data_dir}:\n{process.stderr}")
+        reports[data_dir] = json.loads(process.stdout.strip().splitlines()[-1])
+        print_report(data_dir, reports[data_dir], baselines.get(data_dir))
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
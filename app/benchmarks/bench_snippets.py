@@ -0,0 +1,108 @@
+"""Benchmark review snippet sanitizing: BeautifulSoup per fragment against the regex sanitizer
+
+Checks the sanitizer against the golden snippets in benchmarks/data/nb_snippets.json first, and
+lists the snippets where the old BeautifulSoup output differs. Run from the app directory:
+
+    python -m benchmarks.bench_snippets
+"""
+import json
+import pathlib
+import time
+import tracemalloc
+import warnings
+
+import bs4
+import numpy as np
+
+from verden_pa_norsk.snippets import sanitize_snippets
+
+GOLDEN_PATH = pathlib.Path(__file__).parent / "data" / "nb_snippets.json"
+# fragments per result page, and per full review search of ten pages
+SIZES = (100, 1000)
+REPEAT = 5
+
+# the golden snippets include an XML processing instruction
+warnings.filterwarnings("ignore", category=bs4.XMLParsedAsHTMLWarning)
+
+
+# As it was done in pages/3_Omtaler.py, kept as the baseline
+def parse_and_unwrap_html(html_snippet):
+    """Only look for <em> elements when parsing HTML, discard all others"""
+    try:
+        soup = bs4.BeautifulSoup(html_snippet, "html.parser")
+        for tag in soup.find_all(True):
+            if tag.name != 'em':
+                tag.unwrap()
+            else:
+                tag.name = 'strong'
+        return str(soup)
+    except:
+        return ""
+
+
+def sanitize_bs4(snippets: list[str]) -> list[str]:
+    return [parse_and_unwrap_html(snippet) if snippet else "" for snippet in snippets]
+
+
+def load_golden() -> list[dict]:
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_golden(golden: list[dict]):
+    output = sanitize_snippets(case["snippet"] for case in golden)
+    failed = [case["name"] for case, result in zip(golden, output) if result != case["expected"]]
+    assert not failed, f"sanitized snippets differ from the golden output: {', '.join(failed)}"
+    print(f"{len(golden)} golden snippets ok")
+
+    differs = [case["name"] for case, result in zip(golden, sanitize_bs4([c["snippet"] for c in golden])) if result != case["expected"]]
+    if differs:
+        print(f"BeautifulSoup output differs for: {', '.join(differs)}")
+
+
+def make_snippets(n: int, golden: list[dict], seed: int = 0) -> list[str]:
+    """Fragments about the size the API returns (fragSize 500), pieced together from golden snippets"""
+    rng = np.random.default_rng(seed)
+    pieces = [case["snippet"] for case in golden if case["snippet"]]
+    snippets = []
+    for _ in range(n):
+        snippet = ""
+        while len(snippet) < 500:
+            snippet += " " + pieces[rng.integers(0, len(pieces))]
+        snippets.append(snippet)
+    return snippets
+
+
+def best_of(func, snippets: list[str]) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        func(snippets)
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def peak_memory(func, snippets: list[str]) -> int:
+    tracemalloc.start()
+    func(snippets)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    golden = load_golden()
+    check_golden(golden)
+
+    print(f"{'snippets':>9}{'bs4':>11}{'regex':>11}{'speedup':>10}{'bs4 peak':>12}{'regex peak':>12}")
+    for n in SIZES:
+        snippets = make_snippets(n, golden)
+        old = best_of(sanitize_bs4, snippets)
+        new = best_of(sanitize_snippets, snippets)
+        old_peak = peak_memory(sanitize_bs4, snippets) / 1024
+        new_peak = peak_memory(sanitize_snippets, snippets) / 1024
+        print(f"{n:>9}{old * 1000:>9.1f}ms{new * 1000:>9.1f}ms{old / new:>9.1f}x{old_peak:>9.0f} kB{new_peak:>9.0f} kB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+-- Derived tables for the app. Run after load.sql.
+-- The tables are filled from table macros taking the name of the translations table, so that
+-- verden_pa_norsk.refresh can compute the rows of changed translations only, see refresh.sql.
+
+-- translations joined with first edition year and URN, physically ordered by year so that
+-- zone maps can skip row groups outside a year range. book_id follows the same order and is
+-- the stable key for paging through results.
+CREATE OR REPLACE MACRO book_rows(source) AS TABLE
+WITH source_rows AS (FROM query_table(source))
+SELECT t.*, ol.publish_year, u.urn
+FROM source_rows t
+LEFT JOIN urn_mmsid u ON u.mmsid = t.mmsid
+LEFT JOIN ol_first_editions ol ON ol.mmsid = t.mmsid;
+
+CREATE OR REPLACE TABLE books AS
+SELECT *, row_number() OVER (ORDER BY publication_year_int, mmsid, urn, publish_year) AS book_id
+FROM book_rows('translations')
+ORDER BY book_id;
+
+CREATE INDEX _books_mmsid_ ON books(mmsid);
+
+-- geocoded publication places of first editions, with the quadkey of the zoom 16 map tile each
+-- place falls in (see verden_pa_norsk.geo). Ordered by quadkey, so places that are close on the
+-- map are close in the table, and a quadkey prefix is a grid cell at a lower zoom level.
+CREATE OR REPLACE MACRO tile_x(longitude) AS least(greatest(floor((longitude + 180) / 360 * 65536), 0), 65535)::BIGINT;
+CREATE OR REPLACE MACRO tile_y(latitude) AS
+    least(greatest(floor((0.5 - ln(tan(radians(greatest(least(latitude, 85.0511), -85.0511))) + 1 / cos(radians(greatest(least(latitude, 85.0511), -85.0511)))) / (2 * pi())) * 65536), 0), 65535)::BIGINT;
+CREATE OR REPLACE MACRO tile_quadkey(x, y) AS list_sum([(((x >> i) & 1) << (2 * i)) + (((y >> i) & 1) << (2 * i + 1)) FOR i IN range(16)])::BIGINT;
+
+-- one row per first edition with a place
+CREATE OR REPLACE VIEW place_rows AS
+SELECT mmsid, address, latitude, longitude
+FROM ol_first_editions
+WHERE address IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL;
+
+CREATE OR REPLACE TABLE places AS
+SELECT row_number() OVER (ORDER BY quadkey, address, latitude, longitude) - 1 AS place_id, address, latitude, longitude, quadkey
+FROM (
+    SELECT address, latitude, longitude, tile_quadkey(tile_x(longitude), tile_y(latitude)) AS quadkey
+    FROM (SELECT DISTINCT address, latitude, longitude FROM place_rows)
+)
+ORDER BY place_id;
+
+CREATE INDEX _places_address_ ON places(address);
+
+-- first editions per place and translation year, with the filters Kart always applies. This is
+-- the posting list behind verden_pa_norsk.place_cube, and place_year_counts is its aggregate.
+CREATE OR REPLACE MACRO place_book_rows(source) AS TABLE
+WITH source_rows AS (FROM query_table(source))
+SELECT p.place_id, tr.publication_year_int AS year, ol.mmsid
+FROM ol_first_editions ol
+JOIN source_rows tr ON ol.mmsid = tr.mmsid
+JOIN places p ON p.address = ol.address AND p.latitude = ol.latitude AND p.longitude = ol.longitude
+WHERE (tr.ddc800 IS TRUE OR tr.ddc0 IS TRUE) AND tr.publication_year_int IS NOT NULL;
+
+CREATE OR REPLACE TABLE place_books AS
+SELECT * FROM place_book_rows('translations')
+ORDER BY place_id, year, mmsid;
+
+CREATE OR REPLACE VIEW place_year_rows AS
+SELECT place_id, year, count(*) AS books_published
+FROM place_books
+GROUP BY place_id, year;
+
+CREATE OR REPLACE TABLE place_year_counts AS
+SELECT * FROM place_year_rows
+ORDER BY place_id, year;
@@ -0,0 +1,46 @@
+-- Persons named in translations: main authors, translators and contributors, for the person
+-- filters and the autocomplete in verden_pa_norsk.persons. Run after search_index.sql, which
+-- defines search_fold.
+
+-- A name is keyed by its folded words in "first last" order, so "Hamsun, Knut" and "Knut Hamsun"
+-- are the same person. Must match verden_pa_norsk.persons.person_key.
+CREATE OR REPLACE MACRO person_key(name) AS trim(regexp_replace(search_fold(
+    CASE WHEN contains(name, ',') THEN substr(name, strpos(name, ',') + 1) || ' ' || split_part(name, ',', 1) ELSE name END
+), '[^\p{L}\p{N}]+', ' ', 'g'));
+
+-- names per book and role, of a translations table, also run by verden_pa_norsk.refresh on the
+-- changed translations only
+CREATE OR REPLACE MACRO person_name_rows(source) AS TABLE
+WITH source_rows AS (
+    FROM query_table(source)
+), names AS (
+    SELECT mmsid, 'author' AS role, main_author AS name FROM source_rows
+    UNION ALL SELECT mmsid, 'translator', unnest(translators) FROM source_rows
+    UNION ALL SELECT mmsid, 'contributor', unnest(contributors) FROM source_rows
+)
+SELECT DISTINCT mmsid, role, name, person_key(name) AS key
+FROM names
+WHERE name IS NOT NULL AND person_key(name) <> '';
+
+CREATE OR REPLACE TEMP TABLE person_names AS FROM person_name_rows('translations');
+
+-- one row per person, named by the most frequent spelling, with the number of books per role
+CREATE OR REPLACE TABLE persons AS
+SELECT row_number() OVER (ORDER BY key) - 1 AS person_id, key, mode(name) AS name,
+    count(DISTINCT mmsid) FILTER (WHERE role = 'author') AS author_books,
+    count(DISTINCT mmsid) FILTER (WHERE role = 'translator') AS translator_books,
+    count(DISTINCT mmsid) FILTER (WHERE role = 'contributor') AS contributor_books
+FROM person_names
+GROUP BY key
+ORDER BY person_id;
+
+-- ordered by person, so a lookup of a few persons reads few row groups
+CREATE OR REPLACE TABLE person_books AS
+SELECT DISTINCT p.person_id, n.role, n.mmsid
+FROM person_names n
+JOIN persons p USING (key)
+ORDER BY p.person_id, n.role, n.mmsid;
+
+CREATE INDEX _person_books_person_id_ ON person_books(person_id);
+
+DROP TABLE person_names;
@@ -0,0 +1,108 @@
+-- Incremental update of the derived tables, run by verden_pa_norsk.refresh after the changed
+-- rows of the source tables are applied. The temp table changed holds the mmsids inserted,
+-- updated or deleted in translations, urn_mmsid or ol_first_editions. Their rows are deleted
+-- from the derived tables and computed again by the table macros of derived.sql,
+-- search_index.sql and persons.sql, from their current translations only. New rows get ids
+-- after the existing ones, so the ids of the other rows stay the same; a full build puts them
+-- back in year, quadkey and name order.
+
+CREATE OR REPLACE TEMP TABLE changed_translations AS
+SELECT * FROM translations WHERE mmsid IN (SELECT mmsid FROM changed);
+
+DELETE FROM books WHERE mmsid IN (SELECT mmsid FROM changed);
+INSERT INTO books
+SELECT *, (SELECT coalesce(max(book_id), 0) FROM books)
+    + row_number() OVER (ORDER BY publication_year_int, mmsid, urn, publish_year) AS book_id
+FROM book_rows('changed_translations')
+ORDER BY book_id;
+
+-- places no longer in use are kept, with no books, so place ids stay dense
+INSERT INTO places
+SELECT (SELECT coalesce(max(place_id), -1) FROM places)
+    + row_number() OVER (ORDER BY quadkey, address, latitude, longitude) AS place_id, address, latitude, longitude, quadkey
+FROM (
+    SELECT address, latitude, longitude, tile_quadkey(tile_x(longitude), tile_y(latitude)) AS quadkey
+    FROM (SELECT DISTINCT address, latitude, longitude FROM place_rows WHERE mmsid IN (SELECT mmsid FROM changed)) n
+    WHERE NOT EXISTS (
+        SELECT 1 FROM places p WHERE p.address = n.address AND p.latitude = n.latitude AND p.longitude = n.longitude
+    )
+)
+ORDER BY place_id;
+
+DELETE FROM place_books WHERE mmsid IN (SELECT mmsid FROM changed);
+INSERT INTO place_books
+SELECT * FROM place_book_rows('changed_translations')
+ORDER BY place_id, year, mmsid;
+
+CREATE OR REPLACE TABLE place_year_counts AS
+SELECT * FROM place_year_rows
+ORDER BY place_id, year;
+
+CREATE OR REPLACE TEMP TABLE changed_postings AS
+SELECT * FROM search_posting_rows('changed_translations');
+
+DELETE FROM search_postings WHERE mmsid IN (SELECT mmsid FROM changed);
+INSERT INTO search_postings
+SELECT * FROM changed_postings
+ORDER BY field, term, mmsid;
+
+DELETE FROM search_documents WHERE mmsid IN (SELECT mmsid FROM changed);
+INSERT INTO search_documents
+SELECT * FROM search_document_rows('changed_postings')
+ORDER BY field, mmsid;
+
+CREATE OR REPLACE TABLE search_fields AS
+SELECT * FROM search_field_rows;
+
+CREATE OR REPLACE TEMP TABLE person_names AS
+SELECT * FROM person_name_rows('changed_translations');
+
+-- persons of the changed books before and after the change, whose book counts are counted again
+CREATE OR REPLACE TEMP TABLE changed_persons AS
+SELECT person_id FROM person_books WHERE mmsid IN (SELECT mmsid FROM changed);
+
+-- new persons are named by their most frequent spelling in the change, and keep that name. Persons
+-- no longer named are kept, with no books, so person ids stay dense.
+INSERT INTO persons
+SELECT (SELECT coalesce(max(person_id), -1) FROM persons) + row_number() OVER (ORDER BY key) AS person_id,
+    key, name, 0 AS author_books, 0 AS translator_books, 0 AS contributor_books
+FROM (
+    SELECT key, mode(name) AS name
+    FROM person_names
+    WHERE key NOT IN (SELECT key FROM persons)
+    GROUP BY key
+)
+ORDER BY person_id;
+
+DELETE FROM person_books WHERE mmsid IN (SELECT mmsid FROM changed);
+INSERT INTO person_books
+SELECT DISTINCT p.person_id, n.role, n.mmsid
+FROM person_names n
+JOIN persons p USING (key)
+ORDER BY p.person_id, n.role, n.mmsid;
+
+INSERT INTO changed_persons
+SELECT p.person_id FROM person_names n JOIN persons p USING (key);
+
+-- counted into a table first, an UPDATE joined to the aggregate directly is much slower
+CREATE OR REPLACE TEMP TABLE changed_person_counts AS
+SELECT a.person_id,
+    count(DISTINCT b.mmsid) FILTER (WHERE b.role = 'author') AS author_books,
+    count(DISTINCT b.mmsid) FILTER (WHERE b.role = 'translator') AS translator_books,
+    count(DISTINCT b.mmsid) FILTER (WHERE b.role = 'contributor') AS contributor_books
+FROM (SELECT DISTINCT person_id FROM changed_persons) a
+LEFT JOIN person_books b ON b.person_id = a.person_id
+GROUP BY a.person_id;
+
+UPDATE persons SET
+    author_books = c.author_books,
+    translator_books = c.translator_books,
+    contributor_books = c.contributor_books
+FROM changed_person_counts c
+WHERE persons.person_id = c.person_id;
+
+DROP TABLE changed_translations;
+DROP TABLE changed_postings;
+DROP TABLE person_names;
+DROP TABLE changed_persons;
+DROP TABLE changed_person_counts;
@@ -12,5 +12,6 @@ CREATE TABLE ol_first_editions(mmsid VARCHAR, work_key VARCHAR, edition_key VARC
 
 CREATE INDEX _mmsid_ ON urn_mmsid(mmsid);
 CREATE INDEX _urn_ ON urn_mmsid(urn);
+CREATE INDEX _ol_mmsid_ ON ol_first_editions(mmsid);
 
 
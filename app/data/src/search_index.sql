@@ -0,0 +1,45 @@
+-- Full-text search index over the free-text fields of translations.
+-- Run after load.sql. Folding must match verden_pa_norsk.search.fold.
+CREATE OR REPLACE MACRO search_fold(s) AS strip_accents(replace(replace(lower(s), 'ø', 'o'), 'æ', 'ae'));
+CREATE OR REPLACE MACRO search_tokens(s) AS list_filter(regexp_split_to_array(search_fold(s), '[^\p{L}\p{N}]+'), t -> t <> '');
+
+-- the tables are filled from table macros, which verden_pa_norsk.refresh also runs on the changed
+-- translations and postings only
+CREATE OR REPLACE MACRO search_posting_rows(source) AS TABLE
+WITH source_rows AS (
+    FROM query_table(source)
+), documents AS (
+    SELECT mmsid, 'title' AS field, title AS text FROM source_rows
+    UNION ALL SELECT mmsid, 'main_author', main_author FROM source_rows
+    UNION ALL SELECT mmsid, 'original_title', original_title FROM source_rows
+    UNION ALL SELECT mmsid, 'publisher', publisher FROM source_rows
+), tokens AS (
+    SELECT field, mmsid, unnest(search_tokens(text)) AS term FROM documents
+)
+SELECT field, term, mmsid, count(*)::INTEGER AS tf
+FROM tokens
+GROUP BY field, term, mmsid;
+
+CREATE OR REPLACE TABLE search_postings AS
+SELECT * FROM search_posting_rows('translations')
+ORDER BY field, term, mmsid;
+
+CREATE OR REPLACE MACRO search_document_rows(source) AS TABLE
+SELECT field, mmsid, sum(tf)::INTEGER AS length
+FROM query_table(source)
+GROUP BY field, mmsid;
+
+CREATE OR REPLACE TABLE search_documents AS
+SELECT * FROM search_document_rows('search_postings')
+ORDER BY field, mmsid;
+
+CREATE OR REPLACE VIEW search_field_rows AS
+SELECT field, count(*) AS n_documents, avg(length) AS avg_length
+FROM search_documents
+GROUP BY field;
+
+CREATE OR REPLACE TABLE search_fields AS
+SELECT * FROM search_field_rows;
+
+CREATE INDEX _search_postings_term_ ON search_postings(term);
+CREATE INDEX _search_documents_mmsid_ ON search_documents(mmsid);
@@ -1,109 +1,237 @@
 import streamlit as st
-import duckdb
-import pandas as pd
-from pandas import DataFrame, Series
+from pandas import DataFrame
+from verden_pa_norsk.catalog import get_available_languages, get_column_names_and_types
+from verden_pa_norsk.database import fetch_all, fetch_arrow
+from verden_pa_norsk.facets import FACETS, LANGUAGE_NAMES, facet_counts, facet_filter
+from verden_pa_norsk.formatting import metadata_link_sql, review_author_sql, review_link_sql, review_title_sql, urn_link_sql
+from verden_pa_norsk.persons import ROLES, person_filter_sql
+from verden_pa_norsk.result_cache import cache_table
+from verden_pa_norsk.search import SEARCH_FIELDS, ranked_hits
+from verden_pa_norsk.streamlit_tools import cache_data, get_person_index, get_review_prefetcher, run_latest, show_export, show_person_suggestions
 from verden_pa_norsk.utils import feltnavn_norsk
 
-db_path = "data/translations_map_data.db"
 table_name = "translations"
+# translations pre-joined with first edition year and URN, built by verden_pa_norsk.build
+search_table = "books"
+PAGE_SIZE = 200
+# seconds between updates of the review counts while they are being fetched
+REVIEW_REFRESH = 2
+# user_inputs key of the selected facet values, see verden_pa_norsk.facets
+FACETS_KEY = "facets"
+facet_titles = {**{name: feltnavn_norsk.get(name, name) for name in FACETS}, "decade": "Tiår"}
 
-@st.cache_data
-def get_column_names_and_types(table_name):
-    with duckdb.connect(db_path, read_only=True) as con:
-        query = f"""
-        SELECT column_name, data_type 
-        FROM information_schema.columns 
-        WHERE table_name = '{table_name}'
-        """
-        return [(row[0], row[1]) for row in con.execute(query).fetchall()]
-
-@st.cache_data
-def get_available_languages():
-    with duckdb.connect(db_path, read_only=True) as con:
-        query = """
-        SELECT DISTINCT l."language_code", l."language_nob" as language 
-        FROM translations t 
-        JOIN languages l ON l.language_code = t.original_language
-        ORDER BY l."language_nob";
-        """
-        return [(row[0], row[1]) for row in con.execute(query).fetchall()]
+# result columns in display order, formatted and named for display
+display_columns = ", ".join([
+    f"{urn_link_sql('urn')} AS urn",
+    *[f'{col} AS "{feltnavn_norsk[col].lower()}"' for col in ('main_author', 'translators', 'title', 'publication_year_int', 'language', 'publisher', 'original_title', 'original_language', 'publish_year', 'ddc800', 'ddc0')],
+    f"{review_link_sql('main_author', 'title', 'publication_year_int')} AS lenker",
+    f"{metadata_link_sql('mmsid')} AS mmsid",
+    # author and title as the Omtaler page gets them from the review link, for prefetching review counts
+    f"replace({review_author_sql('main_author')}, '.', '') AS review_author",
+    f"replace({review_title_sql('title')}, '.', '') AS review_title",
+])
+review_columns = ["review_author", "review_title", feltnavn_norsk["publication_year_int"].lower()]
+# exported columns, with plain values rather than links to the other pages
+export_columns = ", ".join([
+    *[f'{col} AS "{feltnavn_norsk[col].lower()}"' for col in ('main_author', 'translators', 'contributors', 'title', 'subtitle', 'publication_year_int', 'language', 'publisher', 'original_title', 'original_language', 'publish_year', 'ddc', 'ddc800', 'ddc0')],
+    f"{urn_link_sql('urn')} AS urn",
+    "mmsid",
+])
 
 def split(a, n):
     "Split list a into n parts"
     k, m = divmod(len(a), n)
     return (a[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(n))
 
-def switch_author_name(author: str | None) -> str | None:
-    if author is None:
-        return None
+def build_query(user_inputs) -> tuple[str, list]:
+    """Build the filtered result query, returning every column of the search table plus a relevance score"""
+    params = []
+    where_clauses = []
+    text_queries = {}
+
+    for col in user_inputs:
+        _type = user_inputs[col]['type']
+        _input = user_inputs[col]['input']
+
+        if col in SEARCH_FIELDS:
+            text_queries[col] = _input
+            continue
+
+        if col == FACETS_KEY:
+            where_clause, facet_params = facet_filter(_input)
+            if where_clause:
+                where_clauses.append(where_clause)
+                params.extend(facet_params)
+            continue
+
+        if isinstance(_input, list) == False and isinstance(_input, tuple) == False:
+            _input = [_input]
+        
+        if col == 'ddc800' and _input == [True]:
+            where_clause = '(t.ddc800 is true or t.ddc0 is true)'
+        elif col == "contributors" or col == "translators":
+            # books by the persons whose names start with the typed words, see verden_pa_norsk.persons
+            if not _input[0].strip():
+                continue
+            person_ids = get_person_index().match(_input[0], ROLES[col])
+            if person_ids is None:
+                # a name without any words, such as "-", matches no one
+                where_clause = "FALSE"
+            else:
+                where_clause = person_filter_sql("t.mmsid")
+                params.extend([ROLES[col], person_ids.tolist()])
+        elif col == "publication_year_int":
+            where_clause =  f"(t.{col} BETWEEN ? AND ?)"
+            params.extend(list(_input))
+        elif col == "language":
+            if isinstance(_input[0], list):
+                where_clause = f"t.{col} IN (?, ?, ?)"
+                params.extend(_input[0])
+            else:
+                where_clause = f"t.{col} == ?"
+                params.extend(_input)
+        else:
+            where_clause =  '(' + ' OR '.join([f"t.{col} ILIKE ?" for x in _input]) + ')'
+            _input = [f'%{x}%' for x in _input]
+            params.extend(_input)
+    
+        where_clauses.append(where_clause)
+
+    # free-text fields go through the search index and are ranked by relevance
+    hits_query, hits_params = ranked_hits(text_queries)
+    if hits_query:
+        hits_join = f"JOIN ({hits_query}) h ON h.mmsid = t.mmsid"
+        score = "h.score"
+        params = hits_params + params
     else:
-        return " ".join(author.split(", ")[::-1])
+        hits_join = ""
+        score = "0.0"
+
+    where_statement = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
+    query = f"""SELECT t.*, {score} AS score
+        FROM {search_table} t
+        {hits_join}
+        {where_statement}"""
+    return query, params
 
-def remove_subtitle(title: str | None) -> str | None:
-    return title.split(":")[0].strip()
+@cache_data(show_spinner = False)
+def count_query(user_inputs) -> int:
+    query, params = build_query(user_inputs)
+    return fetch_all(f"SELECT count(*) FROM ({query})", params)[0][0]
 
-def sub_space_and_punct(text: str) -> str:
-    return text.replace(".", "").replace(" ", "%20")
+@cache_data(show_spinner = False)
+def get_facets(user_inputs) -> dict[str, list[tuple[str, str, int]]]:
+    "Facet counts over all results, not just the page, see verden_pa_norsk.facets"
+    query, params = build_query(user_inputs)
+    return facet_counts(query, params)
 
-def generate_dhlab_review_link(author: str, title: str, publication_year_int: int) -> str:
-    link = f"Omtaler?author={sub_space_and_punct(author)}&title={sub_space_and_punct(title)}&publication_year={publication_year_int}"
-    return link
+@cache_table
+def run_query(user_inputs, cursor=None, page_size=PAGE_SIZE):
+    """Fetch one page of results, ordered by relevance and then by year
 
-def get_dhlab_review_links(df: DataFrame) -> Series:
-    authors = df["main_author"].apply(switch_author_name)
-    titles = df["title"].apply(remove_subtitle)
-    publication_year_int = df["publication_year_int"]
+    Args:
+        user_inputs (dict): search form input
+        cursor (tuple | None): (score, book_id) of the last row on the previous page, None for the first page
+        page_size (int): maximum number of rows to fetch
 
-    target = pd.concat([authors, titles, publication_year_int], axis=1).dropna()
+    Returns:
+        pa.Table: the page with display columns, plus the score and book_id columns that make up the next cursor
+    """
+    query, params = build_query(user_inputs)
 
-    return target.apply(
-        lambda x: generate_dhlab_review_link(x["main_author"], x["title"], x["publication_year_int"]), axis=1
+    if cursor is None:
+        keyset = ""
+    elif any(col in SEARCH_FIELDS for col in user_inputs):
+        keyset = "WHERE score < ? OR (score = ? AND book_id > ?)"
+        params = params + [cursor[0], cursor[0], cursor[1]]
+    else:
+        # unranked results follow book_id, which is the physical order of the table
+        keyset = "WHERE book_id > ?"
+        params = params + [cursor[1]]
+
+    # only the rows on the page are formatted
+    res = fetch_arrow(
+        f"""SELECT {display_columns}, score, book_id
+        FROM (SELECT * FROM ({query}) {keyset} ORDER BY score DESC, book_id LIMIT {int(page_size)})
+        ORDER BY score DESC, book_id""",
+        params,
     )
+    return res
 
-@st.cache_data(show_spinner = False)
-def run_query(user_inputs):
-    with duckdb.connect(db_path, read_only=True) as con:
-        if len(user_inputs) == 0:
-            query = f"SELECT t.*, ol.publish_year, u.urn FROM {table_name} t LEFT JOIN urn_mmsid u ON u.mmsid = t.mmsid LEFT JOIN ol_first_editions ol ON ol.mmsid = t.mmsid"
-        else:
-            params = []
-            where_clauses = []
-            
-            for col in user_inputs:
-                _type = user_inputs[col]['type']
-                _input = user_inputs[col]['input']
-
-                if isinstance(_input, list) == False and isinstance(_input, tuple) == False:
-                    _input = [_input]
-                
-                if col == 'ddc800' and _input == [True]:
-                    where_clause = '(ddc800 is true or ddc0 is true)'
-                elif col == "contributors" or col == "translators":
-                    where_clause =  '(' + ' OR '.join([f"{col}::varchar ILIKE ?" for x in _input]) + ')'
-                    _input = [f'%{x}%' for x in _input]
-                    params.extend(_input)
-                elif col == "publication_year_int":
-                    where_clause =  f"({col} BETWEEN ? AND ?)"
-                    params.extend(list(_input))
-                elif col == "language":
-                    if isinstance(_input[0], list):
-                        where_clause = f"{col} IN (?, ?, ?)"
-                        params.extend(_input[0])
-                    else:
-                        where_clause = f"{col} == ?"
-                        params.extend(_input)
-                else:
-                    where_clause =  '(' + ' OR '.join([f"{col} ILIKE ?" for x in _input]) + ')'
-                    _input = [f'%{x}%' for x in _input]
-                    params.extend(_input)
-            
-                where_clauses.append(where_clause)
-            
-            where_statement = " AND ".join(where_clauses)
-            query = f"SELECT t.*, ol.publish_year, u.urn FROM {table_name} t LEFT JOIN urn_mmsid u ON u.mmsid = t.mmsid LEFT JOIN ol_first_editions ol ON ol.mmsid = t.mmsid WHERE {where_statement}"
+def export_rows(user_inputs) -> tuple[str, list]:
+    "Query for every result, in the order they are shown, for export"
+    query, params = build_query(user_inputs)
+    # unranked results are already in book_id order, and sorting the whole catalog would hold it in memory
+    order = " ORDER BY score DESC, book_id" if any(col in SEARCH_FIELDS for col in user_inputs) else ""
+    return f"SELECT {export_columns} FROM ({query}){order}", params
+
+def page_cursor(res: DataFrame) -> tuple:
+    "Keyset cursor pointing past the last row of a page"
+    last = res.iloc[-1]
+    return float(last["score"]), int(last["book_id"])
+
+def facet_label(name: str, value: str, label: str) -> str:
+    if name == "decade":
+        return f"{value}-tallet"
+    if name == "language":
+        return LANGUAGE_NAMES.get(value, value)
+    if name in ("ddc800", "ddc0"):
+        return "ja" if value == "true" else "nei"
+    return label
+
+def show_facets(facets: dict, selected: dict) -> dict:
+    """Facet values as toggles, returning the selected values per facet"""
+    new_selected = {}
+    with st.expander("Avgrens søket", expanded=bool(selected)):
+        stcols = st.columns(3)
+        for i, (name, values) in enumerate(facets.items()):
+            # selected values stay visible, also when the other filters leave none of them
+            options = {value: f"{facet_label(name, value, label)} ({n})" for value, label, n in values}
+            options.update({value: facet_label(name, value, value) for value in selected.get(name, []) if value not in options})
+            with stcols[i % 3]:
+                new_selected[name] = st.pills(
+                    facet_titles[name],
+                    options.keys(),
+                    selection_mode="multi",
+                    default=selected.get(name, []),
+                    format_func=options.get,
+                    key=f"facet_{name}",
+                )
+    return {name: values for name, values in new_selected.items() if values}
 
-        res = con.execute(query, params).df()
-        return res
+def show_results(res: DataFrame, books: list[tuple]):
+    """Result table, with review counts filled in as the background prefetch finds them"""
+    prefetcher = get_review_prefetcher()
+    refresh = REVIEW_REFRESH if prefetcher.pending(books) else None
+    shown_counts = prefetcher.counts(books)
+
+    @st.fragment(run_every=refresh)
+    def results_table():
+        counts = prefetcher.counts(books)
+        table = res.copy()
+        table.insert(table.columns.get_loc("lenker") + 1, "omtaler", counts)
+        st.dataframe(
+            table,
+            hide_index=True,
+            use_container_width=True,
+            column_config={"urn": st.column_config.LinkColumn("urn", display_text="📖"), "lenker": st.column_config.LinkColumn("omtale", display_text="🔍"),
+            "omtaler": st.column_config.NumberColumn("antall omtaler", format="%d", help="Treff i aviser inntil to år etter utgivelse"),
+            "mmsid": st.column_config.LinkColumn("metadata", display_text="📚"), "publikasjonsår oversettelse": st.column_config.NumberColumn(format="%d"), "publikasjonsår originaltittel": st.column_config.NumberColumn(format="%d")},
+        )
+        # a full rerun stops the timer once every fetch is done. Failed books are not queued again
+        # by the rerun, see ReviewPrefetcher, and without new counts there is nothing to rerun for.
+        if refresh and not prefetcher.pending(books) and counts != shown_counts:
+            st.rerun()
+
+    results_table()
+
+def search_person(col: str, name: str):
+    "Search again with a name chosen among the suggestions"
+    inputs = dict(st.session_state.boksok_inputs)
+    inputs[col] = {**inputs[col], "input": name}
+    st.session_state.boksok_inputs = inputs
+    st.session_state.boksok_facets = {}
+    st.session_state.boksok_cursors = [None]
 
 def main():
     st.set_page_config(
@@ -158,35 +286,58 @@ def main():
         submitted = st.form_submit_button("Søk")
 
     if submitted:
-        res = run_query(user_inputs)
-        if len(res) > 0:
-            # apply mapping
-            try:
-                res["links"] = get_dhlab_review_links(res)
-            except:
-                res["links"] = ""
+        # a new search starts over at the first page, without facet filters
+        st.session_state.boksok_inputs = user_inputs
+        st.session_state.boksok_facets = {}
+        st.session_state.boksok_cursors = [None]
 
-            res.urn = res.urn.apply(lambda x: f"https://urn.nb.no/{x}" if x else None)
+    if "boksok_inputs" not in st.session_state:
+        return
 
-            res.columns = [feltnavn_norsk[x].lower() for x in res.columns]
+    for col in ("main_author", "translators"):
+        if col in st.session_state.boksok_inputs:
+            show_person_suggestions(col, ROLES[col], f"Forslag til {feltnavn_norsk[col].lower()}", on_select=lambda name, col=col: search_person(col, name))
 
-            res["mmsid"] = res["mmsid"].apply(lambda x: f"Metadata?mmsid={x}")
+    selected = st.session_state.boksok_facets
+    user_inputs = st.session_state.boksok_inputs
+    if selected:
+        user_inputs = {**user_inputs, FACETS_KEY: {"input": selected, "type": "FACETS"}}
+    cursors = st.session_state.boksok_cursors
+    page = len(cursors) - 1
 
-            col_order = ['urn', 'forfatter', 'oversetter', 'oversatt tittel', 'publikasjonsår oversettelse', 'målform', 'norsk forlag', 'originaltittel', "originalspråk", "publikasjonsår originaltittel", 'ddc800', 'ddc0', 'lenker', 'mmsid']
+    # a new search or page while these run interrupts them, see verden_pa_norsk.executor
+    total = run_latest(count_query, user_inputs)
+    res = run_latest(run_query, user_inputs, cursors[page]).to_pandas()
 
-            res = res[col_order]
+    new_selected = show_facets(run_latest(get_facets, user_inputs), selected)
+    if new_selected != selected:
+        st.session_state.boksok_facets = new_selected
+        st.session_state.boksok_cursors = [None]
+        st.rerun()
 
-            # sort by year
-            res = res.sort_values(by="publikasjonsår oversettelse")
+    if len(res) > 0:
+        next_cursor = page_cursor(res)
+        books = list(res[review_columns].itertuples(index=False, name=None))
+        get_review_prefetcher().submit(books)
+        res = res.drop(columns=["score", "book_id", "review_author", "review_title"])
 
-            st.write(f"Antall treff: {len(res)}")
-            st.dataframe(
-                res,
-                hide_index=True,
-                use_container_width=True,
-                column_config={"urn": st.column_config.LinkColumn("urn", display_text="📖"), "lenker": st.column_config.LinkColumn("omtale", display_text="🔍"),
-                "mmsid": st.column_config.LinkColumn("metadata", display_text="📚"), "publikasjonsår oversettelse": st.column_config.NumberColumn(format="%d"), "publikasjonsår originaltittel": st.column_config.NumberColumn(format="%d")},
-            )
+        first_row = page * PAGE_SIZE + 1
+        st.write(f"Antall treff: {total}. Viser {first_row}–{first_row + len(res) - 1}.")
+        show_results(res, books)
+
+        prev_col, next_col, _ = st.columns([1, 1, 8])
+        with prev_col:
+            if st.button("Forrige side", disabled=page == 0):
+                cursors.pop()
+                st.rerun()
+        with next_col:
+            if st.button("Neste side", disabled=first_row + len(res) > total):
+                cursors.append(next_cursor)
+                st.rerun()
+
+        show_export(*export_rows(user_inputs), name="boksok", key="boksok_export")
+    else:
+        st.write("Antall treff: 0")
 
 if __name__ == "__main__":
     main()
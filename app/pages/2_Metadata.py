@@ -1,16 +1,21 @@
-from verden_pa_norsk.streamlit_tools import load_database
+import re
+from verden_pa_norsk.metadata import MAX_MMSIDS, compare
+from verden_pa_norsk.streamlit_tools import get_metadata_service
 from verden_pa_norsk.utils import feltnavn_norsk, feltnavn_ol_norsk
 import streamlit as st
 from pandas import DataFrame
 
 
-def get_book_data(mmsid: str) -> tuple[DataFrame, DataFrame]:
-    con = load_database("data/translations_map_data.db")
-    tr_query = f"SELECT * FROM translations tr WHERE tr.mmsid = '{mmsid}'"
-    ol_query = f"SELECT * FROM ol_first_editions ol WHERE ol.mmsid = '{mmsid}'"
+def parse_mmsids(text: str) -> list[str]:
+    "One or more mmsids, separated by commas or whitespace"
+    return [mmsid for mmsid in re.split(r"[\s,;]+", text) if mmsid]
 
-    tr_data = con.sql(tr_query).df().transpose()
-    ol_data = con.sql(ol_query).df().transpose()
+
+def get_book_data(mmsids: list[str]) -> tuple[DataFrame, DataFrame]:
+    """Translation and Open Library metadata for books side by side, one column per record"""
+    books = get_metadata_service().get_books(mmsids)
+    tr_data = compare({mmsid: tr for mmsid, (tr, _) in books.items()})
+    ol_data = compare({mmsid: ol for mmsid, (_, ol) in books.items()})
     return tr_data, ol_data
 
 
@@ -18,15 +23,20 @@ def main():
     st.set_page_config(page_title="Metadata", page_icon="📚", layout="wide")
 
     if st.query_params:
-        mmsid = st.query_params["mmsid"]
+        mmsid = ", ".join(st.query_params.get_all("mmsid"))
     else:
         mmsid = "991418780884702201"
 
     st.title("Metadata")
 
-    mmsid = st.text_input("Oppgi MMSID", value=mmsid)
+    mmsid = st.text_input("Oppgi MMSID", value=mmsid, help="Skill flere MMSID-er med komma for å sammenligne utgaver")
+
+    mmsids = list(dict.fromkeys(parse_mmsids(mmsid)))
+    if len(mmsids) > MAX_MMSIDS:
+        st.warning(f"Viser de første {MAX_MMSIDS} av {len(mmsids)} MMSID-er.")
+        mmsids = mmsids[:MAX_MMSIDS]
 
-    tr_data, ol_data = get_book_data(mmsid)
+    tr_data, ol_data = get_book_data(mmsids)
 
     tr_data.index = [feltnavn_norsk[x] for x in tr_data.index]
     ol_data.index = [feltnavn_ol_norsk[x] for x in ol_data.index]
@@ -1,24 +1,11 @@
 import streamlit as st
-import requests
-import bs4
 import pandas as pd
 import urllib
-from verden_pa_norsk.review_corpus.dhlab_review import get_reviews
+from verden_pa_norsk.nb_api import MAX_PAGES, PAGE_SIZE
+from verden_pa_norsk.reviews import get_cached_reviews
+from verden_pa_norsk.streamlit_tools import get_review_cache
 
 
-def parse_and_unwrap_html(html_snippet):
-    """Only look for <em> elements when parsing HTML, discard all others"""
-    try:
-        soup = bs4.BeautifulSoup(html_snippet, "html.parser")
-        for tag in soup.find_all(True):
-            if tag.name != 'em':
-                tag.unwrap()
-            else:
-                tag.name = 'strong'
-        return str(soup)
-    except:
-        return ""
-
 def get_nb_search_url(author, title, publication_year):
     query_string = urllib.parse.quote(f"«{author} {title}»~100")
     from_date = str(publication_year) + "0101"
@@ -26,40 +13,26 @@ def get_nb_search_url(author, title, publication_year):
     url = f"https://www.nb.no/search?q={query_string}&mediatype=aviser&fromDate={from_date}&toDate={to_date}"
     return url
 
-def get_reviews_nb(author, title, publication_year):
-    query_string = f"«{author} {title}»~100"
-    from_date = str(publication_year) + "0101"
-    to_date = str(publication_year + 2) + "1231"
-    base_url = f"https://api.nb.no/catalog/v1/items?q={query_string}&filter=mediatype:aviser&filter=contentClasses:jp2&filter=date:[{from_date}%20TO%20{to_date}]&aggs=mediatype&aggs=year:9999&aggs=county&snippets=aviser&fragments=2&fragSize=500&size=100&profile=nbdigital"
-    r = requests.get(base_url)
-    rows = []
-    obj = r.json()
-
-    if '_embedded' in obj:
-        if 'items' in obj["_embedded"]:
-            for item in obj["_embedded"]["items"]:
-                urn = item["metadata"]["identifiers"]["urn"]
-                title = item["metadata"]["title"]
-                timestamp = item["metadata"]["originInfo"]["issued"]
-                if "contentFragments" in item:
-                    text = item["contentFragments"][0]["text"]
-                    text = parse_and_unwrap_html(text)
-                    pagenumber = item["contentFragments"][0]["pageNumber"]
-                    url = f"https://www.nb.no/items/{urn}?searchText={query_string}&page={pagenumber}"
-                    row = [url, title, timestamp, text]
-                    rows.append(row)
-                else:
-                    text = ""
-                    url = f"https://www.nb.no/items/{urn}?searchText={query_string}"
-                    row = [url, title, timestamp, text]
-                    rows.append(row)
+def show_reviews(res, nb_search_url, total=None):
+    """Render review rows. total is the number of hits in the API, None if it is not known."""
+    if len(res) > 0:
+        res = res.copy()
+        res.columns = ["URL", "avistittel", "dato", "treff"]
+        res = res.sort_values(by="dato")
+        res["dato"] = res["dato"].apply(lambda x: f"{str(x)[6:8]}.{str(x)[4:6]}.{str(x)[:4]}")
+        res["URL"] = res["URL"].apply(lambda x: f"<a href='{x}'>URL</a>")
+
+        if total is None and len(res) >= MAX_PAGES * PAGE_SIZE:
+            st.markdown(f"Fant mer enn {str(len(res))} resultater. [Gå til Nettbiblioteket for å vise mer.]({nb_search_url}).")
+        elif total is not None and len(res) < total:
+            st.markdown(f"Fant {str(total)} resultater, viser {str(len(res))}. [Gå til Nettbiblioteket for å vise alle.]({nb_search_url}).")
+        else:
+            st.write("Fant", str(len(res)), "resultater:")
 
-    df = pd.DataFrame(rows)
-    return df
+        st.write(res.to_html(escape=False, index=False), unsafe_allow_html=True)
 
-@st.cache_data
-def get_cached_reviews(author, title, publication_year):
-    return get_reviews_nb(author, title, publication_year)
+    else:
+        st.write("Fant ingen potensielle omtaler.")
 
 def app():
     # Set page configuration
@@ -91,24 +64,19 @@ def app():
 
     # Fetch reviews
     if author and title and publication_year:
-        res = get_cached_reviews(author, title, publication_year)
         nb_search_url = get_nb_search_url(author, title, publication_year)
-
-        if len(res) > 0:
-            res.columns = ["URL", "avistittel", "dato", "treff"]
-            res = res.sort_values(by="dato")
-            res["dato"] = res["dato"].apply(lambda x: f"{str(x)[6:8]}.{str(x)[4:6]}.{str(x)[:4]}")
-            res["URL"] = res["URL"].apply(lambda x: f"<a href='{x}'>URL</a>")
-
-            if len(res) < 100:
-                st.write("Fant", str(len(res)), "resultater:")
-            else:
-                st.markdown(f"Fant mer enn {str(len(res))} resultater. [Gå til Nettbiblioteket for å vise mer.]({nb_search_url}).")
-
-            st.write(res.to_html(escape=False, index=False), unsafe_allow_html=True)
-
-        else:
-            st.write("Fant ingen potensielle omtaler.")
+        placeholder = st.empty()
+
+        # result pages are shown as they arrive
+        def on_page(rows, total):
+            with placeholder.container():
+                show_reviews(pd.DataFrame(rows), nb_search_url, total)
+
+        rows, total, complete = get_cached_reviews(get_review_cache(), author, title, publication_year, on_page=on_page)
+        with placeholder.container():
+            if not complete:
+                st.warning("Noen resultatsider kunne ikke hentes fra Nettbiblioteket, så listen er ufullstendig. Prøv igjen senere.")
+            show_reviews(pd.DataFrame(rows), nb_search_url, total)
 
 if __name__ == "__main__":
     app()
@@ -1,91 +1,122 @@
 import pandas as pd
+import pyarrow as pa
 import folium
-from folium.plugins import Fullscreen, FastMarkerCluster, MarkerCluster
-import duckdb
+from folium.plugins import Fullscreen
 import streamlit as st
 from streamlit_folium import st_folium
-
-# Constants
-DDB_CONNECTION = "data/translations_map_data.db"
-
-@st.cache_data
+from verden_pa_norsk.database import fetch_arrow, fetch_df
+from verden_pa_norsk.executor import DEBOUNCE
+from verden_pa_norsk.formatting import metadata_link_sql, openlibrary_link_sql
+from verden_pa_norsk.geo import WORLD_BOUNDS, cluster_places
+from verden_pa_norsk.persons import person_filter_sql
+from verden_pa_norsk.result_cache import cache_table
+from verden_pa_norsk.streamlit_tools import cache_data, get_person_index, get_place_cube, run_latest, show_export, show_person_suggestions
+
+DEFAULT_CENTER = [10, 150]
+DEFAULT_ZOOM = 2
+
+@cache_data
 def query_builder(address="", publication_year=(1800,2024), author="", translator=""):
     params = []
 
     if address:
-        address_cond = "address = ?"
+        address_cond = "ol.address = ?"
         params.append(address)
     else:
-        address_cond = "address IS NOT NULL"
+        address_cond = "ol.address IS NOT NULL"
 
     params.extend([publication_year[0], publication_year[1]])
 
     where_clause = f"""WHERE ({address_cond}) AND (tr.ddc800 IS TRUE OR tr.ddc0 IS TRUE)
             AND (tr.publication_year_int BETWEEN ? AND ?)"""
     
-    if author:
-        author = f"%{author}%"
-        where_clause += " AND (tr.main_author ILIKE ?)"
-        params.append(author)
-
-    if translator:
-        translator = f"%{translator}%"
-        where_clause += " AND (tr.translators::varchar ILIKE ?)"
-        params.append(translator)
+    # books by the persons whose names start with the typed words, see verden_pa_norsk.persons
+    for role, name in (("author", author), ("translator", translator)):
+        if not name or not name.strip():
+            continue
+        person_ids = get_person_index().match(name, role)
+        if person_ids is None:
+            # a name without any words, such as "-", matches no one
+            where_clause += " AND FALSE"
+        else:
+            where_clause += f" AND {person_filter_sql('tr.mmsid')}"
+            params.extend([role, person_ids.tolist()])
 
     return where_clause, params
 
-@st.cache_data
-def load_city_data(where_clause, params) -> pd.DataFrame:
-    ddb = duckdb.connect(DDB_CONNECTION, read_only=True)
-
-    city_count_data = ddb.sql(
+@cache_table
+def load_city_data(where_clause, params) -> pa.Table:
+    city_count_data = fetch_arrow(
         f"""SELECT ol.address,
                 ol.latitude,
                 ol.longitude,
+                p.quadkey,
                 COUNT(ol.mmsid) AS books_published
             FROM ol_first_editions ol
             JOIN translations tr ON ol.mmsid = tr.mmsid
+            JOIN places p ON p.address = ol.address AND p.latitude = ol.latitude AND p.longitude = ol.longitude
             {where_clause}
-            GROUP BY address,
-                    latitude,
-                    longitude
+            GROUP BY ol.address,
+                    ol.latitude,
+                    ol.longitude,
+                    p.quadkey
                 ORDER BY books_published DESC
         """,
-    params=params).df()
+    params)
 
     # city_count_data = ddb.execute("SELECT * FROM city_count").df()
     return city_count_data
 
 
-@st.cache_resource
-def create_map(where_clause, params) -> folium.Map:
-    data = load_city_data(where_clause, params)
-
-    folium_map = folium.Map(location=[10, 150], zoom_start=2)
-
-    marker_cluster = MarkerCluster(
-        name='Clustered books',
-        overlay=True,
-        control=False,
-        icon_create_function=None
-    )
-
-    # Add points to the map with CircleMarker
-    for idx, row in data.iterrows():
-        marker = folium.Marker(location=[row["latitude"], row["longitude"]], tooltip=row["address"])
-        marker_cluster.add_child(marker)
-
-    marker_cluster.add_to(folium_map)
+def create_map() -> folium.Map:
+    """Base map without markers. Markers are sent as a separate layer, so panning and filtering
+    update the markers without rendering the map again."""
+    folium_map = folium.Map(location=DEFAULT_CENTER, zoom_start=DEFAULT_ZOOM)
     fullscreen = Fullscreen()
     fullscreen.add_to(folium_map)
 
     return folium_map
 
 
-def get_address_books(where_clause, params) -> pd.DataFrame:
-    ddb = duckdb.connect(DDB_CONNECTION, read_only=True)
-    query = f"""SELECT ol.mmsid,
+def create_cluster_layer(clusters: pd.DataFrame) -> folium.FeatureGroup:
+    layer = folium.FeatureGroup(name="Clustered books", control=False)
+
+    for row in clusters.itertuples(index=False):
+        location = [row.latitude, row.longitude]
+        if row.address is not None:
+            marker = folium.Marker(location=location, tooltip=row.address)
+        else:
+            size = 30 + 6 * len(str(row.places))
+            icon = folium.DivIcon(
+                html=f"""<div style="width:{size}px;height:{size}px;line-height:{size}px;border-radius:50%;
+                    background:rgba(110,204,57,0.8);text-align:center;font:12px sans-serif;">{row.places}</div>""",
+                icon_size=(size, size),
+                icon_anchor=(size // 2, size // 2),
+            )
+            marker = folium.Marker(location=location, icon=icon, tooltip=f"{row.places} steder, {row.books_published} bøker")
+        layer.add_child(marker)
+
+    return layer
+
+
+def map_view(output: dict) -> dict | None:
+    "Zoom level and bounds of the map as reported by the browser"
+    bounds = output.get("bounds")
+    if not bounds or bounds["_southWest"]["lat"] is None:
+        return None
+    south_west, north_east = bounds["_southWest"], bounds["_northEast"]
+    return {
+        "zoom": output["zoom"],
+        "bounds": (
+            (round(south_west["lat"], 4), round(south_west["lng"], 4)),
+            (round(north_east["lat"], 4), round(north_east["lng"], 4)),
+        ),
+    }
+
+
+def address_books_query(where_clause, links=True) -> str:
+    "Books published at an address. Without links, the mmsid is given as is, for export."
+    return f"""SELECT {metadata_link_sql('ol.mmsid') if links else 'ol.mmsid'} AS mmsid,
                         ol.title as originaltittel,
                         tr.title as tittel,
                         tr.subtitle as undertittel,
@@ -96,25 +127,17 @@ def get_address_books(where_clause, params) -> pd.DataFrame:
                         ol.publish_places_all as publikasjonssteder_alle,
                         ol.publish_places publikasjonssteder,
                         ol.address as adresse,
-                        ol.work_key as verksnøkkel,
+                        {openlibrary_link_sql('ol.work_key')} as verksnøkkel,
                 FROM ol_first_editions ol
                 JOIN translations tr ON ol.mmsid = tr.mmsid
                 {where_clause}
             """
 
-    books_data = ddb.sql(query, params=params).df()
-    books_data["mmsid"] = books_data["mmsid"].apply(
-        lambda x: f"Metadata?mmsid={x}"
-    )
-    books_data["verksnøkkel"] = books_data["verksnøkkel"].apply(
-        lambda x: f"https://www.openlibrary.org{x}"
-    )
-    return books_data
 
+def get_address_books(where_clause, params) -> pd.DataFrame:
+    books_data = fetch_df(address_books_query(where_clause), params)
+    return books_data
 
-@st.cache_resource
-def connect_to_ddb():
-    return duckdb.connect(DDB_CONNECTION, read_only=True)
 
 def main():
     st.set_page_config(page_title="Kart", page_icon="📚", layout="wide")
@@ -124,24 +147,61 @@ def main():
     col1, col2 = st.columns(2)
 
     with col1:
-        author = st.text_input("Forfatter")
+        author = st.text_input("Forfatter", key="kart_author")
+        show_person_suggestions("kart_author", "author", "Forslag til forfatter")
     with col2:
-        translator = st.text_input("Oversetter")
+        translator = st.text_input("Oversetter", key="kart_translator")
+        show_person_suggestions("kart_translator", "translator", "Forslag til oversetter")
 
-    where_clause, params = query_builder(publication_year=publication_year, author=author, translator=translator)
+    # the year range alone is answered by the precomputed cube, author and translator need the live query
+    use_cube = not author and not translator
+    if use_cube:
+        data = get_place_cube().city_data(publication_year)
+    else:
+        where_clause, params = query_builder(publication_year=publication_year, author=author, translator=translator)
+        # dragging the slider or typing reruns the page, only the query for the settled input runs
+        data = run_latest(load_city_data, where_clause, params, debounce=DEBOUNCE).to_pandas()
 
-    map = create_map(where_clause, params)
+    # only the clusters in the current view are sent to the browser
+    view = st.session_state.setdefault("kart_view", {"zoom": DEFAULT_ZOOM, "bounds": WORLD_BOUNDS})
+    clusters = cluster_places(data, view["zoom"], view["bounds"])
 
+    focus = st.session_state.get("kart_focus", {})
     output = st_folium(
-        map, width=2000, height=600, returned_objects=["last_object_clicked_tooltip"]
+        create_map(),
+        key="kart",
+        width=2000,
+        height=600,
+        center=focus.get("center"),
+        zoom=focus.get("zoom"),
+        feature_group_to_add=create_cluster_layer(clusters),
+        returned_objects=["last_object_clicked", "last_object_clicked_tooltip", "bounds", "zoom"],
     )
     # folium_static(map)
 
+    new_view = map_view(output)
+    if new_view and new_view != view:
+        st.session_state.kart_view = new_view
+        st.rerun()
+
     address = output["last_object_clicked_tooltip"]
+    clicked = output["last_object_clicked"]
+
+    if address and address not in set(data["address"]):
+        # a cluster was clicked, zoom in on it
+        address = None
+        if clicked and clicked != st.session_state.get("kart_clicked"):
+            st.session_state.kart_clicked = clicked
+            st.session_state.kart_focus = {"center": [clicked["lat"], clicked["lng"]], "zoom": view["zoom"] + 2}
+            st.rerun()
 
     if address:
-        where_clause, params = query_builder(address=address, publication_year=publication_year, author=author, translator=translator)
-        df = get_address_books(where_clause, params)
+        if use_cube:
+            mmsids = get_place_cube().address_mmsids(address, publication_year)
+            where_clause, params = "WHERE ol.address = ? AND ol.mmsid IN (SELECT unnest(?::VARCHAR[]))", [address, mmsids]
+        else:
+            where_clause, params = query_builder(address=address, publication_year=publication_year, author=author, translator=translator)
+        df = run_latest(get_address_books, where_clause, params)
         col_order = ['mmsid', 'forfatter', 'tittel', 'originaltittel', 'publikasjonsår', 'publikasjonssteder_alle', 'publikasjonssteder', 'forlag' ,'bidragsytere', 'undertittel', 'adresse', 'verksnøkkel']
 
         df = df[col_order]
@@ -155,6 +215,7 @@ def main():
                 "verksnøkkel": st.column_config.LinkColumn("verksnøkkel"),
             },
         )
+        show_export(address_books_query(where_clause, links=False), params, name="kart", key="kart_export")
 
 if __name__ == "__main__":
     main()
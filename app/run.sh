@@ -1 +1 @@
-python -m streamlit run Hjem.py
+python -m verden_pa_norsk.serve
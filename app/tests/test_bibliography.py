@@ -0,0 +1,261 @@
+"""verden_pa_norsk.bibliography against an in-memory records collection instead of MongoDB"""
+import bisect
+import os
+import random
+
+import duckdb
+import pyarrow.parquet as pq
+import pytest
+from bson import ObjectId
+
+from verden_pa_norsk import bibliography
+from verden_pa_norsk.bibliography import export_bibliography, record_rows, split_ranges
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "src", "schema.sql")
+
+
+class Interrupted(Exception):
+    """The connection was lost while reading a range"""
+
+
+class FakeCursor:
+    def __init__(self, docs: list[dict], fail_after: int | None = None):
+        self.docs = docs
+        self.fail_after = fail_after
+
+    def __iter__(self):
+        for i, doc in enumerate(self.docs):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise Interrupted()
+            yield doc
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    name = "test"
+
+
+class FakeCollection:
+    """The part of a pymongo collection that bibliography uses, for records sorted by _id"""
+    name = "records"
+    database = FakeDatabase()
+
+    def __init__(self, docs: list[dict], seed: int = 0):
+        self.docs = sorted(docs, key=lambda doc: doc["_id"])
+        self.ids = [doc["_id"] for doc in self.docs]
+        self.random = random.Random(seed)
+        # records each find returns before the connection is lost, by the number of the find
+        self.fail_after = {}
+        self.finds = 0
+
+    def aggregate(self, pipeline: list[dict]) -> list[dict]:
+        size = pipeline[0]["$sample"]["size"]
+        return [{"_id": _id} for _id in self.random.sample(self.ids, min(size, len(self.ids)))]
+
+    def find(self, query: dict, projection: dict, sort=None, batch_size=None) -> FakeCursor:
+        assert sort == [("_id", 1)]
+        ids = query.get("_id", {})
+        lo, hi = 0, len(self.ids)
+        if "$gt" in ids:
+            lo = bisect.bisect_right(self.ids, ids["$gt"])
+        if "$gte" in ids:
+            lo = bisect.bisect_left(self.ids, ids["$gte"])
+        if "$lt" in ids:
+            hi = bisect.bisect_left(self.ids, ids["$lt"])
+        # the server-side filter, bibliography.QUERY
+        assert set(query) - {"_id"} == set(bibliography.QUERY)
+        docs = [project(doc, projection) for doc in self.docs[lo:hi] if original_languages(doc)]
+        self.finds += 1
+        return FakeCursor(docs, self.fail_after.get(self.finds))
+
+
+def original_languages(doc: dict) -> list[str]:
+    return [value for field in doc["fields"] for sub in field.get("041", {}).get("subfields", []) for key, value in sub.items() if key == "h"]
+
+
+def project(doc: dict, projection: dict) -> dict:
+    tags = {path.split(".")[1] for path in projection}
+    # fields not projected are left as empty documents, as MongoDB does for paths into arrays
+    return {"_id": doc["_id"], "fields": [{tag: value for tag, value in field.items() if tag in tags} for field in doc["fields"]]}
+
+
+def field(tag: str, subfields: list[tuple[str, str]], ind1: str = " ", ind2: str = " ") -> dict:
+    return {tag: {"ind1": ind1, "ind2": ind2, "subfields": [{code: value} for code, value in subfields]}}
+
+
+def translation(i: int) -> dict:
+    """Record of a translation into Norwegian, in MARC-in-JSON"""
+    fields = [
+        {"001": f"99{i:014d}"},
+        {"008": f"900101s{1950 + i % 70}    no            000 1 nob d"},
+        field("041", [("a", "nob"), ("h", "eng")], "1"),
+        field("082", [("a", "823.914")], "0", "4"),
+        field("100", [("a", f"Forfatter {i},"), ("4", "aut")], "1"),
+        field("240", [("a", f"The Original {i} Story."), ("l", "Norsk")], "1", "0"),
+        field("245", [("a", f"Tittel {i} :"), ("b", "roman /"), ("c", "oversatt av Oversetter")], "1", "0"),
+        field("264", [("a", "Oslo :"), ("b", "Gyldendal,"), ("c", f"{1950 + i % 70}.")], " ", "1"),
+        field("700", [("a", f"Oversetter {i},"), ("e", "oversetter")], "1"),
+    ]
+    if i % 3 == 0:
+        fields.append(field("856", [("u", f"https://urn.nb.no/URN:NBN:no-nb_digibok_{i:013d}"), ("3", "Digital versjon")], "4", "1"))
+    return {"_id": ObjectId(), "leader": "00000cam a2200000 i 4500", "fields": fields}
+
+
+def make_records(n: int) -> list[dict]:
+    """n translations, and records that are not translations into Norwegian"""
+    docs = [translation(i) for i in range(n)]
+    docs += [{"_id": ObjectId(), "fields": [{"001": f"98{i:014d}"}, field("041", [("a", "nob")])]} for i in range(n // 4)]
+    docs += [{"_id": ObjectId(), "fields": [{"001": f"97{i:014d}"}, field("041", [("a", "swe"), ("h", "eng")])]} for i in range(n // 4)]
+    random.Random(1).shuffle(docs)
+    return docs
+
+
+@pytest.fixture
+def collection() -> FakeCollection:
+    return FakeCollection(make_records(400))
+
+
+def exported_mmsids(out_dir: str, table: str = "translations") -> list[str]:
+    return pq.read_table(os.path.join(out_dir, bibliography.OUTPUTS[table][0]), columns=["mmsid"]).column("mmsid").to_pylist()
+
+
+@pytest.mark.parametrize("n", [1, 2, 8, 32])
+def test_split_ranges_cover_every_record_once(collection, n):
+    ranges = split_ranges(collection, n)
+    assert 1 <= len(ranges) <= n
+    assert ranges[0]["lo"] is None and ranges[-1]["hi"] is None
+    for before, after in zip(ranges, ranges[1:]):
+        assert before["hi"] == after["lo"]
+        assert after["lo"] is not None
+    bounds = [state["lo"] for state in ranges[1:]]
+    assert bounds == sorted(set(bounds))
+
+    counts = [0] * len(ranges)
+    for _id in collection.ids:
+        inside = [
+            i for i, state in enumerate(ranges)
+            if (state["lo"] is None or _id >= state["lo"]) and (state["hi"] is None or _id < state["hi"])
+        ]
+        assert len(inside) == 1
+        counts[inside[0]] += 1
+    # quantiles of the sample, so the ranges are about the same size
+    assert min(counts) > 0
+    assert max(counts) < 3 * len(collection.ids) / len(ranges)
+
+
+def test_split_ranges_of_a_small_collection():
+    collection = FakeCollection(make_records(2))
+    ranges = split_ranges(collection, 8)
+    assert ranges[0]["lo"] is None and ranges[-1]["hi"] is None
+    # bounds are distinct _ids
+    assert len(ranges) <= len(collection.ids) + 1
+
+
+def test_export(collection, tmp_path):
+    summary = export_bibliography(collection, str(tmp_path / "out"), str(tmp_path / "work"), workers=2)
+    assert summary["records"] == 500
+    assert summary["row_counts"] == {"translations": 400, "urn_mmsid": 134}
+    mmsids = exported_mmsids(str(tmp_path / "out"))
+    assert mmsids == sorted(f"99{i:014d}" for i in range(400))
+
+
+def test_resume_after_a_finished_part(collection, tmp_path, monkeypatch):
+    monkeypatch.setattr(bibliography, "BATCH_SIZE", 10)
+    monkeypatch.setattr(bibliography, "PART_ROWS", 20)
+    out_dir, work_dir = str(tmp_path / "out"), str(tmp_path / "work")
+    # one worker reads its four ranges in turn, and the connection is lost in the second after 50 records
+    collection.fail_after = {2: 50}
+    with pytest.raises(Interrupted):
+        export_bibliography(collection, out_dir, work_dir, workers=1)
+
+    checkpoint = bibliography.Checkpoint.load(os.path.join(work_dir, bibliography.CHECKPOINT), {
+        "database": "test", "collection": "records", "query": bibliography.QUERY, "tags": list(bibliography.TAGS),
+    })
+    first, second = checkpoint.ranges[:2]
+    assert first["done"] and not second["done"]
+    # two parts of 20 rows were finished before the connection was lost, the third was not
+    assert second["parts"] == 2 and second["rows"] == 40 and second["last_id"] is not None
+
+    # the other ranges were still read
+    assert [state["done"] for state in checkpoint.ranges] == [True, False, True, True]
+
+    collection.fail_after = {}
+    summary = export_bibliography(collection, out_dir, work_dir, workers=1)
+    assert summary["ranges"] == 4 and summary["resumed_ranges"] == 3
+    assert summary["records"] == 500
+    mmsids = exported_mmsids(out_dir)
+    assert len(mmsids) == len(set(mmsids)) == 400
+    assert mmsids == sorted(f"99{i:014d}" for i in range(400))
+    urns = pq.read_table(os.path.join(out_dir, "urn_mmsid.parquet")).to_pylist()
+    assert len(urns) == len({row["urn"] for row in urns}) == 134
+
+    # a complete export is not resumed, but started over
+    collection.finds = 0
+    assert export_bibliography(collection, out_dir, work_dir, workers=1)["resumed_ranges"] == 0
+
+
+def test_record_rows():
+    row, urns = record_rows(translation(3))
+    assert row == {
+        "mmsid": "9900000000000003",
+        "main_author": "Forfatter 3",
+        "contributors": ["Oversetter 3"],
+        "translators": ["Oversetter 3"],
+        "title": "Tittel 3",
+        "subtitle": "roman",
+        "original_title": "The Original 3 Story",
+        "publisher": "Gyldendal",
+        "language": "nob",
+        "original_language": "[eng]",
+        "publication_year_str": "1953",
+        "publication_year_int": 1953,
+        "ddc": [823.914],
+        "ddc800": True,
+        "ddc0": False,
+    }
+    assert urns == [{"urn": "URN:NBN:no-nb_digibok_0000000000003", "mmsid": "9900000000000003"}]
+    # in the order of the columns of translations, see test_rows_match_the_schema
+    assert list(row) == bibliography.TRANSLATIONS_SCHEMA.names
+
+
+def test_record_rows_of_other_records():
+    # no URN
+    row, urns = record_rows(translation(1))
+    assert row["mmsid"] == "9900000000000001" and urns == []
+    # not a translation
+    assert record_rows({"fields": [{"001": "1"}, field("041", [("a", "nob")])]}) == (None, [])
+    # a translation into Swedish
+    assert record_rows({"fields": [{"001": "1"}, field("041", [("a", "swe"), ("h", "eng")])]}) == (None, [])
+    # the language from 008 when 041 has none, the older imprint, several original languages and
+    # a translator named by relator code only
+    row, _ = record_rows({"fields": [
+        {"001": "2"},
+        {"008": "900101s1975    no            000 1 nno d"},
+        field("041", [("h", "eng"), ("h", "ger")], "1"),
+        field("260", [("a", "Oslo :"), ("b", "Samlaget,"), ("c", "cop. 1975.")]),
+        field("700", [("a", "Rowling, J.K."), ("4", "trl")], "1"),
+        field("700", [("a", "Illustratør,"), ("e", "illustratør")], "1"),
+    ]})
+    assert row["language"] == "nno"
+    assert row["original_language"] == "[eng, ger]"
+    assert row["publisher"] == "Samlaget"
+    assert (row["publication_year_str"], row["publication_year_int"]) == ("cop. 1975", 1975)
+    assert row["contributors"] == ["Rowling, J.K.", "Illustratør"]
+    assert row["translators"] == ["Rowling, J.K."]
+    assert (row["ddc"], row["ddc800"], row["ddc0"]) == ([], False, True)
+
+
+def test_rows_match_the_schema(collection, tmp_path):
+    """The exported files load into the tables of schema.sql, as load.sql does"""
+    out_dir = str(tmp_path / "out")
+    export_bibliography(collection, out_dir, str(tmp_path / "work"), workers=2)
+    with duckdb.connect() as con, open(SCHEMA_PATH) as file:
+        con.execute(file.read())
+        for table in bibliography.OUTPUTS:
+            columns = con.execute(f"SELECT column_name FROM (DESCRIBE {table})").fetchall()
+            assert [name for name, in columns] == bibliography.OUTPUTS[table][1].names
+            con.execute(f"COPY {table} FROM '{os.path.join(out_dir, bibliography.OUTPUTS[table][0])}' (FORMAT 'parquet')")
+        assert con.execute("SELECT count(*) FROM translations").fetchone()[0] == 400
+        assert con.execute("SELECT count(*) FROM urn_mmsid JOIN translations USING (mmsid)").fetchone()[0] == 134
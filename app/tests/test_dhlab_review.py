@@ -0,0 +1,86 @@
+"""verden_pa_norsk.review_corpus.dhlab_review with fake dhlab classes instead of the API"""
+import pandas as pd
+import pytest
+
+from verden_pa_norsk.review_corpus import dhlab_review
+
+
+class FakeCorpus:
+    """Corpus of `size` newspapers, counting the corpora built"""
+    built = []
+    size = 50
+
+    def __init__(self, **kwargs):
+        FakeCorpus.built.append(kwargs)
+        self.frame = pd.DataFrame({"urn": [f"URN:NBN:no-nb_digavis_{i}" for i in range(self.size)]})
+
+
+class FakeConcordance:
+    """Concordances with `per_document` hits in each newspaper, recording the chunks requested"""
+    requests = []
+    per_document = 3
+
+    def __init__(self, corpus=None, query=None, window=20, limit=500):
+        FakeConcordance.requests.append(corpus)
+        rows = [(f"link {urn} {i}", urn, f"{query} {i}") for urn in corpus for i in range(min(self.per_document, limit))]
+        self.frame = pd.DataFrame(rows, columns=["link", "urn", "concordance"])
+
+    @classmethod
+    def from_df(cls, df):
+        obj = cls.__new__(cls)
+        obj.frame = df
+        return obj
+
+
+@pytest.fixture(autouse=True)
+def fakes():
+    dhlab_review.build_corpus.cache_clear()
+    FakeCorpus.built.clear()
+    FakeCorpus.size = 50
+    FakeConcordance.requests.clear()
+    FakeConcordance.per_document = 3
+    yield
+    dhlab_review.build_corpus.cache_clear()
+
+
+def get_reviews(*book, **kwargs):
+    return dhlab_review.get_reviews(*book, corpus_cls=FakeCorpus, concordance_cls=FakeConcordance, **kwargs)
+
+
+def test_concordances_are_fetched_in_chunks():
+    concs = get_reviews("Hamsun", "Sult", 1890)
+    assert isinstance(concs, FakeConcordance)
+    assert [len(chunk) for chunk in FakeConcordance.requests] == [20, 20, 10]
+    assert len(concs.frame) == 150
+    assert list(concs.frame.columns) == ["link", "urn", "concordance"]
+
+
+def test_fetching_stops_at_max_hits():
+    corpus = dhlab_review.build_corpus("Hamsun", "Sult", 1890, corpus_cls=FakeCorpus)
+    concs = dhlab_review.get_concs_for_author(corpus, "Sult", "Hamsun", max_hits=70, concordance_cls=FakeConcordance)
+    # 60 hits per chunk, so the third chunk is never requested
+    assert len(FakeConcordance.requests) == 2
+    assert len(concs.frame) == 70
+
+
+def test_empty_corpus():
+    FakeCorpus.size = 0
+    concs = get_reviews("Hamsun", "Sult", 1890)
+    assert FakeConcordance.requests == []
+    assert concs.frame.empty
+
+
+def test_corpus_is_cached_per_book():
+    get_reviews("Hamsun", "Sult", 1890)
+    get_reviews("Hamsun", "Sult", 1890)
+    get_reviews("Undset", "Jenny", 1911)
+    assert [kwargs["from_year"] for kwargs in FakeCorpus.built] == [1890, 1911]
+    assert FakeCorpus.built[0]["to_year"] == 1892
+
+
+def test_corpora_are_built_once_per_book():
+    books = [("Hamsun", "Sult", 1890), ("Undset", "Jenny", 1911), ("Hamsun", "Sult", 1890)]
+    corpora = dhlab_review.build_corpora(books, corpus_cls=FakeCorpus)
+    assert list(corpora) == books[:2]
+    assert len(FakeCorpus.built) == 2
+    assert corpora[books[0]] is dhlab_review.build_corpus(*books[0], corpus_cls=FakeCorpus)
@@ -0,0 +1,120 @@
+"""verden_pa_norsk.executor with a stand-in for the database cursor"""
+import threading
+import time
+
+import pytest
+
+from verden_pa_norsk import executor
+from verden_pa_norsk.executor import QueryExecutor, Superseded
+
+
+class FakeCursor:
+    def __init__(self):
+        self.interrupted = threading.Event()
+
+    def interrupt(self):
+        self.interrupted.set()
+
+
+@pytest.fixture
+def cursors(monkeypatch) -> dict[threading.Thread, FakeCursor]:
+    """One cursor per worker thread, as verden_pa_norsk.database.get_cursor keeps them"""
+    cursors = {}
+
+    def get_runner():
+        return cursors.setdefault(threading.current_thread(), FakeCursor())
+
+    monkeypatch.setattr(executor, "get_runner", get_runner)
+    return cursors
+
+
+def test_worker_threads_are_reused(cursors):
+    queries = QueryExecutor()
+    threads = {queries.run(threading.current_thread) for _ in range(20)}
+    assert len(threads) == 1
+    assert threads == set(cursors)
+    assert threading.current_thread() not in threads
+
+
+def test_context_of_the_caller(cursors):
+    """The context is made on the calling thread, and entered and left around the query on the worker"""
+    session = threading.local()
+    events = []
+
+    class Context:
+        def __init__(self, value):
+            self.value = value
+
+        def __enter__(self):
+            session.value = self.value
+
+        def __exit__(self, *exc):
+            events.append(("left", session.value))
+            session.value = None
+
+    queries = QueryExecutor(context=lambda: Context(threading.current_thread().name))
+    assert queries.run(lambda: session.value) == threading.current_thread().name
+    assert events == [("left", threading.current_thread().name)]
+    # the next session on the same worker thread doesn't see it
+    assert QueryExecutor().run(lambda: session.value) is None
+
+
+def test_newer_run_interrupts_the_older(cursors):
+    queries = QueryExecutor(poll_interval=0.01)
+    started = threading.Event()
+
+    def slow_query():
+        started.set()
+        cursor = cursors[threading.current_thread()]
+        if not cursor.interrupted.wait(5):
+            return "finished"
+        cursor.interrupted.clear()
+        raise RuntimeError("interrupted")
+
+    result = {}
+    older = threading.Thread(target=lambda: result.setdefault("older", _run(queries, slow_query)))
+    older.start()
+    assert started.wait(5)
+    assert queries.run(lambda: "newer") == "newer"
+    older.join(5)
+    assert isinstance(result["older"], RuntimeError)
+
+
+def test_check_gives_up_the_run(cursors):
+    queries = QueryExecutor(poll_interval=0.01)
+    started = threading.Event()
+
+    def slow_query():
+        started.set()
+        cursors[threading.current_thread()].interrupted.wait(5)
+
+    class Rerun(Exception):
+        pass
+
+    def check():
+        if started.is_set():
+            raise Rerun()
+
+    t0 = time.monotonic()
+    with pytest.raises(Rerun):
+        queries.run(slow_query, check=check)
+    assert time.monotonic() - t0 < 2
+    assert any(cursor.interrupted.is_set() for cursor in cursors.values())
+
+
+def test_superseded_while_debouncing(cursors):
+    queries = QueryExecutor(poll_interval=0.01)
+    result = {}
+    waiting = threading.Thread(target=lambda: result.setdefault("first", _run(queries, str, 1, debounce=1)))
+    waiting.start()
+    time.sleep(0.1)
+    assert queries.run(str, 2) == "2"
+    waiting.join(5)
+    assert isinstance(result["first"], Superseded)
+
+
+def _run(queries: QueryExecutor, func, *args, **kwargs):
+    try:
+        return queries.run(func, *args, **kwargs)
+    except Exception as e:
+        return e
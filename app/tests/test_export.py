@@ -0,0 +1,61 @@
+"""verden_pa_norsk.export writers and format fallback, without a database"""
+import csv
+
+import pyarrow as pa
+import pytest
+from openpyxl import load_workbook
+
+from verden_pa_norsk import export
+
+
+def make_reader(n: int, batch_size: int = 1000) -> pa.RecordBatchReader:
+    batches = [
+        pa.record_batch({"mmsid": [str(i) for i in range(lo, min(lo + batch_size, n))], "år": list(range(lo, min(lo + batch_size, n)))})
+        for lo in range(0, n, batch_size)
+    ]
+    return pa.RecordBatchReader.from_batches(pa.schema([("mmsid", pa.string()), ("år", pa.int64())]), batches)
+
+
+@pytest.fixture
+def fake_query(monkeypatch):
+    """export_query on n generated rows instead of a query"""
+    def use_rows(n: int):
+        monkeypatch.setattr(export, "count_rows", lambda query, params: n)
+        monkeypatch.setattr(export, "fetch_batches", lambda query, params, batch_size: make_reader(n, batch_size))
+        monkeypatch.setattr(export, "flat_query", lambda query, params: query)
+    return use_rows
+
+
+def test_xlsx_has_one_sheet(tmp_path):
+    progress = []
+    rows = export.write_xlsx(make_reader(2500), str(tmp_path / "t.xlsx"), progress.append)
+    assert rows == 2500
+    workbook = load_workbook(tmp_path / "t.xlsx", read_only=True)
+    assert workbook.sheetnames == ["Treff"]
+    values = list(workbook["Treff"].values)
+    assert values[0] == ("mmsid", "år")
+    assert values[1:] == [(str(i), i) for i in range(2500)]
+    assert progress[-1] == 2500 and progress == sorted(progress)
+
+
+def test_empty_xlsx(tmp_path):
+    assert export.write_xlsx(make_reader(0), str(tmp_path / "t.xlsx")) == 0
+    assert list(load_workbook(tmp_path / "t.xlsx", read_only=True)["Treff"].values) == [("mmsid", "år")]
+
+
+def test_xlsx_up_to_the_cap(tmp_path, fake_query, monkeypatch):
+    monkeypatch.setattr(export, "XLSX_MAX_ROWS", 3000)
+    fake_query(3000)
+    path, rows = export.export_query("query", [], "xlsx", "t", str(tmp_path))
+    assert path.endswith("-t.xlsx") and rows == 3000
+
+
+def test_large_xlsx_falls_back_to_csv(tmp_path, fake_query, monkeypatch):
+    monkeypatch.setattr(export, "XLSX_MAX_ROWS", 3000)
+    fake_query(3001)
+    progress = []
+    path, rows = export.export_query("query", [], "xlsx", "t", str(tmp_path), on_progress=lambda rows, total: progress.append((rows, total)))
+    assert path.endswith("-t." + export.XLSX_FALLBACK) and rows == 3001
+    with open(path, newline="") as file:
+        assert sum(1 for _ in csv.reader(file)) == 3002
+    assert progress[0] == (0, 3001) and progress[-1] == (3001, 3001)
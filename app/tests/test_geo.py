@@ -0,0 +1,73 @@
+"""verden_pa_norsk.geo clustering, for places at the same coordinates in particular"""
+import math
+
+import pandas as pd
+import pytest
+
+from verden_pa_norsk.geo import CELL_LEVELS, MAX_ZOOM, cluster_places
+
+
+def quadkey(latitude: float, longitude: float) -> int:
+    """Quadkey of the zoom 16 tile of a location, as tile_quadkey in data/src/derived.sql"""
+    x = int((longitude + 180) / 360 * 65536)
+    lat = math.radians(latitude)
+    y = int((0.5 - math.log(math.tan(lat) + 1 / math.cos(lat)) / (2 * math.pi)) * 65536)
+    return sum((((x >> i) & 1) << (2 * i)) + (((y >> i) & 1) << (2 * i + 1)) for i in range(16))
+
+
+def make_places(rows: list[tuple[str, float, float, int]]) -> pd.DataFrame:
+    return pd.DataFrame(
+        [(address, lat, lon, quadkey(lat, lon), books) for address, lat, lon, books in rows],
+        columns=["address", "latitude", "longitude", "quadkey", "books_published"],
+    )
+
+
+@pytest.fixture
+def places() -> pd.DataFrame:
+    return make_places([
+        ("Bogotá", 4.6097, -74.0817, 5),
+        ("Bogotá, Colombia", 4.6097, -74.0817, 3),
+        ("Bogota D.C.", 4.6097, -74.0817, 1),
+        ("Oslo", 59.9133, 10.7389, 20),
+        ("Bergen", 60.3913, 5.3221, 4),
+    ])
+
+
+def clickable(clusters: pd.DataFrame) -> set[str]:
+    """Addresses of the markers that open a book list, each at a position of its own"""
+    markers = clusters[clusters["address"].notna()]
+    assert not markers.duplicated(["latitude", "longitude"]).any()
+    return set(markers["address"])
+
+
+@pytest.mark.parametrize("zoom", [MAX_ZOOM - CELL_LEVELS, MAX_ZOOM, MAX_ZOOM + 2])
+def test_same_coordinates_at_max_zoom(zoom):
+    places = make_places([("Toronto", 43.6535, -79.3839, 2), ("Toronto, Ontario", 43.6535, -79.3839, 7)])
+    clusters = cluster_places(places, zoom)
+    assert clusters["address"].notna().all()
+    assert clickable(clusters) == {"Toronto", "Toronto, Ontario"}
+    assert clusters["books_published"].sum() == 9
+    # close to the common location, within the spread circle
+    assert (clusters["latitude"] - 43.6535).abs().max() < 0.01
+    assert (clusters["longitude"] + 79.3839).abs().max() < 0.01
+
+
+def test_same_coordinates_are_not_clustered(places):
+    """A cell of places at one location is shown as markers at any zoom, as zooming in can not split it"""
+    clusters = cluster_places(places, 10)
+    assert clickable(clusters) == {"Bogotá", "Bogotá, Colombia", "Bogota D.C.", "Oslo", "Bergen"}
+    assert (clusters["places"] == 1).all()
+
+
+def test_clusters_at_low_zoom(places):
+    clusters = cluster_places(places, 2)
+    norway = clusters[clusters["address"].isna()]
+    assert norway["places"].tolist() == [2]
+    assert norway["books_published"].tolist() == [24]
+    assert clickable(clusters) == {"Bogotá", "Bogotá, Colombia", "Bogota D.C."}
+    assert clusters["books_published"].sum() == 33
+
+
+def test_out_of_view():
+    places = make_places([("Toronto", 43.6535, -79.3839, 2), ("Toronto, Ontario", 43.6535, -79.3839, 7)])
+    assert cluster_places(places, MAX_ZOOM, ((50.0, 0.0), (60.0, 10.0))).empty
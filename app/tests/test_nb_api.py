@@ -0,0 +1,166 @@
+"""verden_pa_norsk.nb_api against a local stub of the search endpoint"""
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from verden_pa_norsk import nb_api, reviews
+from verden_pa_norsk.review_cache import ReviewCache
+
+
+class StubAPI(ThreadingHTTPServer):
+    """Search endpoint answering every page with one item, scripted per test"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.total_pages = 1
+        self.pages = []
+        # statuses to answer with before the page itself, such as 429
+        self.failures = []
+        # status of every answer for these pages, such as 503
+        self.failed_pages = {}
+        # seconds to wait before answering
+        self.delay = 0
+        # set by a test to let the pages after the first be answered
+        self.release = threading.Event()
+        self.release.set()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/catalog/v1/items"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        page = int(parse_qs(urlparse(self.path).query)["page"][0])
+        with server.lock:
+            server.pages.append(page)
+            status = server.failures.pop(0) if server.failures else server.failed_pages.get(page, 200)
+        if status != 200:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if page > 0:
+            server.release.wait(5)
+        if server.delay:
+            threading.Event().wait(server.delay)
+        body = json.dumps({
+            "page": {"totalElements": server.total_pages, "totalPages": server.total_pages},
+            "_embedded": {"items": [{"metadata": {
+                "identifiers": {"urn": f"URN:NBN:no-nb_digavis_{page}"},
+                "title": "avis",
+                "originInfo": {"issued": "20200101"},
+            }}]},
+        }).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client timed out
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    server = StubAPI()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(api, **kwargs) -> list:
+    return list(nb_api.iter_reviews("Forfatter", "Tittel", 2000, api_url=api.url, **kwargs))
+
+
+def test_first_page_is_yielded_before_the_rest(api):
+    api.total_pages = 3
+    api.release.clear()
+    reviews = nb_api.iter_reviews("Forfatter", "Tittel", 2000, api_url=api.url)
+    rows, total = next(reviews)
+    assert total == 3
+    assert "_0?" in rows[0][0]
+    # the other pages are held back until the first has been seen
+    api.release.set()
+    rest = list(reviews)
+    assert sorted(rows[0][0] for rows, _ in rest) == sorted(
+        f"https://www.nb.no/items/URN:NBN:no-nb_digavis_{page}?searchText=«Forfatter Tittel»~100" for page in (1, 2)
+    )
+
+
+def test_pages_are_capped(api):
+    api.total_pages = 25
+    pages = fetch(api)
+    assert len(pages) == nb_api.MAX_PAGES
+    assert sorted(api.pages) == list(range(nb_api.MAX_PAGES))
+
+
+def test_single_page(api):
+    assert len(fetch(api)) == 1
+    assert api.pages == [0]
+
+
+def test_rate_limit_is_retried(api):
+    api.failures = [429, 503]
+    (rows, total), = fetch(api)
+    assert total == 1
+    assert api.pages == [0, 0, 0]
+
+
+def test_timeout_is_an_error(api, monkeypatch):
+    monkeypatch.setattr(nb_api, "TIMEOUT", (1, 0.1))
+    api.delay = 0.5
+    with pytest.raises(requests.RequestException):
+        fetch(api)
+    # the first attempt and its retries
+    assert len(api.pages) == 4
+
+
+def test_failed_page_is_left_out(api):
+    api.total_pages = 4
+    api.failed_pages = {2: 503}
+    pages = fetch(api)
+    assert len(pages) == 4
+    assert sum(rows is None for rows, _ in pages) == 1
+    assert sorted(rows[0][0].split("?")[0][-1] for rows, _ in pages if rows) == ["0", "1", "3"]
+    # the failed page and its retries
+    assert api.pages.count(2) == 4
+
+
+def test_partial_result_is_cached_briefly(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(reviews, "iter_reviews", functools.partial(nb_api.iter_reviews, api_url=api.url))
+    cache = ReviewCache(str(tmp_path / "cache.sqlite"), ttl=3600, negative_ttl=60)
+    api.total_pages = 3
+    api.failed_pages = {1: 503}
+    streamed = []
+    rows, total, complete = reviews.get_cached_reviews(
+        cache, "Forfatter", "Tittel", 2000, on_page=lambda rows, total: streamed.append((len(rows), total))
+    )
+    assert (len(rows), total, complete) == (2, 3, False)
+    assert streamed == [(1, 3), (2, 3)]
+    expires, = cache._connection().execute(
+        "SELECT expires FROM reviews WHERE key = ?", (reviews.review_key(cache, "Forfatter", "Tittel", 2000),)
+    ).fetchone()
+    assert expires < time.time() + 61
+
+    # from the cache, still marked as incomplete and with the total
+    api.pages.clear()
+    assert reviews.get_cached_reviews(cache, "Forfatter", "Tittel", 2000) == (rows, 3, False)
+    assert api.pages == []
@@ -0,0 +1,67 @@
+"""verden_pa_norsk.review_cache on a temporary SQLite file"""
+import json
+
+import pytest
+
+from verden_pa_norsk import review_cache
+from verden_pa_norsk.review_cache import ReviewCache
+
+
+@pytest.fixture
+def cache(tmp_path) -> ReviewCache:
+    return ReviewCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+
+
+def table_bytes(cache: ReviewCache) -> int:
+    return cache._connection().execute("SELECT coalesce(sum(size), 0) FROM reviews").fetchone()[0]
+
+
+def test_hit_does_not_write(cache):
+    cache.set("a", [["url", "avis", "20200101", "treff"]])
+    con = cache._connection()
+    changes = con.total_changes
+    assert cache.get("a") == [["url", "avis", "20200101", "treff"]]
+    assert cache.get("b") is None
+    assert con.total_changes == changes
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_access_time_is_updated_when_stale(cache, monkeypatch):
+    cache.set("a", [1])
+    con = cache._connection()
+    con.execute("UPDATE reviews SET accessed = accessed - ?", (review_cache.ACCESS_INTERVAL + 1,))
+    changes = con.total_changes
+    cache.get("a")
+    assert con.total_changes == changes + 1
+
+
+def test_counts_are_flushed_periodically(cache, monkeypatch):
+    monkeypatch.setattr(review_cache, "FLUSH_INTERVAL", 0)
+    cache.get("missing")
+    other = ReviewCache(cache.path)
+    assert other.stats()["misses"] == 1
+
+
+def test_running_size(cache):
+    cache.set("a", ["x" * 100])
+    cache.set("b", ["y" * 200])
+    cache.set("a", ["z" * 50])
+    assert cache.stats()["bytes"] == table_bytes(cache) == len(json.dumps(["z" * 50])) + len(json.dumps(["y" * 200]))
+    # expired entries are dropped by the next write
+    cache.set("c", [], ttl=-1)
+    cache.set("d", [1])
+    assert cache.stats()["bytes"] == table_bytes(cache)
+    # over budget, the least recently used are evicted
+    for key in "efghij":
+        cache.set(key, ["w" * 300])
+    stats = cache.stats()
+    assert stats["bytes"] == table_bytes(cache) <= cache.max_bytes
+    assert stats["evictions"] > 0
+    assert cache.get("j") == ["w" * 300]
+
+
+def test_running_size_of_an_older_file(tmp_path):
+    cache = ReviewCache(str(tmp_path / "cache.sqlite"))
+    cache.set("a", ["x" * 100])
+    cache._connection().execute("DELETE FROM counters WHERE name = 'bytes'")
+    assert ReviewCache(cache.path).stats()["bytes"] == table_bytes(cache)
@@ -0,0 +1,26 @@
+"""verden_pa_norsk.snippets against the golden snippets of the snippet benchmark"""
+import json
+import pathlib
+
+import pytest
+
+from verden_pa_norsk.snippets import sanitize_snippet, sanitize_snippets
+
+GOLDEN_PATH = pathlib.Path(__file__).parent.parent / "benchmarks" / "data" / "nb_snippets.json"
+
+with open(GOLDEN_PATH, encoding="utf-8") as f:
+    GOLDEN = json.load(f)
+
+
+@pytest.mark.parametrize("case", GOLDEN, ids=[case["name"] for case in GOLDEN])
+def test_golden(case):
+    assert sanitize_snippet(case["snippet"]) == case["expected"]
+
+
+def test_batch_matches_single():
+    assert sanitize_snippets(case["snippet"] for case in GOLDEN) == [case["expected"] for case in GOLDEN]
+
+
+def test_none():
+    assert sanitize_snippet(None) == ""
+
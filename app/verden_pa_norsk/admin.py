@@ -0,0 +1,71 @@
+"""Admin view of query timings, cache hit rates and profiles
+
+Shown on the home page instead of the usual content when the admin query parameter matches the
+ADMIN_TOKEN environment variable, so it is not listed among the pages. Without ADMIN_TOKEN the
+view is disabled.
+"""
+import hmac
+import os
+
+import pandas as pd
+import streamlit as st
+
+from verden_pa_norsk.instrumentation import query_log
+from verden_pa_norsk.result_cache import result_cache
+from verden_pa_norsk.streamlit_tools import get_review_cache
+
+
+def is_admin() -> bool:
+    token = os.environ.get("ADMIN_TOKEN")
+    given = st.query_params.get("admin")
+    return bool(token) and given is not None and hmac.compare_digest(given, token)
+
+
+def show_admin():
+    st.title("Spørringer")
+
+    if st.button("Oppdater"):
+        st.rerun()
+
+    st.header("Per spørring")
+    summary = pd.DataFrame(query_log.summary())
+    if len(summary):
+        st.dataframe(
+            summary,
+            hide_index=True,
+            use_container_width=True,
+            column_config={col: st.column_config.NumberColumn(format="%.1f") for col in ("mean_ms", "p50_ms", "p95_ms", "max_ms", "mean_rows")},
+        )
+    else:
+        st.write("Ingen spørringer ennå.")
+
+    st.header("Mellomlager")
+    caches = pd.DataFrame([{"funksjon": name, **totals} for name, totals in query_log.caches.copy().items()])
+    if len(caches):
+        caches["treffrate"] = caches["hits"] / (caches["hits"] + caches["misses"])
+        st.dataframe(caches, hide_index=True, use_container_width=True)
+    st.write("Resultater:", result_cache.stats())
+    st.write("Omtaler:", get_review_cache().stats())
+
+    if query_log.startup:
+        st.header("Oppstart")
+        startup = pd.DataFrame({"steg": query_log.startup.keys(), "ms": [1000 * seconds for seconds in query_log.startup.values()]})
+        st.dataframe(startup, hide_index=True, column_config={"ms": st.column_config.NumberColumn(format="%.0f")})
+
+    st.header("Siste spørringer")
+    recent = pd.DataFrame(reversed(query_log.recent()))
+    if len(recent):
+        recent["time"] = pd.to_datetime(recent["time"], unit="s")
+        recent["ms"] = recent.pop("seconds") * 1000
+        st.dataframe(recent.head(200), hide_index=True, use_container_width=True)
+
+    st.header("Profiler")
+    profiles = query_log.profiles.copy()
+    if profiles:
+        key = st.selectbox("Spørring", profiles.keys(), format_func=lambda key: f"{key} {query_log.queries[key]['query'][:120]}")
+        st.caption(f"Parametre: {profiles[key]['params']}")
+        st.code(profiles[key]["plan"])
+    else:
+        st.write("Ingen profiler. Sett QUERY_PROFILE_RATE for å profilere et utvalg av spørringene.")
+
+    st.download_button("Last ned Prometheus-metrikker", query_log.to_prometheus(), file_name="verden_pa_norsk.prom", mime="text/plain")
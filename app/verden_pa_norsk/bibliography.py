@@ -0,0 +1,426 @@
+"""Export the translations in the national bibliography to the parquet sources of the database
+
+The records collection, see verden_pa_norsk.mongodb, is split into ranges of _id, which are read
+in parallel on one pooled client. Each range is read in _id order by a cursor that fetches
+batches of records holding only the MARC fields used here, and the records are turned into rows
+of translations.parquet and urn_mmsid.parquet, see data/src/schema.sql. The rows are written as
+Arrow record batches to parquet parts in a work directory, and a checkpoint records the last _id
+of every finished part. An interrupted export resumes from there. When every range is done, the
+parts are merged in mmsid order into the files load.sql reads, replacing them in one rename each.
+verden_pa_norsk.refresh then applies the changes to the database.
+
+Records are expected in MARC-in-JSON, as written by pymarc's Record.as_dict:
+
+    {"leader": "...", "fields": [{"001": "990000..."}, {"245": {"ind1": "1", "ind2": "0",
+        "subfields": [{"a": "Tittel :"}, {"b": "undertittel"}]}}, ...]}
+
+A record is a translation if it is in Norwegian (041 $a, or 008) and names an original language
+(041 $h). Only record_rows reads the layout, so another layout needs only a new record_rows.
+
+Usage, from the app directory, against config.cfg or a local mongod:
+
+    python -m verden_pa_norsk.bibliography [--out data/src] [--workers 8] [--restart]
+    python -m verden_pa_norsk.bibliography --uri mongodb://localhost:27017 --db test --collection records
+"""
+import argparse
+import glob
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson import json_util
+from pymongo.collection import Collection
+
+from verden_pa_norsk.build import SRC_DIR
+from verden_pa_norsk.mongodb import COLLECTION, DB, connect
+
+WORK_DIR = "data/bibliography"
+CHECKPOINT = "checkpoint.json"
+# ranges read at once, each on a pooled connection
+WORKERS = 8
+# ranges per worker, so that a worker done early takes over another range
+RANGES_PER_WORKER = 4
+# _id values sampled per range to place the range bounds
+SAMPLES_PER_RANGE = 20
+# records per cursor batch and per Arrow record batch
+BATCH_SIZE = 2_000
+# rows per parquet part, the unit of the checkpoint
+PART_ROWS = 50_000
+
+# MARC fields read, see record_rows. The projection leaves the other fields as empty documents.
+TAGS = ("001", "008", "041", "082", "100", "240", "245", "260", "264", "700", "765", "856")
+PROJECTION = {f"fields.{tag}": 1 for tag in TAGS}
+# records naming an original language, translations are picked out of these by record_rows
+QUERY = {"fields.041.subfields.h": {"$exists": True}}
+NORWEGIAN = ("nob", "nno", "nor")
+TRANSLATOR_CODES = ("trl",)
+# relator terms of translators, such as "oversetter" and "oversettelse"
+TRANSLATOR_TERMS = ("oversett", "translat")
+
+TRANSLATIONS_SCHEMA = pa.schema([
+    ("mmsid", pa.string()),
+    ("main_author", pa.string()),
+    ("contributors", pa.list_(pa.string())),
+    ("translators", pa.list_(pa.string())),
+    ("title", pa.string()),
+    ("subtitle", pa.string()),
+    ("original_title", pa.string()),
+    ("publisher", pa.string()),
+    ("language", pa.string()),
+    ("original_language", pa.string()),
+    ("publication_year_str", pa.string()),
+    ("publication_year_int", pa.int32()),
+    ("ddc", pa.list_(pa.float64())),
+    ("ddc800", pa.bool_()),
+    ("ddc0", pa.bool_()),
+])
+URN_SCHEMA = pa.schema([("urn", pa.string()), ("mmsid", pa.string())])
+# output file and sort order of each table, the file names load.sql reads
+OUTPUTS = {
+    "translations": ("translations.parquet", TRANSLATIONS_SCHEMA, "mmsid"),
+    "urn_mmsid": ("urn_mmsid.parquet", URN_SCHEMA, "mmsid, urn"),
+}
+
+_YEAR = re.compile(r"\d{4}")
+_URN = re.compile(r"URN:NBN:no-nb_\w+")
+# ISBD punctuation ending a value, a period is handled separately
+_TRAILING = " ,:;/="
+_INITIAL = re.compile(r"(^|[\s.])\w\.$")
+
+
+def marc_fields(record: dict) -> dict[str, list]:
+    """Values of every field of a record by tag, in record order"""
+    fields = {}
+    for field in record.get("fields", ()):
+        for tag, value in field.items():
+            fields.setdefault(tag, []).append(value)
+    return fields
+
+
+def subfields(field: dict, code: str) -> list[str]:
+    return [value for subfield in field.get("subfields", ()) for key, value in subfield.items() if key == code]
+
+
+def clean(value: str | None) -> str | None:
+    """Value without the ISBD punctuation that ends it, None if nothing is left
+
+    A final period is kept after an initial, as in "Rowling, J.K.".
+    """
+    if value is None:
+        return None
+    value = value.strip().rstrip(_TRAILING).strip()
+    if value.endswith(".") and not _INITIAL.search(value):
+        value = value[:-1].rstrip()
+    return value or None
+
+
+def first(fields: list[dict], code: str) -> str | None:
+    """First value of a subfield in a list of fields, cleaned"""
+    for field in fields:
+        for value in subfields(field, code):
+            if clean(value):
+                return clean(value)
+    return None
+
+
+def record_rows(record: dict) -> tuple[dict | None, list[dict]]:
+    """Row of translations and rows of urn_mmsid for a bibliographic record
+
+    Returns:
+        tuple[dict | None, list[dict]]: the translations row, None if the record is not a
+            translation into Norwegian, and a row per URN of the digitized book
+    """
+    fields = marc_fields(record)
+    mmsid = (fields.get("001") or [None])[0]
+    original_languages = [code for field in fields.get("041", ()) for code in subfields(field, "h")]
+    if not mmsid or not original_languages:
+        return None, []
+    fixed = (fields.get("008") or [""])[0]
+    language = first(fields.get("041", ()), "a") or clean(fixed[35:38])
+    if language not in NORWEGIAN:
+        return None, []
+
+    contributors, translators = [], []
+    for field in fields.get("700", ()):
+        name = first([field], "a")
+        if name is None:
+            continue
+        contributors.append(name)
+        terms = [term.lower() for term in subfields(field, "e")]
+        if any(code in TRANSLATOR_CODES for code in subfields(field, "4")) or any(term.startswith(TRANSLATOR_TERMS) for term in terms):
+            translators.append(name)
+
+    # the publication statement, or the older imprint
+    imprint = [field for field in fields.get("264", ()) if field.get("ind2") == "1"] or fields.get("260", [])
+    year_str = first(imprint, "c")
+    year = _YEAR.search(year_str or "") or _YEAR.fullmatch(fixed[7:11])
+
+    ddc = []
+    for value in (value for field in fields.get("082", ()) for value in subfields(field, "a")):
+        try:
+            # segmentation marks, such as the / in 839.823/6
+            ddc.append(float(value.replace("/", "").replace("'", "")))
+        except ValueError:
+            pass
+
+    row = {
+        "mmsid": mmsid,
+        "main_author": first(fields.get("100", ()), "a"),
+        "contributors": contributors,
+        "translators": translators,
+        "title": first(fields.get("245", ()), "a"),
+        "subtitle": first(fields.get("245", ()), "b"),
+        "original_title": first(fields.get("240", ()), "a") or first(fields.get("765", ()), "t"),
+        "publisher": first(imprint, "b"),
+        "language": language,
+        "original_language": "[" + ", ".join(original_languages) + "]",
+        "publication_year_str": year_str,
+        "publication_year_int": int(year.group(0)) if year else None,
+        "ddc": ddc,
+        "ddc800": any(800 <= code < 900 for code in ddc),
+        "ddc0": not ddc,
+    }
+    urns = dict.fromkeys(
+        match.group(0)
+        for field in fields.get("856", ())
+        for value in subfields(field, "u")
+        if (match := _URN.search(value))
+    )
+    return row, [{"urn": urn, "mmsid": mmsid} for urn in urns]
+
+
+def split_ranges(collection: Collection, n: int) -> list[dict]:
+    """Split the collection into about n ranges of _id with about as many records each
+
+    The bounds are quantiles of a random sample of _id. The first and last ranges are open, so the
+    ranges cover every record whatever the sample.
+    """
+    if n <= 1:
+        return [{"lo": None, "hi": None}]
+    sample = sorted(doc["_id"] for doc in collection.aggregate([
+        {"$sample": {"size": n * SAMPLES_PER_RANGE}},
+        {"$project": {"_id": 1}},
+    ]))
+    bounds = []
+    for i in range(1, n):
+        if sample and (not bounds or sample[len(sample) * i // n] > bounds[-1]):
+            bounds.append(sample[len(sample) * i // n])
+    los, his = [None, *bounds], [*bounds, None]
+    return [{"lo": lo, "hi": hi} for lo, hi in zip(los, his)]
+
+
+def range_query(state: dict) -> dict:
+    """Query for the records of a range not yet exported"""
+    ids = {}
+    if state["last_id"] is not None:
+        ids["$gt"] = state["last_id"]
+    elif state["lo"] is not None:
+        ids["$gte"] = state["lo"]
+    if state["hi"] is not None:
+        ids["$lt"] = state["hi"]
+    return {**QUERY, "_id": ids} if ids else dict(QUERY)
+
+
+class Checkpoint:
+    """Progress of every range, saved to a JSON file after each finished part"""
+
+    def __init__(self, path: str, source: dict, ranges: list[dict] | None = None):
+        self.path = path
+        self.source = source
+        self.ranges = [
+            {"index": i, **bounds, "last_id": None, "parts": 0, "records": 0, "rows": 0, "done": False}
+            for i, bounds in enumerate(ranges or [])
+        ]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str, source: dict) -> "Checkpoint | None":
+        """The checkpoint of an unfinished export of the same source, None if there is none"""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as file:
+            state = json_util.loads(file.read())
+        if state["source"] != source or state.get("complete"):
+            return None
+        checkpoint = cls(path, source)
+        checkpoint.ranges = state["ranges"]
+        return checkpoint
+
+    def update(self, index: int, **values):
+        with self._lock:
+            self.ranges[index].update(values)
+            self.save()
+
+    def save(self, complete: bool = False):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(json_util.dumps({"source": self.source, "ranges": self.ranges, "complete": complete}, indent=2))
+        os.replace(tmp_path, self.path)
+
+
+class _PartWriter:
+    """Parquet parts of one range, one file per table, renamed into place when complete"""
+
+    def __init__(self, work_dir: str, index: int, part: int):
+        self.paths = {table: os.path.join(work_dir, table, f"part-{index:04d}-{part:05d}.parquet") for table in OUTPUTS}
+        self.writers = {
+            table: pq.ParquetWriter(path + ".tmp", OUTPUTS[table][1])
+            for table, path in self.paths.items()
+        }
+        self.rows = 0
+
+    def write(self, rows: dict[str, list[dict]]):
+        for table, table_rows in rows.items():
+            self.writers[table].write_batch(pa.RecordBatch.from_pylist(table_rows, schema=OUTPUTS[table][1]))
+        self.rows += len(rows["translations"])
+
+    def close(self):
+        for table, writer in self.writers.items():
+            writer.close()
+            os.replace(self.paths[table] + ".tmp", self.paths[table])
+
+
+def export_range(collection: Collection, state: dict, checkpoint: Checkpoint, work_dir: str,
+                 batch_size: int | None = None, part_rows: int | None = None):
+    """Read the rest of a range in _id order into parquet parts, checkpointing after each part
+
+    Args:
+        state (dict): the range in the checkpoint, updated as parts are finished
+        batch_size (int | None): records per cursor batch and rows per record batch, BATCH_SIZE by default
+        part_rows (int | None): rows per part, PART_ROWS by default
+    """
+    batch_size = batch_size or BATCH_SIZE
+    part_rows = part_rows or PART_ROWS
+    cursor = collection.find(range_query(state), PROJECTION, sort=[("_id", 1)], batch_size=batch_size)
+    part, rows = None, {table: [] for table in OUTPUTS}
+    last_id, records = state["last_id"], state["records"]
+
+    def finish(part: _PartWriter):
+        part.close()
+        checkpoint.update(state["index"], last_id=last_id, records=records, parts=state["parts"] + 1, rows=state["rows"] + part.rows)
+
+    try:
+        for record in cursor:
+            translation, urns = record_rows(record)
+            last_id, records = record["_id"], records + 1
+            if translation is not None:
+                rows["translations"].append(translation)
+                rows["urn_mmsid"].extend(urns)
+            if len(rows["translations"]) >= batch_size:
+                part = part or _PartWriter(work_dir, state["index"], state["parts"])
+                part.write(rows)
+                rows = {table: [] for table in OUTPUTS}
+                if part.rows >= part_rows:
+                    finish(part)
+                    part = None
+        if rows["translations"]:
+            part = part or _PartWriter(work_dir, state["index"], state["parts"])
+            part.write(rows)
+        if part is not None:
+            finish(part)
+        checkpoint.update(state["index"], last_id=last_id, records=records, done=True)
+    finally:
+        cursor.close()
+
+
+def merge_parts(work_dir: str, out_dir: str) -> dict[str, int]:
+    """Merge the parts of every table in sort order into the parquet sources, each replaced in one rename
+
+    Returns:
+        dict[str, int]: rows per table
+    """
+    counts = {}
+    with duckdb.connect() as con:
+        for table, (file_name, schema, order) in OUTPUTS.items():
+            path = os.path.join(out_dir, file_name)
+            parts = os.path.join(work_dir, table, "part-*.parquet")
+            if glob.glob(parts):
+                con.execute(f"COPY (SELECT * FROM read_parquet('{parts}') ORDER BY {order}) TO '{path}.tmp' (FORMAT 'parquet')")
+                counts[table] = con.execute(f"SELECT count(*) FROM read_parquet('{path}.tmp')").fetchone()[0]
+            else:
+                pq.write_table(schema.empty_table(), path + ".tmp")
+                counts[table] = 0
+            os.replace(path + ".tmp", path)
+    return counts
+
+
+def export_bibliography(collection: Collection, out_dir: str = SRC_DIR, work_dir: str = WORK_DIR,
+                        workers: int = WORKERS, restart: bool = False) -> dict:
+    """Export the translations of a records collection to translations.parquet and urn_mmsid.parquet
+
+    Args:
+        collection (Collection): the records, see verden_pa_norsk.mongodb.connect
+        out_dir (str): directory of the parquet sources
+        work_dir (str): directory of the parts and the checkpoint
+        workers (int): ranges read at once
+        restart (bool): start over rather than resume an unfinished export
+
+    Returns:
+        dict: records read and rows written per range and table, and timings
+    """
+    started = time.perf_counter()
+    timings = {}
+    source = {"database": collection.database.name, "collection": collection.name, "query": QUERY, "tags": list(TAGS)}
+    checkpoint_path = os.path.join(work_dir, CHECKPOINT)
+    checkpoint = None if restart else Checkpoint.load(checkpoint_path, source)
+    if checkpoint is None:
+        t0 = time.perf_counter()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        for table in OUTPUTS:
+            os.makedirs(os.path.join(work_dir, table))
+        checkpoint = Checkpoint(checkpoint_path, source, split_ranges(collection, workers * RANGES_PER_WORKER))
+        checkpoint.save()
+        timings["split"] = round(time.perf_counter() - t0, 3)
+    # parts being written when the last export stopped
+    for path in glob.glob(os.path.join(work_dir, "*", "*.tmp")):
+        os.remove(path)
+
+    t0 = time.perf_counter()
+    pending = [state for state in checkpoint.ranges if not state["done"]]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bibliography") as pool:
+        for future in [pool.submit(export_range, collection, state, checkpoint, work_dir) for state in pending]:
+            future.result()
+    timings["read"] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    counts = merge_parts(work_dir, out_dir)
+    checkpoint.save(complete=True)
+    timings["merge"] = round(time.perf_counter() - t0, 3)
+    timings["total"] = round(time.perf_counter() - started, 3)
+    return {
+        "ranges": len(checkpoint.ranges),
+        "resumed_ranges": len(checkpoint.ranges) - len(pending),
+        "records": sum(state["records"] for state in checkpoint.ranges),
+        "row_counts": counts,
+        "timings": timings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the translations in the national bibliography to parquet sources")
+    parser.add_argument("--uri", help="MongoDB connection string, config.cfg if not given")
+    parser.add_argument("--db", default=DB)
+    parser.add_argument("--collection", default=COLLECTION)
+    parser.add_argument("--out", default=SRC_DIR, help="directory of the parquet sources")
+    parser.add_argument("--work", default=WORK_DIR, help="directory of the parts and the checkpoint")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="ranges read at once")
+    parser.add_argument("--restart", action="store_true", help="start over rather than resume an unfinished export")
+    args = parser.parse_args()
+
+    summary = export_bibliography(connect(args.db, args.collection, args.uri), args.out, args.work, args.workers, args.restart)
+    print(f"{summary['records']} records in {summary['ranges']} ranges, {summary['resumed_ranges']} done before")
+    for table, rows in summary["row_counts"].items():
+        print(f"{table:<24}{rows:>12}")
+    for step, seconds in summary["timings"].items():
+        print(f"{step:<24}{seconds:>11}s")
+
+
+if __name__ == "__main__":
+    main()
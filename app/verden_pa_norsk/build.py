@@ -0,0 +1,181 @@
+"""Build the app database from the parquet sources
+
+The database is written as a new version in the versions directory next to the database path,
+and the path, a symbolic link, is switched to it in one rename, as verden_pa_norsk.refresh does.
+Running apps reopen the database when the link changes, see verden_pa_norsk.database.
+
+Usage, from the app directory:
+
+    python -m verden_pa_norsk.build [--src data/src] [--db data/translations_map_data.db]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import duckdb
+
+from verden_pa_norsk.database import DB_PATH
+
+SRC_DIR = "data/src"
+# the database versions are kept in this directory, next to the database path
+VERSIONS_DIR = "versions"
+# versions kept, including the current one, for the processes that still have them open
+KEEP_VERSIONS = 3
+
+# SQL scripts in data/src, run in this order
+BUILD_STEPS = ("schema.sql", "load.sql", "derived.sql", "search_index.sql", "persons.sql")
+
+
+def manifest_path(db_path: str) -> str:
+    """Path of the manifest written next to a database file"""
+    return os.path.splitext(db_path)[0] + ".manifest.json"
+
+
+def get_row_counts(con: duckdb.DuckDBPyConnection) -> dict[str, int]:
+    """Count rows in every table of the main schema, leaving out the views"""
+    tables = con.execute(
+        "SELECT table_name FROM information_schema.tables"
+        " WHERE table_schema = 'main' AND table_type = 'BASE TABLE' ORDER BY table_name"
+    ).fetchall()
+    return {name: con.execute(f'SELECT count(*) FROM "{name}"').fetchone()[0] for (name,) in tables}
+
+
+def make_manifest(src_dir: str, db_path: str, row_counts: dict[str, int], timings: dict[str, float]) -> dict:
+    return {
+        "database": os.path.basename(db_path),
+        "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "duckdb_version": duckdb.__version__,
+        "sources": {
+            name: os.path.getsize(os.path.join(src_dir, name))
+            for name in sorted(os.listdir(src_dir))
+            if name.endswith(".parquet")
+        },
+        "row_counts": row_counts,
+        "timings": timings,
+    }
+
+
+def version_path(db_path: str, written: datetime | None = None) -> str:
+    """Path of the version of a database written at a time, now by default, so versions sort by time"""
+    stem, ext = os.path.splitext(os.path.basename(db_path))
+    stamp = (written or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%S%f")
+    return os.path.join(os.path.dirname(db_path), VERSIONS_DIR, f"{stem}.{stamp}{ext}")
+
+
+def keep_as_version(db_path: str = DB_PATH):
+    """Keep a database file built in place, rather than linked to a version, as the first version"""
+    if not os.path.exists(db_path) or os.path.islink(db_path):
+        return
+    path = version_path(db_path, datetime.fromtimestamp(os.path.getmtime(db_path), timezone.utc))
+    os.link(db_path, path)
+    if os.path.exists(manifest_path(db_path)):
+        shutil.copyfile(manifest_path(db_path), manifest_path(path))
+
+
+def publish(path: str, db_path: str = DB_PATH):
+    """Point the database path at a version, atomically, together with its manifest"""
+    keep_as_version(db_path)
+    link = db_path + ".link.tmp"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.relpath(path, os.path.dirname(db_path) or "."), link)
+    os.replace(link, db_path)
+    if os.path.exists(manifest_path(path)):
+        shutil.copyfile(manifest_path(path), manifest_path(db_path) + ".tmp")
+        os.replace(manifest_path(db_path) + ".tmp", manifest_path(db_path))
+
+
+def remove_old_versions(db_path: str = DB_PATH, keep: int = KEEP_VERSIONS):
+    """Delete all but the newest versions. Processes that still have one open keep reading it."""
+    versions_dir = os.path.join(os.path.dirname(db_path), VERSIONS_DIR)
+    current = os.path.realpath(db_path)
+    stem, ext = os.path.splitext(os.path.basename(db_path))
+    versions = sorted(name for name in os.listdir(versions_dir) if name.startswith(f"{stem}.") and name.endswith(ext))
+    for name in versions[:-keep]:
+        path = os.path.join(versions_dir, name)
+        if os.path.realpath(path) != current:
+            os.remove(path)
+            if os.path.exists(manifest_path(path)):
+                os.remove(manifest_path(path))
+
+
+def build_database(src_dir: str = SRC_DIR, db_path: str = DB_PATH) -> dict:
+    """Build the database from the SQL scripts and parquet files in src_dir as a new version, and publish it
+
+    Args:
+        src_dir (str): directory holding the SQL scripts and parquet sources
+        db_path (str): the database path, which becomes a link to the new version
+
+    Returns:
+        dict: the manifest, with row counts per table and timings per step
+    """
+    path = version_path(db_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest = write_database(src_dir, path)
+    publish(path, db_path)
+    remove_old_versions(db_path)
+    return manifest
+
+
+def write_database(src_dir: str, db_path: str) -> dict:
+    """Write a database file from the SQL scripts and parquet files in src_dir, with its manifest
+
+    The database is written to a temporary file and moved into place when complete, so nothing
+    ever opens a half-built file.
+
+    Args:
+        src_dir (str): directory holding the SQL scripts and parquet sources
+        db_path (str): path of the database file to create
+
+    Returns:
+        dict: the manifest, with row counts per table and timings per step
+    """
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    timings = {}
+    started = time.perf_counter()
+    with duckdb.connect(tmp_path) as con:
+        # load.sql refers to the sources as src/<file>, relative to the data directory
+        con.execute(f"SET file_search_path = '{os.path.dirname(os.path.abspath(src_dir))}'")
+        for step in BUILD_STEPS:
+            t0 = time.perf_counter()
+            with open(os.path.join(src_dir, step), "r") as file:
+                con.execute(file.read())
+            timings[step] = round(time.perf_counter() - t0, 3)
+
+        t0 = time.perf_counter()
+        con.execute("ANALYZE")
+        timings["analyze"] = round(time.perf_counter() - t0, 3)
+
+        row_counts = get_row_counts(con)
+        con.execute("CHECKPOINT")
+
+    os.replace(tmp_path, db_path)
+    timings["total"] = round(time.perf_counter() - started, 3)
+
+    manifest = make_manifest(src_dir, db_path, row_counts, timings)
+    with open(manifest_path(db_path), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Verden på norsk database from parquet sources")
+    parser.add_argument("--src", default=SRC_DIR, help="directory with SQL scripts and parquet files")
+    parser.add_argument("--db", default=DB_PATH, help="database path, a link to the new version")
+    args = parser.parse_args()
+
+    manifest = build_database(args.src, args.db)
+    for table, rows in manifest["row_counts"].items():
+        print(f"{table:<24}{rows:>12}")
+    for step, seconds in manifest["timings"].items():
+        print(f"{step:<24}{seconds:>11}s")
+
+
+if __name__ == "__main__":
+    main()
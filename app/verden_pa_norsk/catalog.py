@@ -0,0 +1,34 @@
+"""Cached lookups on the catalog shared by the pages
+
+These live in a module rather than in the page scripts, since Streamlit keys cached functions by
+module and name, and page scripts run as __main__. Only functions defined here can be filled by
+the warm-up in verden_pa_norsk.serve before the first visitor arrives.
+"""
+from verden_pa_norsk.database import fetch_all
+from verden_pa_norsk.facets import facet_counts
+from verden_pa_norsk.streamlit_tools import cache_data
+
+# translations pre-joined with first edition year and URN, built by verden_pa_norsk.build
+SEARCH_TABLE = "books"
+
+
+# the catalog only changes with a new database, so these never expire
+@cache_data(ttl=None)
+def get_column_names_and_types(table_name: str) -> list[tuple[str, str]]:
+    query = """
+    SELECT column_name, data_type
+    FROM information_schema.columns
+    WHERE table_name = ?
+    """
+    return [(row[0], row[1]) for row in fetch_all(query, [table_name])]
+
+
+@cache_data(ttl=None)
+def get_catalog_facets() -> dict[str, list[tuple[str, str, int]]]:
+    """Every value of every facet over the whole catalog, see verden_pa_norsk.facets"""
+    return facet_counts(f"SELECT * FROM {SEARCH_TABLE}", limits={})
+
+
+def get_available_languages() -> list[tuple[str, str]]:
+    """Language code and Norwegian name of the original languages in the catalog, by name"""
+    return sorted(((value, label) for value, label, _ in get_catalog_facets()["original_language"]), key=lambda row: row[1])
@@ -0,0 +1,228 @@
+"""Queries on the read-only catalog database, run in this process or on the query service
+
+With QUERY_SERVICE_URL set, the queries on the default database are sent to the query service,
+see verden_pa_norsk.query_service, and the rows come back as Arrow. Otherwise they run on a
+connection shared by every thread of this process.
+
+The database path may be a link to the current version of the database, see
+verden_pa_norsk.refresh. When it points to a new version, the next queries run on a connection to
+that version, while queries in progress finish on the old one, and the callbacks registered with
+on_reload are called so that the caches of the old version are dropped.
+"""
+import os
+import threading
+import time
+
+import duckdb
+import pyarrow as pa
+from pandas import DataFrame
+
+from verden_pa_norsk.instrumentation import query_log, timed
+from verden_pa_norsk.query_client import QueryClient, get_client
+
+DB_PATH = "data/translations_map_data.db"
+QUERY_SERVICE_URL = os.environ.get("QUERY_SERVICE_URL")
+
+# seconds between checks of the version the database path points to
+RELOAD_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_databases: dict[str, duckdb.DuckDBPyConnection] = {}
+# version of each open database, and when the path was last checked
+_versions: dict[str, str] = {}
+_checked: dict[str, float] = {}
+_reload_callbacks: list = []
+# the latest database version the query service answered from
+_service_version: str | None = None
+# DuckDB settings of the connections opened by get_database
+_config: dict = {}
+_local = threading.local()
+
+
+def configure_database(**config):
+    """DuckDB settings for the connections opened from now on, such as threads"""
+    _config.update(config)
+
+
+def use_service(db_path: str) -> bool:
+    return bool(QUERY_SERVICE_URL) and db_path == DB_PATH
+
+
+def database_version(db_path: str = DB_PATH) -> str:
+    """Version of the file a database path points to, which changes when a new version is published
+
+    Versions of one path sort by the time they were written.
+    """
+    stat = os.stat(db_path)
+    return f"{stat.st_mtime_ns}-{stat.st_ino}"
+
+
+def current_version(db_path: str = DB_PATH) -> str | None:
+    """Version of the database the queries of this process run on, None before it is opened"""
+    if use_service(db_path):
+        return _service_version
+    return _versions.get(db_path)
+
+
+def on_reload(callback):
+    """Register a function to call with no arguments whenever a new version of the database is opened"""
+    _reload_callbacks.append(callback)
+    return callback
+
+
+def _reloaded():
+    for callback in _reload_callbacks:
+        callback()
+
+
+def _sort_key(version: str) -> tuple[int, ...]:
+    return tuple(int(part) for part in version.split("-"))
+
+
+def check_service_version(version: str | None):
+    """Note the database version of a query service response, calling the reload callbacks on a newer one"""
+    global _service_version
+    if version is None or version == _service_version:
+        return
+    with _lock:
+        previous = _service_version
+        if previous is not None and _sort_key(version) <= _sort_key(previous):
+            # a worker that has not switched yet
+            return
+        _service_version = version
+    if previous is not None:
+        _reloaded()
+
+
+def get_database(db_path: str = DB_PATH) -> duckdb.DuckDBPyConnection:
+    """Get the process-wide read-only connection to a database file
+
+    The database is opened once per process, so every session shares one catalog and buffer pool.
+    Every RELOAD_INTERVAL seconds the path is checked, and opened again if it points to a new version.
+    Don't run queries on the returned connection directly, use get_cursor from the calling thread.
+
+    Args:
+        db_path (str): path to the DuckDB database file
+
+    Returns:
+        duckdb.DuckDBPyConnection: shared read-only connection
+    """
+    con = _databases.get(db_path)
+    if con is not None and time.monotonic() - _checked[db_path] < RELOAD_INTERVAL:
+        return con
+    with _lock:
+        con = _databases.get(db_path)
+        if con is not None and time.monotonic() - _checked[db_path] < RELOAD_INTERVAL:
+            return con
+        # the version the path points to is opened, rather than the path, which may change meanwhile
+        path = os.path.realpath(db_path)
+        version = database_version(path)
+        _checked[db_path] = time.monotonic()
+        if con is not None and version == _versions[db_path]:
+            return con
+        reloaded = con is not None
+        con = _databases[db_path] = duckdb.connect(path, read_only=True, config=_config)
+        _versions[db_path] = version
+    if reloaded:
+        _reloaded()
+    return con
+
+
+def get_cursor(db_path: str = DB_PATH) -> duckdb.DuckDBPyConnection:
+    """Get a cursor on the shared database for the current thread
+
+    DuckDB connections are not safe to share between threads, so each thread gets its own cursor.
+    Cursors are dropped together with the thread that created them, or when the database is reopened.
+
+    Args:
+        db_path (str): path to the DuckDB database file
+
+    Returns:
+        duckdb.DuckDBPyConnection: cursor owned by the current thread
+    """
+    cursors = _local.__dict__.setdefault("cursors", {})
+    con = get_database(db_path)
+    database, cursor = cursors.get(db_path, (None, None))
+    if database is not con:
+        cursor = con.cursor()
+        cursors[db_path] = (con, cursor)
+    return cursor
+
+
+def get_runner(db_path: str = DB_PATH) -> duckdb.DuckDBPyConnection | QueryClient:
+    """What runs the queries of the current thread, the query service client or the cursor
+
+    Both can interrupt the query in progress from another thread, see verden_pa_norsk.executor.
+    """
+    return get_client(QUERY_SERVICE_URL) if use_service(db_path) else get_cursor(db_path)
+
+
+def fetch_all(query: str, params: list | None = None, db_path: str = DB_PATH) -> list[tuple]:
+    """Run a query on the current thread's cursor and return all rows as tuples"""
+    if use_service(db_path):
+        table = fetch_arrow(query, params, db_path)
+        return list(zip(*(column.to_pylist() for column in table.columns)))
+    cursor = get_cursor(db_path)
+    with timed(query, params) as result:
+        rows = cursor.execute(query, params).fetchall()
+        result["rows"] = len(rows)
+    query_log.sample_profile(get_database(db_path), query, params)
+    return rows
+
+
+def fetch_df(query: str, params: list | None = None, db_path: str = DB_PATH) -> DataFrame:
+    """Run a query on the current thread's cursor and return the result as a DataFrame"""
+    if use_service(db_path):
+        return fetch_arrow(query, params, db_path).to_pandas()
+    cursor = get_cursor(db_path)
+    with timed(query, params) as result:
+        df = cursor.execute(query, params).df()
+        result["rows"] = len(df)
+    query_log.sample_profile(get_database(db_path), query, params)
+    return df
+
+
+def fetch_arrow(query: str, params: list | None = None, db_path: str = DB_PATH) -> pa.Table:
+    """Run a query on the current thread's cursor and return the result as an Arrow table"""
+    if use_service(db_path):
+        client = get_client(QUERY_SERVICE_URL)
+        with timed(query, params) as result:
+            table = client.arrow(query, params)
+            result["rows"] = table.num_rows
+        check_service_version(client.version)
+        return table
+    cursor = get_cursor(db_path)
+    with timed(query, params) as result:
+        table = cursor.execute(query, params).arrow()
+        result["rows"] = table.num_rows
+    query_log.sample_profile(get_database(db_path), query, params)
+    return table
+
+
+def fetch_batches(query: str, params: list | None = None, batch_size: int = 10_000, db_path: str = DB_PATH) -> pa.RecordBatchReader:
+    """Run a query and return a reader of its rows in record batches, for results too large to hold
+
+    The query is timed until the last batch has been read.
+    """
+    if use_service(db_path):
+        client = get_client(QUERY_SERVICE_URL)
+        reader = client.stream(query, params, batch_size)
+        check_service_version(client.version)
+        return pa.RecordBatchReader.from_batches(reader.schema, _timed_batches(reader, query, params))
+    reader = get_cursor(db_path).execute(query, params).fetch_record_batch(batch_size)
+    return pa.RecordBatchReader.from_batches(reader.schema, _timed_batches(reader, query, params, db_path))
+
+
+def _timed_batches(reader: pa.RecordBatchReader, query: str, params: list | None, db_path: str | None = None):
+    """Batches of a reader, recording the query when they have all been read
+
+    Args:
+        db_path (str | None): database to sample a profile of the query on, None for the query service
+    """
+    with timed(query, params) as result:
+        result["rows"] = 0
+        for batch in reader:
+            result["rows"] += batch.num_rows
+            yield batch
+    if db_path is not None:
+        query_log.sample_profile(get_database(db_path), query, params)
@@ -0,0 +1,140 @@
+"""Cancellable query execution for one session
+
+Streamlit reruns a page on every change of an input, and a rerun is only noticed by the running
+script at its next Streamlit call. A query already running in DuckDB would keep a core busy until
+it finished, and the rerun would wait for it. The executor runs each query on a worker thread,
+so the waiting script can be stopped, and interrupts the query of a run that is given up. The
+worker threads are a pool shared by every session, so the cursor each thread keeps, see
+verden_pa_norsk.database.get_cursor, is reused by the queries that follow. A
+query with new arguments can wait for the input to settle first, so a slider drag or a burst of
+edits starts one query rather than one per step.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from typing import Callable
+
+import duckdb
+
+from verden_pa_norsk.database import get_runner
+from verden_pa_norsk.query_client import QueryClient
+
+# seconds to wait for more input before running a query with new arguments
+DEBOUNCE = 0.3
+# seconds between checks for a newer run while waiting
+POLL_INTERVAL = 0.05
+# worker threads running the queries of every session in the process
+WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="query")
+
+
+class Superseded(Exception):
+    """A newer query was started by the same session before this one ran"""
+
+
+class QueryExecutor:
+    def __init__(
+        self,
+        context: Callable[[], AbstractContextManager] | None = None,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        """
+        Args:
+            context (callable | None): called on the calling thread for every run, returning a
+                context manager that the worker thread runs the query in, to give it the context
+                of the calling thread
+            poll_interval (float): seconds between checks while waiting
+        """
+        self.context = context
+        self.poll_interval = poll_interval
+        self.generation = 0
+        # generation: cursor or query service client of the queries in progress
+        self._running: dict[int, duckdb.DuckDBPyConnection | QueryClient] = {}
+        # function name: arguments of the last query started
+        self._last_args: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def cancel(self, before: int | None = None):
+        """Interrupt the queries in progress, or only those of runs older than a generation"""
+        with self._lock:
+            for generation, cursor in self._running.items():
+                if before is None or generation < before:
+                    cursor.interrupt()
+
+    def _interrupt(self, generation: int):
+        with self._lock:
+            cursor = self._running.get(generation)
+            if cursor is not None:
+                cursor.interrupt()
+
+    def _wait(self, seconds: float, generation: int, check: Callable[[], None] | None):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if check:
+                check()
+            if generation != self.generation:
+                raise Superseded()
+            time.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+
+    def _work(self, future: Future, context: AbstractContextManager, generation: int, func: Callable, args: tuple, kwargs: dict):
+        cursor = get_runner()
+        with self._lock:
+            if generation != self.generation:
+                future.set_exception(Superseded())
+                return
+            self._running[generation] = cursor
+        try:
+            with context:
+                future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running.pop(generation, None)
+
+    def run(self, func: Callable, *args, debounce: float = 0.0, check: Callable[[], None] | None = None, **kwargs):
+        """Run a function that queries the database on a pooled worker thread and wait for its result
+
+        Starting a run interrupts the queries of older runs still in progress. Any exception raised
+        by check while waiting, such as Streamlit stopping the script for a rerun, interrupts the
+        query and is raised again.
+
+        Args:
+            func (callable): function to run, querying through verden_pa_norsk.database
+            debounce (float): seconds to wait before running with arguments other than last time
+            check (callable | None): called regularly while waiting, raises to give up the run
+
+        Returns:
+            the return value of func
+
+        Raises:
+            Superseded: a newer run was started before this one finished waiting
+        """
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+        self.cancel(before=generation)
+
+        name = func.__qualname__
+        call_args = repr((args, sorted(kwargs.items())))
+        if debounce and self._last_args.get(name) != call_args:
+            self._wait(debounce, generation, check)
+        self._last_args[name] = call_args
+
+        future = Future()
+        context = self.context() if self.context else nullcontext()
+        _pool.submit(self._work, future, context, generation, func, args, kwargs)
+        try:
+            while True:
+                try:
+                    return future.result(timeout=self.poll_interval)
+                except TimeoutError:
+                    if check:
+                        check()
+        except BaseException:
+            # the interrupted query fails on the worker thread, where nobody waits for it
+            self._interrupt(generation)
+            raise
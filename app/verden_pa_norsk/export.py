@@ -0,0 +1,256 @@
+"""Export of query results to Parquet, CSV and XLSX files
+
+Rows are streamed from DuckDB in Arrow record batches straight into the file writers, so an
+export of the whole catalog runs in constant memory and never becomes a DataFrame. The files are
+written to the static directory of the app and downloaded from there, since st.download_button
+holds the whole file in memory. Static serving is enabled in .streamlit/config.toml.
+
+Exports run in the background on a small pool shared by every session, see Exporter, which
+limits the exports in flight, so a large export neither blocks the session that asked for it
+nor lets many sessions fill the disk at once. XLSX is for results that fit a spreadsheet, larger
+results are written as CSV instead. The oldest files are removed when the export directory
+outgrows its budget.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet
+from openpyxl import Workbook
+
+from verden_pa_norsk.database import fetch_all, fetch_batches
+
+# served by Streamlit at app/static/exports, relative to the page
+EXPORT_DIR = "static/exports"
+EXPORT_URL = "app/static/exports"
+# exports older than this are deleted, in seconds
+EXPORT_TTL = 3600
+# size of the export directory, beyond which the oldest exports are deleted
+EXPORT_MAX_BYTES = 2 * 1024**3
+BATCH_SIZE = 10_000
+# larger XLSX exports are written in the fallback format, as openpyxl writes a few thousand rows a
+# second. Far below the Excel limit of 1048576 rows, so the rows fit one worksheet.
+XLSX_MAX_ROWS = 100_000
+XLSX_FALLBACK = "csv"
+# rows between progress updates of an XLSX export
+XLSX_PROGRESS_ROWS = 1000
+# exports written at once, and exports running or queued, shared by every session of the process
+EXPORT_WORKERS = 2
+MAX_EXPORTS = 4
+
+FORMATS = {
+    "parquet": "Parquet",
+    "csv": "CSV",
+    "xlsx": "Excel (XLSX)",
+}
+
+
+def flat_query(query: str, params: list | None) -> str:
+    """Select the columns of a query with lists and structs cast to VARCHAR, for CSV and XLSX"""
+    columns = fetch_all(f"DESCRIBE {query}", params)
+    flat = [
+        f'"{name}"::VARCHAR AS "{name}"' if data_type.endswith("]") or data_type.startswith(("STRUCT", "MAP")) else f'"{name}"'
+        for name, data_type, *_ in columns
+    ]
+    return f"SELECT {', '.join(flat)} FROM ({query})"
+
+
+# The writers call on_batch, if given, with the number of rows written so far after every batch
+
+
+def write_parquet(reader: pa.RecordBatchReader, path: str, on_batch: Callable[[int], None] | None = None) -> int:
+    rows = 0
+    with pyarrow.parquet.ParquetWriter(path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+            if on_batch:
+                on_batch(rows)
+    return rows
+
+
+def write_csv(reader: pa.RecordBatchReader, path: str, on_batch: Callable[[int], None] | None = None) -> int:
+    rows = 0
+    with pyarrow.csv.CSVWriter(path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+            if on_batch:
+                on_batch(rows)
+    return rows
+
+
+def write_xlsx(reader: pa.RecordBatchReader, path: str, on_batch: Callable[[int], None] | None = None) -> int:
+    """Write rows to one worksheet in write-only mode, which keeps only the current row in memory"""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Treff")
+    sheet.append(reader.schema.names)
+    rows = 0
+    for batch in reader:
+        for row in zip(*(column.to_pylist() for column in batch.columns)):
+            sheet.append(row)
+            rows += 1
+            # a batch takes a while to write as XLSX
+            if on_batch and rows % XLSX_PROGRESS_ROWS == 0:
+                on_batch(rows)
+        if on_batch:
+            on_batch(rows)
+    workbook.save(path)
+    return rows
+
+
+WRITERS = {"parquet": write_parquet, "csv": write_csv, "xlsx": write_xlsx}
+
+
+def remove_old_exports(export_dir: str = EXPORT_DIR, ttl: float = EXPORT_TTL, max_bytes: int = EXPORT_MAX_BYTES):
+    """Delete the exports older than ttl, and the oldest finished exports beyond max_bytes"""
+    cutoff = time.time() - ttl
+    exports = []
+    for entry in os.scandir(export_dir):
+        try:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if stat.st_mtime < cutoff:
+                os.remove(entry.path)
+            elif not entry.name.endswith(".tmp"):
+                exports.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            # removed by another session
+            pass
+
+    total = sum(size for _, size, _ in exports)
+    for _, size, path in sorted(exports):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def count_rows(query: str, params: list | None) -> int:
+    return fetch_all(f"SELECT count(*) FROM ({query})", params)[0][0]
+
+
+def export_query(
+    query: str,
+    params: list | None,
+    file_format: str,
+    name: str,
+    export_dir: str = EXPORT_DIR,
+    on_progress: Callable[[int, int], None] | None = None,
+) -> tuple[str, int]:
+    """Write the rows of a query to a file in the export directory
+
+    Args:
+        query (str): query for the rows to export
+        params (list | None): parameters of the query
+        file_format (str): one of FORMATS. XLSX is written as XLSX_FALLBACK above XLSX_MAX_ROWS rows.
+        name (str): file name without extension, shown to the user when downloading
+        export_dir (str): directory to write the file to
+        on_progress (callable | None): called with the rows written so far and the rows to write,
+            before the first and after every batch
+
+    Returns:
+        tuple[str, int]: path of the file, with a random prefix and the extension of the format
+            written, and the number of rows
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    remove_old_exports(export_dir)
+    total = count_rows(query, params)
+    if file_format == "xlsx" and total > XLSX_MAX_ROWS:
+        file_format = XLSX_FALLBACK
+    # the random prefix keeps the exports of one session out of reach of other sessions
+    path = os.path.join(export_dir, f"{uuid.uuid4().hex}-{name}.{file_format}")
+    if file_format != "parquet":
+        query = flat_query(query, params)
+
+    on_batch = None
+    if on_progress:
+        on_progress(0, total)
+
+        def on_batch(rows: int):
+            on_progress(rows, total)
+
+    tmp_path = path + ".tmp"
+    try:
+        rows = WRITERS[file_format](fetch_batches(query, params, BATCH_SIZE), tmp_path, on_batch)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return path, rows
+
+
+class ExportJob:
+    """An export submitted to an Exporter, with its progress"""
+
+    def __init__(self, file_format: str):
+        self.file_format = file_format
+        self.rows = 0
+        self.total = None
+        self.future: Future | None = None
+
+    def _progress(self, rows: int, total: int):
+        self.rows, self.total = rows, total
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the rows written, 0 until the rows are counted"""
+        return min(self.rows / self.total, 1.0) if self.total else 0.0
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self) -> tuple[str, int, str]:
+        """Path of the file, number of rows and the format written, raising the error of a failed export"""
+        path, rows = self.future.result()
+        return path, rows, os.path.splitext(path)[1][1:]
+
+
+class Exporter:
+    """Background pool writing exports, shared by every session in the process
+
+    At most `workers` exports are written at once, and at most `max_exports` are running or
+    queued. Further exports are refused until one finishes.
+    """
+
+    def __init__(self, workers: int = EXPORT_WORKERS, max_exports: int = MAX_EXPORTS, export_dir: str = EXPORT_DIR):
+        self.max_exports = max_exports
+        self.export_dir = export_dir
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def submit(self, query: str, params: list | None, file_format: str, name: str) -> ExportJob | None:
+        """Start exporting the rows of a query, see export_query. None if too many exports are in flight."""
+        with self._lock:
+            if self._in_flight >= self.max_exports:
+                return None
+            self._in_flight += 1
+        job = ExportJob(file_format)
+        job.future = self._executor.submit(self._export, job, query, params, file_format, name)
+        return job
+
+    def _export(self, job: ExportJob, query: str, params: list | None, file_format: str, name: str) -> tuple[str, int]:
+        try:
+            return export_query(query, params, file_format, name, self.export_dir, on_progress=job._progress)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+
+def export_url(path: str) -> str:
+    return f"{EXPORT_URL}/{os.path.basename(path)}"
@@ -0,0 +1,83 @@
+"""Facet counts for the Boksøk results
+
+The counts of every facet come from one GROUPING SETS query over the filtered rows, with one
+grouping set per facet, rather than from one query per facet. Selected facet values are applied
+as filters on the same expressions, see facet_filter.
+"""
+from verden_pa_norsk.database import fetch_all
+
+# facet name: SQL expression on the search table, aliased t, see data/src/schema.sql
+FACETS = {
+    "original_language": "t.original_language",
+    "language": "t.language",
+    "decade": "t.publication_year_int // 10 * 10",
+    "publisher": "t.publisher",
+    "ddc800": "t.ddc800",
+    "ddc0": "t.ddc0",
+}
+# most frequent values kept per facet, None for all
+FACET_LIMITS = {"original_language": 20, "publisher": 15}
+LANGUAGE_NAMES = {"nob": "Bokmål", "nno": "Nynorsk", "nor": "Norsk"}
+
+
+def facet_query(query: str, limits: dict[str, int] = FACET_LIMITS) -> str:
+    """Count the rows of a query per facet value, in one grouped scan
+
+    The rows are (facet, value, label, count), with the value cast to VARCHAR and the label the
+    Norwegian language name for original_language, otherwise the value. Only the most frequent
+    values of the facets in limits are kept.
+    """
+    names = list(FACETS)
+    columns = ", ".join(f"{FACETS[name]} AS {name}" for name in names)
+    which = " ".join(f"WHEN GROUPING({name}) = 0 THEN '{name}'" for name in names)
+    value = " ".join(f"WHEN GROUPING({name}) = 0 THEN {name}::VARCHAR" for name in names)
+    sets = ", ".join(f"({name})" for name in names)
+    rank = "row_number() OVER (PARTITION BY facet ORDER BY n DESC, value)"
+    limits = " ".join(f"WHEN '{name}' THEN {rank} <= {int(limit)}" for name, limit in limits.items() if limit)
+    # language names are joined on the grouped rows, not on every result row
+    return f"""SELECT facet, value, coalesce(l.language_nob, value) AS label, n
+        FROM (
+            SELECT CASE {which} END AS facet, CASE {value} END AS value, count(*) AS n
+            FROM (SELECT {columns} FROM ({query}) t)
+            GROUP BY GROUPING SETS ({sets})
+        ) g
+        LEFT JOIN languages l ON g.facet = 'original_language' AND l.language_code = g.value
+        WHERE value IS NOT NULL
+        {f"QUALIFY CASE facet {limits} ELSE true END" if limits else ""}"""
+
+
+def facet_counts(query: str, params: list | None = None, limits: dict[str, int] = FACET_LIMITS) -> dict[str, list[tuple[str, str, int]]]:
+    """Facet values with their labels and row counts, most frequent first, decades in order
+
+    Args:
+        query (str): query for the filtered rows of the search table
+        params (list | None): parameters of the query
+        limits (dict[str, int]): most frequent values kept per facet, all values of facets not listed
+
+    Returns:
+        dict[str, list[tuple[str, str, int]]]: (value, label, count) per facet, for every facet
+    """
+    counts = {name: [] for name in FACETS}
+    for facet, value, label, n in fetch_all(facet_query(query, limits), params):
+        counts[facet].append((value, label, n))
+    for values in counts.values():
+        values.sort(key=lambda row: (-row[2], row[0]))
+    counts["decade"].sort()
+    return counts
+
+
+def facet_filter(selected: dict[str, list[str]]) -> tuple[str, list]:
+    """WHERE condition for selected facet values, OR within a facet and AND between facets
+
+    Args:
+        selected (dict[str, list[str]]): selected values per facet, as returned by facet_counts
+
+    Returns:
+        tuple[str, list]: the condition, empty if nothing is selected, and its parameters
+    """
+    conditions, params = [], []
+    for name, values in selected.items():
+        if values:
+            conditions.append(f"list_contains(?::VARCHAR[], ({FACETS[name]})::VARCHAR)")
+            params.append(list(values))
+    return " AND ".join(conditions), params
@@ -0,0 +1,44 @@
+"""SQL expressions that format result columns for display
+
+Formatting in the query keeps the work vectorized inside DuckDB, instead of applying Python
+functions row by row to the fetched DataFrame.
+"""
+
+
+def url_escape_sql(expr: str) -> str:
+    """Drop periods and encode spaces, as expected by the Omtaler query parameters"""
+    return f"replace(replace({expr}, '.', ''), ' ', '%20')"
+
+
+def review_author_sql(author: str = "main_author") -> str:
+    """Turn 'Last, First' into 'First Last'"""
+    return f"array_to_string(list_reverse(string_split({author}, ', ')), ' ')"
+
+
+def review_title_sql(title: str = "title") -> str:
+    """Drop the subtitle, everything after the first colon"""
+    return f"trim(split_part({title}, ':', 1))"
+
+
+def review_link_sql(author: str = "main_author", title: str = "title", year: str = "publication_year_int") -> str:
+    """Link to the Omtaler page for a book. NULL if author, title or year is missing."""
+    return (
+        f"'Omtaler?author=' || {url_escape_sql(review_author_sql(author))}"
+        f" || '&title=' || {url_escape_sql(review_title_sql(title))}"
+        f" || '&publication_year=' || CAST({year} AS VARCHAR)"
+    )
+
+
+def urn_link_sql(urn: str = "urn") -> str:
+    """Link to a digitized book in the National Library. NULL if there is no URN."""
+    return f"CASE WHEN {urn} <> '' THEN 'https://urn.nb.no/' || {urn} END"
+
+
+def metadata_link_sql(mmsid: str = "mmsid") -> str:
+    """Link to the Metadata page for a book"""
+    return f"'Metadata?mmsid=' || {mmsid}"
+
+
+def openlibrary_link_sql(work_key: str = "work_key") -> str:
+    """Link to a work in Open Library"""
+    return f"'https://www.openlibrary.org' || {work_key}"
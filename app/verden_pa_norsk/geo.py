@@ -0,0 +1,96 @@
+"""Grid clustering of map places on their quadkeys
+
+Each place in the places table has the quadkey of the zoom 16 web mercator tile it falls in. Two
+bits of the quadkey per zoom level give the tile at any lower zoom, so clustering at a zoom level is
+a group by on a shifted quadkey.
+
+Places at the same coordinates, such as several addresses geocoded to the center of a city, can not
+be split by zooming in. Their cells are shown as one marker per place instead, spread on a small
+circle around the common location so that each can be clicked.
+"""
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# zoom level of the quadkeys stored in the places table, see data/src/derived.sql
+MAX_ZOOM = 16
+
+# clusters are grid cells this many zoom levels below the map tiles, 4 x 4 cells per 256 px tile
+CELL_LEVELS = 2
+
+# radius in pixels of the circle that places at the same coordinates are spread on
+SPREAD_PIXELS = 20
+
+# (south, west), (north, east)
+WORLD_BOUNDS = ((-90.0, -180.0), (90.0, 180.0))
+
+
+def in_bounds(places: DataFrame, bounds: tuple) -> DataFrame:
+    """Keep the places inside map bounds, allowing for views across the antimeridian"""
+    (south, west), (north, east) = bounds
+    mask = places["latitude"].between(south, north)
+    if east - west < 360:
+        west = (west + 180) % 360 - 180
+        east = (east + 180) % 360 - 180
+        if west <= east:
+            mask &= places["longitude"].between(west, east)
+        else:
+            mask &= (places["longitude"] >= west) | (places["longitude"] <= east)
+    return places[mask]
+
+
+def cluster_places(places: DataFrame, zoom: int, bounds: tuple = WORLD_BOUNDS) -> DataFrame:
+    """Cluster places on a grid for a zoom level, keeping only clusters in view
+
+    Args:
+        places (DataFrame): places with address, latitude, longitude, quadkey and books_published
+        zoom (int): map zoom level
+        bounds (tuple): ((south, west), (north, east)) of the map view
+
+    Returns:
+        DataFrame: one row per cluster, with its books-weighted center, number of places and books.
+        address is set for clusters of a single place. At the deepest level, and for cells whose
+        places all share one location, every place is its own row, see spread_places.
+    """
+    places = in_bounds(places, bounds)
+    shift = 2 * max(MAX_ZOOM - zoom - CELL_LEVELS, 0)
+
+    weighted = places.assign(
+        cell=places["quadkey"] // (1 << shift),
+        lat_books=places["latitude"] * places["books_published"],
+        lon_books=places["longitude"] * places["books_published"],
+    )
+    if zoom >= MAX_ZOOM - CELL_LEVELS:
+        single = pd.Series(True, index=weighted.index)
+    else:
+        locations = weighted.groupby("cell")[["latitude", "longitude"]].transform("nunique")
+        single = (locations["latitude"] == 1) & (locations["longitude"] == 1)
+
+    clusters = weighted[~single].groupby("cell").agg(
+        address=("address", "first"),
+        places=("address", "size"),
+        books_published=("books_published", "sum"),
+        lat_books=("lat_books", "sum"),
+        lon_books=("lon_books", "sum"),
+    )
+    clusters["latitude"] = clusters["lat_books"] / clusters["books_published"]
+    clusters["longitude"] = clusters["lon_books"] / clusters["books_published"]
+    clusters.loc[clusters["places"] > 1, "address"] = None
+
+    columns = ["address", "latitude", "longitude", "places", "books_published"]
+    markers = spread_places(weighted[single].assign(places=1), zoom)
+    return pd.concat([clusters[columns], markers[columns]], ignore_index=True)
+
+
+def spread_places(places: DataFrame, zoom: int) -> DataFrame:
+    """Move places at the same coordinates apart, evenly on a circle of SPREAD_PIXELS at a zoom level"""
+    places = places.sort_values("address")
+    location = places.groupby(["latitude", "longitude"])
+    count = location["address"].transform("size")
+    angle = 2 * np.pi * location.cumcount() / count
+    # degrees of longitude per pixel, and of latitude, which are shorter away from the equator in web mercator
+    radius = np.where(count > 1, SPREAD_PIXELS * 360 / (256 * 2 ** zoom), 0.0)
+    return places.assign(
+        latitude=places["latitude"] + radius * np.cos(np.radians(places["latitude"])) * np.sin(angle),
+        longitude=places["longitude"] + radius * np.cos(angle),
+    )
@@ -0,0 +1,333 @@
+"""Timing and profiling of the database queries made by the app
+
+Every query run through verden_pa_norsk.database is recorded with a fingerprint of its text,
+the shape of its parameters, its latency and the number of rows returned. Calls to cached page
+functions are recorded as cache hits or misses, see streamlit_tools.cache_data. A sample of the
+queries is profiled with EXPLAIN ANALYZE, on a background thread so the page doesn't wait for it.
+
+Records are kept in memory, the most recent in a ring buffer and running totals per fingerprint.
+They are shown on the admin view of the home page and can be written as a Prometheus text file
+by a writer thread, started by the process that serves the app or queries, see
+start_metrics_writer.
+
+Configured by environment variables:
+    QUERY_PROFILE_RATE: fraction of queries to profile, 0 by default
+    METRICS_PATH: Prometheus text file to write the metrics to, for the node exporter. Each
+        query service worker writes a file of its own next to it, see start_metrics_writer.
+    METRICS_INTERVAL: seconds between writes of the metrics file, 60 by default
+"""
+import bisect
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import duckdb
+
+RING_SIZE = 2000
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "verden_pa_norsk"
+# profiles queued or running at once, further sampled queries are not profiled
+MAX_PENDING_PROFILES = 4
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(query: str) -> str:
+    """Query text with literals and parameter lists replaced, and repeated UNION ALL branches folded"""
+    query = _WHITESPACE.sub(" ", query).strip()
+    query = _LITERAL.sub("?", query)
+    query = _PARAM_LIST.sub("?, ...", query)
+    branches = query.split(" UNION ALL ")
+    folded = [branch for i, branch in enumerate(branches) if i == 0 or branch != branches[i - 1]]
+    return " UNION ALL ".join(folded) + (" UNION ALL ..." if len(folded) < len(branches) else "")
+
+
+def fingerprint(query: str) -> str:
+    return hashlib.sha1(normalize(query).encode()).hexdigest()[:12]
+
+
+def params_shape(params: list | None) -> str:
+    """Types of the parameters, with runs of the same type counted, like 'str*3,int'"""
+    if not params:
+        return ""
+    runs = []
+    for param in params:
+        name = type(param).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return ",".join(name if n == 1 else f"{name}*{n}" for name, n in runs)
+
+
+def _add_labels(sample: str, labels: str) -> str:
+    """Prometheus sample line with more labels"""
+    name_end = min(i for i in (sample.find("{"), sample.find(" ")) if i >= 0)
+    if sample[name_end] == "{":
+        return f"{sample[:name_end + 1]}{labels},{sample[name_end + 1:]}"
+    return f"{sample[:name_end]}{{{labels}}}{sample[name_end:]}"
+
+
+class QueryLog:
+    def __init__(self, ring_size: int = RING_SIZE, profile_rate: float = 0.0):
+        self.profile_rate = profile_rate
+        self.records = deque(maxlen=ring_size)
+        self.queries = {}
+        self.profiles = {}
+        self.caches = {}
+        self.startup = {}
+        # metric name: (help text, function reading the current value)
+        self.gauges = {}
+        # label added to every metric, such as the query service worker
+        self.labels = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiler = None
+        self._pending_profiles = 0
+
+    @contextmanager
+    def cache_scope(self):
+        """Mark queries run inside a cached function as cache misses, see streamlit_tools.cache_data"""
+        stack = self._local.__dict__.setdefault("scopes", [])
+        stack.append(True)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def _in_cache_scope(self) -> bool:
+        return bool(getattr(self._local, "scopes", None))
+
+    def record_cache(self, function: str, hit: bool, seconds: float):
+        with self._lock:
+            totals = self.caches.setdefault(function, {"hits": 0, "misses": 0, "seconds": 0.0})
+            totals["hits" if hit else "misses"] += 1
+            totals["seconds"] += seconds
+
+    def record_startup(self, step: str, seconds: float):
+        """Time of a warm-up step before the server started, see verden_pa_norsk.serve"""
+        with self._lock:
+            self.startup[step] = seconds
+
+    def register_gauge(self, name: str, help_text: str, read):
+        """Export a value kept elsewhere, read when the metrics are written"""
+        self.gauges[name] = (help_text, read)
+
+    def record(self, query: str, params: list | None, seconds: float, rows: int | None, error: str | None = None):
+        key = fingerprint(query)
+        record = {
+            "time": time.time(),
+            "fingerprint": key,
+            "params": params_shape(params),
+            "seconds": seconds,
+            "rows": rows,
+            "cache": "miss" if self._in_cache_scope() else None,
+            "error": error,
+        }
+        with self._lock:
+            self.records.append(record)
+            totals = self.queries.get(key)
+            if totals is None:
+                totals = self.queries[key] = {
+                    "query": normalize(query),
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "rows": 0,
+                    "buckets": [0] * (len(BUCKETS) + 1),
+                }
+            totals["count"] += 1
+            totals["errors"] += error is not None
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            totals["rows"] += rows or 0
+            totals["buckets"][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def should_profile(self) -> bool:
+        return self.profile_rate > 0 and random.random() < self.profile_rate
+
+    def sample_profile(self, con: duckdb.DuckDBPyConnection, query: str, params: list | None):
+        """Profile a sample of the queries in the background, see profile
+
+        Args:
+            con (duckdb.DuckDBPyConnection): the database connection, a cursor of its own is
+                opened on it for the profile
+            query (str): query that was run
+            params (list | None): its parameters
+        """
+        if not self.should_profile():
+            return
+        with self._lock:
+            if self._pending_profiles >= MAX_PENDING_PROFILES:
+                return
+            self._pending_profiles += 1
+            if self._profiler is None:
+                self._profiler = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-profile")
+        self._profiler.submit(self._profile_in_background, con, query, params)
+
+    def _profile_in_background(self, con: duckdb.DuckDBPyConnection, query: str, params: list | None):
+        try:
+            with con.cursor() as cursor:
+                self.profile(cursor, query, params)
+        except duckdb.Error:
+            # the database was closed meanwhile
+            pass
+        finally:
+            with self._lock:
+                self._pending_profiles -= 1
+
+    def profile(self, cursor: duckdb.DuckDBPyConnection, query: str, params: list | None):
+        """Run EXPLAIN ANALYZE for a query and keep the latest profile per fingerprint"""
+        try:
+            plan = cursor.execute("EXPLAIN ANALYZE " + query, params).fetchall()
+        except duckdb.Error as e:
+            plan = [("error", str(e))]
+        with self._lock:
+            self.profiles[fingerprint(query)] = {
+                "time": time.time(),
+                "params": params_shape(params),
+                "plan": "\n".join(row[1] for row in plan),
+            }
+
+    def recent(self) -> list[dict]:
+        with self._lock:
+            return list(self.records)
+
+    def summary(self) -> list[dict]:
+        """Per fingerprint: totals, and latency percentiles over the records still in the ring buffer"""
+        records = self.recent()
+        with self._lock:
+            queries = {key: dict(totals) for key, totals in self.queries.items()}
+        latencies = {}
+        for record in records:
+            latencies.setdefault(record["fingerprint"], []).append(record["seconds"])
+
+        summary = []
+        for key, totals in queries.items():
+            seconds = sorted(latencies.get(key, []))
+            summary.append({
+                "fingerprint": key,
+                "count": totals["count"],
+                "errors": totals["errors"],
+                "mean_ms": 1000 * totals["seconds"] / totals["count"],
+                "p50_ms": 1000 * seconds[len(seconds) // 2] if seconds else None,
+                "p95_ms": 1000 * seconds[int(len(seconds) * 0.95)] if seconds else None,
+                "max_ms": 1000 * totals["max_seconds"],
+                "mean_rows": totals["rows"] / totals["count"],
+                "query": totals["query"],
+            })
+        return sorted(summary, key=lambda row: row["mean_ms"] * row["count"], reverse=True)
+
+    def to_prometheus(self) -> str:
+        """Totals in the Prometheus text exposition format"""
+        with self._lock:
+            queries = {key: dict(totals) for key, totals in self.queries.items()}
+            caches = {name: dict(totals) for name, totals in self.caches.items()}
+            startup = dict(self.startup)
+
+        name = f"{METRIC_PREFIX}_query_duration_seconds"
+        lines = [f"# HELP {name} Latency of database queries by query fingerprint", f"# TYPE {name} histogram"]
+        for key, totals in queries.items():
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), totals["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{fingerprint="{key}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{fingerprint="{key}"}} {totals["seconds"]:.6f}')
+            lines.append(f'{name}_count{{fingerprint="{key}"}} {totals["count"]}')
+
+        for metric, field, help_text in (
+            ("query_rows_total", "rows", "Rows returned by database queries"),
+            ("query_errors_total", "errors", "Failed database queries"),
+        ):
+            lines += [f"# HELP {METRIC_PREFIX}_{metric} {help_text}", f"# TYPE {METRIC_PREFIX}_{metric} counter"]
+            lines += [f'{METRIC_PREFIX}_{metric}{{fingerprint="{key}"}} {totals[field]}' for key, totals in queries.items()]
+
+        name = f"{METRIC_PREFIX}_cache_requests_total"
+        lines += [f"# HELP {name} Calls to cached page functions", f"# TYPE {name} counter"]
+        for function, totals in caches.items():
+            lines.append(f'{name}{{function="{function}",result="hit"}} {totals["hits"]}')
+            lines.append(f'{name}{{function="{function}",result="miss"}} {totals["misses"]}')
+
+        name = f"{METRIC_PREFIX}_startup_seconds"
+        lines += [f"# HELP {name} Time of the warm-up steps before the server started", f"# TYPE {name} gauge"]
+        lines += [f'{name}{{step="{step}"}} {seconds:.6f}' for step, seconds in startup.items()]
+
+        for metric, (help_text, read) in self.gauges.items():
+            lines += [f"# HELP {METRIC_PREFIX}_{metric} {help_text}", f"# TYPE {METRIC_PREFIX}_{metric} gauge", f"{METRIC_PREFIX}_{metric} {read()}"]
+        if self.labels:
+            labels = ",".join(f'{label}="{value}"' for label, value in self.labels.items())
+            lines = [line if line.startswith("#") else _add_labels(line, labels) for line in lines]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write the metrics file atomically, so the collector never reads a partial file"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+query_log = QueryLog(profile_rate=float(os.environ.get("QUERY_PROFILE_RATE", 0)))
+
+
+def _write_metrics(path: str, interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            query_log.write_prometheus(path)
+        except OSError:
+            pass
+
+
+_writer = None
+
+
+def start_metrics_writer(worker: int | None = None):
+    """Write the metrics to METRICS_PATH every METRICS_INTERVAL seconds, if it is set
+
+    Started once per process, by the process that serves the pages or the queries, rather than by
+    whichever module imports this one. Each process writes its own file, as they keep their own
+    records.
+
+    Args:
+        worker (int | None): query service worker, whose metrics are written to METRICS_PATH with
+            the worker number before the extension, and labelled with it
+    """
+    global _writer
+    path = os.environ.get("METRICS_PATH")
+    if not path or _writer is not None:
+        return
+    if worker is not None:
+        root, ext = os.path.splitext(path)
+        path = f"{root}.worker{worker}{ext}"
+        query_log.labels["worker"] = str(worker)
+    _writer = threading.Thread(
+        target=_write_metrics,
+        args=(path, float(os.environ.get("METRICS_INTERVAL", 60))),
+        name="metrics-writer",
+        daemon=True,
+    )
+    _writer.start()
+
+
+@contextmanager
+def timed(query: str, params: list | None):
+    """Record a query run inside the block. Set the 'rows' key of the yielded dict to the number of rows."""
+    result = {"rows": None}
+    t0 = time.perf_counter()
+    try:
+        yield result
+    except Exception as e:
+        query_log.record(query, params, time.perf_counter() - t0, None, type(e).__name__)
+        raise
+    query_log.record(query, params, time.perf_counter() - t0, result["rows"])
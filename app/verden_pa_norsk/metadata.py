@@ -0,0 +1,87 @@
+"""Metadata lookups for the Metadata page
+
+Records for a list of mmsids are fetched in one query per table, and the most recently used
+records are kept in memory. DuckDB only uses the mmsid indexes for equality filters, not for IN
+lists, so a batch is a UNION ALL of parameterized point lookups, at most MAX_MMSIDS of them.
+"""
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from pandas import DataFrame
+
+from verden_pa_norsk.database import fetch_df
+
+CACHE_SIZE = 1024
+# mmsids per lookup, the number of UNION ALL branches of one query
+MAX_MMSIDS = 50
+# tables with the metadata of a book, both indexed on mmsid, see data/src/schema.sql
+TRANSLATIONS = "translations"
+FIRST_EDITIONS = "ol_first_editions"
+
+
+def lookup(table: str, mmsids: list[str]) -> DataFrame:
+    """All rows of a table for a list of at most MAX_MMSIDS mmsids, in one query"""
+    if len(mmsids) > MAX_MMSIDS:
+        raise ValueError(f"At most {MAX_MMSIDS} mmsids can be looked up at once, got {len(mmsids)}")
+    if not mmsids:
+        return fetch_df(f"SELECT * FROM {table} LIMIT 0")
+    query = " UNION ALL ".join([f"SELECT * FROM {table} WHERE mmsid = ?"] * len(mmsids))
+    return fetch_df(query, list(mmsids))
+
+
+class MetadataService:
+    def __init__(self, max_records: int = CACHE_SIZE):
+        self.max_records = max_records
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_books(self, mmsids: list[str]) -> dict[str, tuple[DataFrame, DataFrame]]:
+        """Translation and Open Library rows per mmsid
+
+        Args:
+            mmsids (list[str]): mmsids to look up, of which the first MAX_MMSIDS distinct are used
+
+        Returns:
+            dict[str, tuple[DataFrame, DataFrame]]: the translations row and the ol_first_editions rows
+            for each mmsid, in the order given. Both are empty for an unknown mmsid.
+        """
+        mmsids = list(dict.fromkeys(mmsids))[:MAX_MMSIDS]
+        with self._lock:
+            records = {mmsid: self._records[mmsid] for mmsid in mmsids if mmsid in self._records}
+            for mmsid in records:
+                self._records.move_to_end(mmsid)
+
+        missing = [mmsid for mmsid in mmsids if mmsid not in records]
+        if missing:
+            tr_data = lookup(TRANSLATIONS, missing)
+            ol_data = lookup(FIRST_EDITIONS, missing)
+            fetched = {
+                mmsid: (
+                    tr_data[tr_data["mmsid"] == mmsid].reset_index(drop=True),
+                    ol_data[ol_data["mmsid"] == mmsid].reset_index(drop=True),
+                )
+                for mmsid in missing
+            }
+            records.update(fetched)
+            with self._lock:
+                self._records.update(fetched)
+                while len(self._records) > self.max_records:
+                    self._records.popitem(last=False)
+
+        return {mmsid: records[mmsid] for mmsid in mmsids}
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+def compare(frames: dict[str, DataFrame]) -> DataFrame:
+    """Rows for several mmsids side by side, one column per row, named by mmsid"""
+    columns = []
+    for mmsid, frame in frames.items():
+        for i, (_, row) in enumerate(frame.iterrows()):
+            columns.append(row.rename(mmsid if i == 0 else f"{mmsid} ({i + 1})"))
+    if not columns:
+        return DataFrame(index=next(iter(frames.values())).columns if frames else None)
+    return pd.concat(columns, axis=1)
@@ -1,23 +1,52 @@
+"""Connection to the MongoDB holding the national bibliography
+
+The host and credentials are read from config.cfg next to this file, or a connection string is
+given instead, such as mongodb://localhost:27017 for a local copy. A MongoClient is thread-safe
+and pools its connections, so each configuration gets one client per process, shared by every
+caller and thread.
+"""
+import os
+import threading
 from configparser import ConfigParser
+
 from pymongo import MongoClient
-import os
+from pymongo.collection import Collection
 
 DB = "nasjonalbibliografien4_test"
 COLLECTION = "records"
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.cfg")
+# connections per client, enough for the parallel readers of verden_pa_norsk.bibliography
+POOL_SIZE = 32
 
+_lock = threading.Lock()
+_clients: dict[str, MongoClient] = {}
 
-def connect(db=DB, collection=COLLECTION):
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    config_path = os.path.join(dir_path, "config.cfg")
+
+def get_client(uri: str | None = None) -> MongoClient:
+    """Get the shared client for a connection string, or for config.cfg if none is given"""
+    key = uri or CONFIG_PATH
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = _create_client(uri)
+    return client
+
+
+def _create_client(uri: str | None) -> MongoClient:
+    if uri:
+        return MongoClient(uri, maxPoolSize=POOL_SIZE)
     config = ConfigParser()
-    # config.read("verden_pa_norsk/config.cfg")
-    config.read(config_path)
-
-    client = MongoClient(
-        config["fulltekst_api"]["host"],
-        username=config["fulltekst_api"]["username"],
-        password=config["fulltekst_api"]["pwd"],
-        authSource=config["fulltekst_api"]["authSource"],
+    config.read(CONFIG_PATH)
+    section = config["fulltekst_api"]
+    return MongoClient(
+        section["host"],
+        username=section["username"],
+        password=section["pwd"],
+        authSource=section["authSource"],
+        maxPoolSize=POOL_SIZE,
     )
 
-    return client[db][collection]
+
+def connect(db: str = DB, collection: str = COLLECTION, uri: str | None = None) -> Collection:
+    """Get a collection on the shared client"""
+    return get_client(uri)[db][collection]
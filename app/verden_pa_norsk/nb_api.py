@@ -0,0 +1,135 @@
+"""Client for newspaper search in the National Library API (api.nb.no)
+
+Requests share a pooled session with timeouts and retries. The first result page tells how many
+pages there are, and the rest are fetched concurrently. A page after the first that still fails
+after the retries is left out, so the pages that did arrive are not lost.
+"""
+import functools
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = "https://api.nb.no/catalog/v1/items"
+PAGE_SIZE = 100
+MAX_PAGES = 10
+WORKERS = 4
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 20)
+
+
+@functools.cache
+def get_session() -> requests.Session:
+    """Process-wide session, keeping connections to the API open between requests"""
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def review_query(author: str, title: str) -> str:
+    """Phrase query for author and title within 100 words of each other"""
+    return f"«{author} {title}»~100"
+
+
+def review_params(author: str, title: str, publication_year: int, page: int = 0, size: int = PAGE_SIZE) -> dict:
+    """Query parameters for newspaper pages mentioning a book up to two years after publication"""
+    from_date = str(publication_year) + "0101"
+    to_date = str(publication_year + 2) + "1231"
+    return {
+        "q": review_query(author, title),
+        "filter": ["mediatype:aviser", "contentClasses:jp2", f"date:[{from_date} TO {to_date}]"],
+        "snippets": "aviser",
+        "fragments": 2,
+        "fragSize": 500,
+        "size": size,
+        "page": page,
+        "profile": "nbdigital",
+    }
+
+
+def parse_items(obj: dict, query_string: str) -> list[list]:
+    """Rows of [url, newspaper title, issue date, snippet html] from one result page"""
+    rows = []
+    for item in obj.get("_embedded", {}).get("items", []):
+        urn = item["metadata"]["identifiers"]["urn"]
+        title = item["metadata"]["title"]
+        timestamp = item["metadata"]["originInfo"]["issued"]
+        if "contentFragments" in item:
+            text = item["contentFragments"][0]["text"]
+            pagenumber = item["contentFragments"][0]["pageNumber"]
+            url = f"https://www.nb.no/items/{urn}?searchText={query_string}&page={pagenumber}"
+        else:
+            text = ""
+            url = f"https://www.nb.no/items/{urn}?searchText={query_string}"
+        rows.append([url, title, timestamp, text])
+    return rows
+
+
+def fetch_page(params: dict, api_url: str = API_URL, session: requests.Session | None = None) -> dict:
+    session = session or get_session()
+    r = session.get(api_url, params=params, timeout=TIMEOUT)
+    r.raise_for_status()
+    return r.json()
+
+
+def iter_reviews(
+    author: str,
+    title: str,
+    publication_year: int,
+    api_url: str = API_URL,
+    session: requests.Session | None = None,
+    max_pages: int = MAX_PAGES,
+    workers: int = WORKERS,
+) -> Iterator[tuple[list[list] | None, int]]:
+    """Fetch newspaper pages mentioning a book, one result page at a time
+
+    Pages after the first are fetched concurrently and yielded as they arrive, not in page order. A
+    failure of the first page is raised, since nothing is known without it. A page after the first
+    that fails is yielded as None in place of its rows, and the other pages are still fetched.
+
+    Args:
+        author (str): author name
+        title (str): book title
+        publication_year (int): year the book was published
+        api_url (str): search endpoint, replaceable by a local stub
+        session (requests.Session | None): session to use, the shared pooled session by default
+        max_pages (int): maximum number of result pages to fetch
+        workers (int): maximum number of concurrent requests
+
+    Yields:
+        tuple[list[list] | None, int]: rows from one result page, see parse_items, or None for a page
+        that could not be fetched, and the total number of hits
+    """
+    query_string = review_query(author, title)
+    first = fetch_page(review_params(author, title, publication_year, 0), api_url, session)
+    total = first.get("page", {}).get("totalElements", 0)
+    yield parse_items(first, query_string), total
+
+    n_pages = min(first.get("page", {}).get("totalPages", 1), max_pages)
+    if n_pages <= 1:
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(fetch_page, review_params(author, title, publication_year, page), api_url, session)
+            for page in range(1, n_pages)
+        ]
+        for future in as_completed(futures):
+            try:
+                obj = future.result()
+            except requests.RequestException:
+                yield None, total
+                continue
+            yield parse_items(obj, query_string), total
@@ -0,0 +1,112 @@
+"""In-memory prefix index of the persons named in translations
+
+Every word of every person's name key, see data/src/persons.sql, is kept in one sorted list, so
+the persons with a word starting with a given prefix are a contiguous slice found by bisection. A
+name typed in any order matches the persons with a word starting with each typed word. This
+answers the autocomplete without a query. Filters then join person_books on the person ids,
+instead of casting the name lists of every row to a string.
+"""
+import bisect
+import re
+
+import numpy as np
+from pandas import DataFrame
+
+from verden_pa_norsk.database import fetch_df
+from verden_pa_norsk.search import fold
+
+# search form column: role in person_books
+ROLES = {"main_author": "author", "translators": "translator", "contributors": "contributor"}
+SUGGESTIONS = 8
+# candidates checked word by word rather than intersected with the slice of the next word
+CHECK_LIMIT = 500
+
+_NON_WORD = re.compile(r"[^\w]+|_+")
+
+
+def person_key(name: str) -> str:
+    """Folded words of a name in "first last" order, like the person_key macro in the database"""
+    if "," in name:
+        last, first = name.split(",", 1)
+        name = f"{first} {last}"
+    return _NON_WORD.sub(" ", fold(name)).strip()
+
+
+def person_filter_sql(mmsid: str = "t.mmsid") -> str:
+    """Condition on books by any of a list of persons in a role. Parameters: role, list of person ids."""
+    return f"{mmsid} IN (SELECT mmsid FROM person_books WHERE role = ? AND person_id IN (SELECT unnest(?::BIGINT[])))"
+
+
+class PersonIndex:
+    def __init__(self, persons: DataFrame):
+        """Build the index from the persons table
+
+        Args:
+            persons (DataFrame): person_id, key, name and the number of books per role, ordered by person_id
+        """
+        self.names = persons["name"].tolist()
+        self.keys = persons["key"].tolist()
+        self.books = {role: persons[f"{role}_books"].to_numpy() for role in ROLES.values()}
+        self.books[None] = sum(self.books.values())
+
+        # persons left without books by an incremental refresh keep their id, but are not suggested
+        words = sorted(
+            (word, person_id)
+            for person_id, key, books in zip(persons["person_id"].tolist(), self.keys, self.books[None].tolist())
+            if books > 0
+            for word in set(key.split())
+        )
+        self.words = [word for word, _ in words]
+        self.word_persons = np.array([person_id for _, person_id in words], dtype=np.int64)
+
+    @classmethod
+    def load(cls) -> "PersonIndex":
+        return cls(fetch_df(
+            "SELECT person_id, key, name, author_books, translator_books, contributor_books FROM persons ORDER BY person_id"
+        ))
+
+    def match(self, text: str, role: str | None = None) -> np.ndarray | None:
+        """Ids of the persons with a name word starting with each word of the text
+
+        Args:
+            text (str): name or the start of a name, in any order
+            role (str | None): only persons with books in this role, see ROLES
+
+        Returns:
+            np.ndarray | None: sorted person ids, None if the text holds no words
+        """
+        words = person_key(text).split()
+        if not words:
+            return None
+        slices = []
+        for word in words:
+            lo = bisect.bisect_left(self.words, word)
+            slices.append((bisect.bisect_left(self.words, word + "\U0010ffff", lo) - lo, lo, word))
+        # start from the rarest word, the other words are checked on the few persons left
+        slices.sort()
+        _, lo, _ = slices[0]
+        ids = np.unique(self.word_persons[lo : lo + slices[0][0]])
+        for size, lo, word in slices[1:]:
+            if len(ids) <= min(size, CHECK_LIMIT):
+                ids = np.array([i for i in ids.tolist() if any(w.startswith(word) for w in self.keys[i].split())], dtype=np.int64)
+            else:
+                ids = np.intersect1d(ids, self.word_persons[lo : lo + size])
+        if role is not None:
+            ids = ids[self.books[role][ids] > 0]
+        return ids
+
+    def complete(self, text: str, role: str | None = None, limit: int = SUGGESTIONS) -> list[tuple[int, str, int]]:
+        """Persons matching the text, most books first
+
+        Returns:
+            list[tuple[int, str, int]]: person id, name and number of books in the role
+        """
+        ids = self.match(text, role)
+        if ids is None or len(ids) == 0:
+            return []
+        books = self.books[role][ids]
+        if len(ids) > limit:
+            top = np.argpartition(-books, limit)[:limit]
+            ids, books = ids[top], books[top]
+        order = np.lexsort((ids, -books))
+        return [(int(ids[i]), self.names[ids[i]], int(books[i])) for i in order]
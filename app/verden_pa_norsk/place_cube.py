@@ -0,0 +1,81 @@
+"""In-memory place × year cube for the Kart filters
+
+Book counts per place and year are held as cumulative sums over the years, so the counts for any
+year range are the difference of two columns. A posting list of mmsids per place, sorted by year,
+answers the drill-down into one place without a join.
+"""
+import numpy as np
+from pandas import DataFrame
+
+from verden_pa_norsk.database import fetch_df
+
+
+class PlaceYearCube:
+    def __init__(self, places: DataFrame, counts: DataFrame, postings: DataFrame):
+        """Build the cube from the places, place_year_counts and place_books tables
+
+        Args:
+            places (DataFrame): place_id, address, latitude, longitude and quadkey, ordered by place_id
+            counts (DataFrame): place_id, year and books_published
+            postings (DataFrame): place_id, year and mmsid, ordered by place_id and year
+        """
+        self.places = places.reset_index(drop=True)
+        self.first_year = int(counts["year"].min()) if len(counts) else 0
+        last_year = int(counts["year"].max()) if len(counts) else -1
+        n_years = last_year - self.first_year + 1
+
+        # cumulative[p, i] is the number of books at place p published before first_year + i
+        totals = np.zeros((len(self.places), n_years + 1), dtype=np.int64)
+        np.add.at(
+            totals,
+            (counts["place_id"].to_numpy(), counts["year"].to_numpy() - self.first_year + 1),
+            counts["books_published"].to_numpy(),
+        )
+        self.cumulative = totals.cumsum(axis=1)
+
+        place_ids = postings["place_id"].to_numpy()
+        self.posting_offsets = np.searchsorted(place_ids, np.arange(len(self.places) + 1))
+        self.posting_years = postings["year"].to_numpy()
+        self.posting_mmsids = postings["mmsid"].to_numpy()
+        self.address_places = self.places.groupby("address").groups
+
+    @classmethod
+    def load(cls) -> "PlaceYearCube":
+        """Load the cube from the database"""
+        places = fetch_df("SELECT place_id, address, latitude, longitude, quadkey FROM places ORDER BY place_id")
+        counts = fetch_df("SELECT place_id, year, books_published FROM place_year_counts")
+        postings = fetch_df("SELECT place_id, year, mmsid FROM place_books ORDER BY place_id, year")
+        return cls(places, counts, postings)
+
+    def _year_column(self, year: int) -> int:
+        return int(np.clip(year - self.first_year, 0, self.cumulative.shape[1] - 1))
+
+    def city_data(self, publication_year: tuple[int, int]) -> DataFrame:
+        """Books per place published in a range of years, like load_city_data without author and translator
+
+        Args:
+            publication_year (tuple[int, int]): first and last year, inclusive
+
+        Returns:
+            DataFrame: address, latitude, longitude, quadkey and books_published, for places with any books
+        """
+        start = self._year_column(publication_year[0])
+        end = self._year_column(publication_year[1] + 1)
+        books = self.cumulative[:, end] - self.cumulative[:, start]
+
+        found = np.flatnonzero(books)
+        order = found[np.argsort(-books[found], kind="stable")]
+        data = self.places.iloc[order, 1:].reset_index(drop=True)
+        data["books_published"] = books[order]
+        return data
+
+    def address_mmsids(self, address: str, publication_year: tuple[int, int]) -> list[str]:
+        """mmsids of the books published at an address in a range of years"""
+        mmsids = []
+        for place_id in self.address_places.get(address, []):
+            lo, hi = self.posting_offsets[place_id], self.posting_offsets[place_id + 1]
+            years = self.posting_years[lo:hi]
+            start = lo + np.searchsorted(years, publication_year[0], side="left")
+            end = lo + np.searchsorted(years, publication_year[1], side="right")
+            mmsids.extend(self.posting_mmsids[start:end])
+        return mmsids
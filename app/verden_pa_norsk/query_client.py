@@ -0,0 +1,74 @@
+"""Client of the query service, see verden_pa_norsk.query_service
+
+Queries are posted with their parameters and the rows come back as an Arrow IPC stream, read
+batch by batch as they arrive. Every thread has its own client, so the query of a thread can be
+interrupted from another thread like a DuckDB cursor, by closing its response.
+"""
+import threading
+
+import duckdb
+import pyarrow as pa
+import requests
+from requests.adapters import HTTPAdapter
+
+# seconds to connect, and to wait for the next bytes of a response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 300
+POOL_SIZE = 32
+VERSION_HEADER = "X-Database-Version"
+
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+_local = threading.local()
+
+
+class QueryServiceError(duckdb.Error):
+    """A query failed on the query service, raised like the DuckDB errors of local queries"""
+
+
+class QueryClient:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        # database version of the last response, see verden_pa_norsk.database.database_version
+        self.version = None
+        self._response = None
+
+    def stream(self, query: str, params: list | None = None, batch_size: int | None = None) -> pa.RecordBatchReader:
+        """Run a query on the service, returning a reader of the batches as they arrive"""
+        response = _session.post(
+            f"{self.url}/query",
+            json={"query": query, "params": params, "batch_size": batch_size},
+            stream=True,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        )
+        if response.status_code != 200:
+            message = response.text
+            response.close()
+            raise QueryServiceError(message)
+        self._response = response
+        self.version = response.headers.get(VERSION_HEADER)
+        return pa.ipc.open_stream(response.raw)
+
+    def arrow(self, query: str, params: list | None = None) -> pa.Table:
+        """Run a query on the service and return all rows"""
+        try:
+            return self.stream(query, params).read_all()
+        finally:
+            self.close()
+
+    def close(self):
+        response, self._response = self._response, None
+        if response is not None:
+            response.close()
+
+    def interrupt(self):
+        """Stop the query in progress, from any thread. The service interrupts it when the connection closes."""
+        self.close()
+
+
+def get_client(url: str) -> QueryClient:
+    """Get the client of the current thread"""
+    client = getattr(_local, "client", None)
+    if client is None or client.url != url.rstrip("/"):
+        client = _local.client = QueryClient(url)
+    return client
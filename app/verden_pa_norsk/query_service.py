@@ -0,0 +1,173 @@
+"""HTTP query service running the database queries of the app in separate worker processes
+
+The pages send their queries here when QUERY_SERVICE_URL is set, see verden_pa_norsk.database,
+so a heavy map query or export runs on the cores of the service instead of stalling the Streamlit
+process, and the service can be scaled on its own. The workers are forked after the port is bound
+and each opens the read-only database file itself, so they share its pages in the OS cache. Each
+worker runs several queries at once on a thread pool, and the rows are streamed back in Arrow IPC
+batches as they are produced.
+
+Connections refuse access to files other than the database and cannot change their settings, so
+a query can only read the catalog. The service is still meant for the internal network only.
+
+Run from the app directory:
+
+    python -m verden_pa_norsk.query_service --port 8502 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import pyarrow as pa
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+from verden_pa_norsk.database import configure_database, current_version, get_database
+from verden_pa_norsk.instrumentation import start_metrics_writer, timed
+from verden_pa_norsk.query_client import VERSION_HEADER
+
+PORT = 8502
+BATCH_SIZE = 10_000
+# queries run at once by each worker process
+WORKER_THREADS = 4
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+class _Chunks:
+    """File for the Arrow IPC writer, collecting what it writes until sent"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class QueryHandler(tornado.web.RequestHandler):
+    def initialize(self, pool: ThreadPoolExecutor):
+        self.pool = pool
+        self.cursor = None
+        self.abandoned = False
+
+    def on_connection_close(self):
+        # the client gave up, such as a session that moved on, see verden_pa_norsk.executor
+        self.abandoned = True
+        if self.cursor is not None:
+            self.cursor.interrupt()
+
+    async def post(self):
+        try:
+            body = json.loads(self.request.body)
+            query, params = body["query"], body.get("params")
+            batch_size = int(body.get("batch_size") or BATCH_SIZE)
+        except (ValueError, KeyError, TypeError) as e:
+            raise tornado.web.HTTPError(400, reason=f"Invalid request: {e}")
+
+        # a cursor of its own, as the pool threads take turns producing the batches of many queries
+        self.cursor = cursor = get_database().cursor()
+        self.set_header(VERSION_HEADER, current_version())
+        loop = asyncio.get_running_loop()
+        streaming = False
+        try:
+            with timed(query, params) as result:
+                reader = await loop.run_in_executor(self.pool, lambda: cursor.execute(query, params).fetch_record_batch(batch_size))
+                self.set_header("Content-Type", ARROW_STREAM)
+                streaming = True
+                sink = _Chunks()
+                rows = 0
+                with pa.ipc.new_stream(sink, reader.schema) as writer:
+                    while True:
+                        # batches are produced on the pool, the event loop only sends them
+                        batch = await loop.run_in_executor(self.pool, _next_batch, reader)
+                        if batch is None:
+                            break
+                        writer.write_batch(batch)
+                        rows += batch.num_rows
+                        self.write(sink.take())
+                        await self.flush()
+                self.write(sink.take())
+                result["rows"] = rows
+            self.finish()
+        except (duckdb.Error, StreamClosedError) as e:
+            if self.abandoned:
+                return
+            if not streaming:
+                self.set_status(400)
+                self.finish(str(e))
+            else:
+                # the client reads the stream cut short as an error
+                self.request.connection.stream.close()
+        finally:
+            self.cursor = None
+            cursor.close()
+
+
+def _next_batch(reader: pa.RecordBatchReader) -> pa.RecordBatch | None:
+    try:
+        return reader.read_next_batch()
+    except StopIteration:
+        return None
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write({"status": "ok", "worker": tornado.process.task_id(), "pid": os.getpid()})
+
+
+def make_app(threads: int = WORKER_THREADS) -> tornado.web.Application:
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="query")
+    return tornado.web.Application([
+        (r"/query", QueryHandler, {"pool": pool}),
+        (r"/health", HealthHandler),
+    ])
+
+
+async def serve(sockets: list, threads: int):
+    server = tornado.httpserver.HTTPServer(make_app(threads))
+    server.add_sockets(sockets)
+    await asyncio.Event().wait()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=int(os.environ.get("QUERY_SERVICE_PORT", PORT)))
+    parser.add_argument("--address", default="0.0.0.0")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("QUERY_SERVICE_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=WORKER_THREADS, help="queries run at once by each worker")
+    args = parser.parse_args(args)
+
+    sockets = tornado.netutil.bind_sockets(args.port, args.address)
+    if args.workers > 1:
+        # forked before any database is opened, so no DuckDB state is shared between workers
+        tornado.process.fork_processes(args.workers)
+    configure_database(
+        threads=max(1, (os.cpu_count() or 1) // args.workers),
+        enable_external_access=False,
+        lock_configuration=True,
+    )
+    get_database()
+    start_metrics_writer(tornado.process.task_id() or 0)
+    print(f"query service worker {tornado.process.task_id() or 0} on port {args.port}", flush=True)
+    asyncio.run(serve(sockets, args.threads))
+
+
+if __name__ == "__main__":
+    main()
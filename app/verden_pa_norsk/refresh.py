@@ -0,0 +1,229 @@
+"""Refresh the app database from new parquet sources, applying only what changed
+
+Every source table of load.sql is compared with its new parquet file by a hash of the rows of each
+mmsid, or of the whole table for the tables without mmsid. The inserted, updated and deleted rows
+are applied to a copy of the current database, and the derived tables are updated for the changed
+mmsids only, see data/src/refresh.sql. The copy is written as a new version next to the database,
+and the database path, a symbolic link, is switched to it in one rename. Running apps notice the
+switch and reopen the database, see verden_pa_norsk.database, so there is no restart.
+
+A database built before the derived tables had their table macros, or a missing one, is built in
+full instead.
+
+Usage, from the app directory:
+
+    python -m verden_pa_norsk.refresh [--src data/src] [--db data/translations_map_data.db] [--full]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import time
+
+import duckdb
+
+from verden_pa_norsk.build import SRC_DIR, get_row_counts, make_manifest, manifest_path, publish, remove_old_versions, version_path, write_database
+from verden_pa_norsk.database import DB_PATH
+
+# source tables the derived tables are computed from
+DERIVED_SOURCES = ("translations", "urn_mmsid", "ol_first_editions")
+# table macros of the derived tables, see derived.sql, search_index.sql and persons.sql
+DERIVED_MACROS = ("book_rows", "place_book_rows", "search_posting_rows", "search_document_rows", "person_name_rows")
+REFRESH_STEP = "refresh.sql"
+CHECKPOINT_THRESHOLD = "4GB"
+
+_COPY = re.compile(r"COPY\s+(\w+)\s+FROM\s+'([^']+)'\s*(\([^)]*\))?", re.IGNORECASE)
+
+
+def source_tables(src_dir: str = SRC_DIR) -> list[tuple[str, str, str]]:
+    """Table, file and COPY options of every source in load.sql, in load order"""
+    with open(os.path.join(src_dir, "load.sql"), "r") as file:
+        return [(table, path, options or "") for table, path, options in _COPY.findall(file.read())]
+
+
+def can_refresh(con: duckdb.DuckDBPyConnection) -> bool:
+    """Whether the database has the table macros the incremental update runs"""
+    names = {name for (name,) in con.execute("SELECT function_name FROM duckdb_functions() WHERE function_type = 'table_macro'").fetchall()}
+    return all(macro in names for macro in DERIVED_MACROS)
+
+
+def diff_table(con: duckdb.DuckDBPyConnection, table: str) -> dict[str, int]:
+    """Compare a table with its incoming rows, leaving the changed mmsids in the temp table diff_<table>
+
+    Returns:
+        dict[str, int]: number of mmsids inserted, updated and deleted, or of rows for a table without mmsid
+    """
+    columns = [name for (name,) in con.execute(f"SELECT column_name FROM (DESCRIBE {table})").fetchall()]
+    if "mmsid" not in columns:
+        old, new = (
+            con.execute(f"SELECT count(*), coalesce(sum(hash(t)::HUGEINT), 0) FROM {name} t").fetchone()
+            for name in (table, f"incoming_{table}")
+        )
+        changed = old != new
+        return {"inserted": new[0] if changed else 0, "updated": 0, "deleted": old[0] if changed else 0}
+
+    con.execute(f"""CREATE OR REPLACE TEMP TABLE diff_{table} AS
+        SELECT coalesce(o.mmsid, n.mmsid) AS mmsid, o.mmsid IS NULL AS inserted, n.mmsid IS NULL AS deleted
+        FROM (SELECT mmsid, count(*) AS n, sum(hash(t)::HUGEINT) AS h FROM {table} t GROUP BY mmsid) o
+        FULL JOIN (SELECT mmsid, count(*) AS n, sum(hash(t)::HUGEINT) AS h FROM incoming_{table} t GROUP BY mmsid) n
+            ON o.mmsid = n.mmsid
+        WHERE o.n IS DISTINCT FROM n.n OR o.h IS DISTINCT FROM n.h""")
+    inserted, deleted, total = con.execute(
+        f"SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE deleted), count(*) FROM diff_{table}"
+    ).fetchone()
+    return {"inserted": inserted, "updated": total - inserted - deleted, "deleted": deleted}
+
+
+def refresh_database(src_dir: str = SRC_DIR, db_path: str = DB_PATH, full: bool = False) -> dict:
+    """Bring the database up to date with the sources in src_dir and switch running apps to it
+
+    Args:
+        src_dir (str): directory holding the SQL scripts and parquet sources
+        db_path (str): the database path, which becomes a link to the new version
+        full (bool): build the new version from scratch rather than updating a copy
+
+    Returns:
+        dict: the manifest of the new version, with the changes per source table, or of the current
+            database if nothing changed
+    """
+    started = time.perf_counter()
+    path = version_path(db_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if not full and os.path.exists(db_path):
+        with duckdb.connect(db_path, read_only=True) as con:
+            full = not can_refresh(con)
+    if full or not os.path.exists(db_path):
+        manifest = write_database(src_dir, path)
+        manifest["refresh"] = {"full": True}
+    else:
+        manifest = update_copy(src_dir, db_path, path)
+        if manifest is None:
+            with open(manifest_path(db_path), "r") as file:
+                return {**json.load(file), "refresh": {"full": False, "changes": {}}}
+
+    manifest["timings"]["total"] = round(time.perf_counter() - started, 3)
+    with open(manifest_path(path), "w") as file:
+        json.dump(manifest, file, indent=2)
+    publish(path, db_path)
+    remove_old_versions(db_path)
+    return manifest
+
+
+def update_copy(src_dir: str, db_path: str, path: str) -> dict | None:
+    """Apply the changed source rows and update the derived tables, in a copy of the database at path
+
+    Returns:
+        dict | None: the manifest of the copy, None if nothing changed and no copy was kept
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    tmp_path = path + ".tmp"
+    shutil.copyfile(os.path.realpath(db_path), tmp_path)
+    timings["copy"] = round(time.perf_counter() - t0, 3)
+
+    try:
+        with duckdb.connect(tmp_path) as con:
+            changes, row_counts = apply_changes(con, src_dir, timings)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if changes is None:
+        os.remove(tmp_path)
+        return None
+
+    os.replace(tmp_path, path)
+    manifest = make_manifest(src_dir, path, row_counts, timings)
+    manifest["refresh"] = {"full": False, "base": os.path.basename(os.path.realpath(db_path)), "changes": changes}
+    return manifest
+
+
+def apply_changes(con: duckdb.DuckDBPyConnection, src_dir: str, timings: dict) -> tuple[dict | None, dict]:
+    """Apply the changed rows of every source, then run refresh.sql on the changed mmsids
+
+    Returns:
+        tuple[dict | None, dict]: the changes per source table, None if there were none, and the row counts
+    """
+    con.execute(f"SET file_search_path = '{os.path.dirname(os.path.abspath(src_dir))}'")
+    # one checkpoint at the end, rather than one whenever the WAL grows past the default size,
+    # which writes the large indexes out again each time
+    con.execute(f"SET checkpoint_threshold = '{CHECKPOINT_THRESHOLD}'")
+    sources = source_tables(src_dir)
+
+    t0 = time.perf_counter()
+    changes = {}
+    for table, file_path, options in sources:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE incoming_{table} AS FROM {table} LIMIT 0")
+        con.execute(f"COPY incoming_{table} FROM '{file_path}' {options}")
+        changes[table] = diff_table(con, table)
+    timings["diff"] = round(time.perf_counter() - t0, 3)
+    if not any(any(counts.values()) for counts in changes.values()):
+        return None, {}
+
+    t0 = time.perf_counter()
+    # tables keyed by mmsid have their changed mmsids in diff_<table>, the others are replaced whole
+    keyed = {name.removeprefix("diff_") for (name,) in con.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE temporary AND starts_with(table_name, 'diff_')"
+    ).fetchall()}
+    replaced = {table for table in changes if table not in keyed and any(changes[table].values())}
+    # rows referring to a changed mmsid are replaced as well, so that it can be deleted
+    references = con.execute(
+        "SELECT table_name, referenced_table FROM duckdb_constraints()"
+        " WHERE constraint_type = 'FOREIGN KEY' AND constraint_column_names = ['mmsid']"
+    ).fetchall()
+    for table, referenced in references:
+        if table in keyed and referenced in keyed:
+            con.execute(f"""INSERT INTO diff_{table}
+                SELECT mmsid, false, false FROM diff_{referenced}
+                WHERE mmsid NOT IN (SELECT mmsid FROM diff_{table})""")
+
+    # children are deleted before and inserted after the tables they refer to
+    for table, _, _ in reversed(sources):
+        if table in keyed:
+            con.execute(f"DELETE FROM {table} WHERE mmsid IN (SELECT mmsid FROM diff_{table})")
+        elif table in replaced:
+            con.execute(f"DELETE FROM {table}")
+    for table, _, _ in sources:
+        if table in keyed:
+            con.execute(f"""INSERT INTO {table} SELECT * FROM incoming_{table}
+                WHERE mmsid IN (SELECT mmsid FROM diff_{table} WHERE NOT deleted)""")
+        elif table in replaced:
+            con.execute(f"INSERT INTO {table} SELECT * FROM incoming_{table}")
+    timings["apply"] = round(time.perf_counter() - t0, 3)
+
+    if any(any(changes[table].values()) for table in DERIVED_SOURCES):
+        t0 = time.perf_counter()
+        con.execute("CREATE OR REPLACE TEMP TABLE changed AS "
+                    + " UNION ".join(f"SELECT mmsid FROM diff_{table}" for table in DERIVED_SOURCES))
+        with open(os.path.join(src_dir, REFRESH_STEP), "r") as file:
+            con.execute(file.read())
+        timings[REFRESH_STEP] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    con.execute("ANALYZE")
+    timings["analyze"] = round(time.perf_counter() - t0, 3)
+    row_counts = get_row_counts(con)
+    con.execute("CHECKPOINT")
+    return changes, row_counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the Verden på norsk database from new parquet sources")
+    parser.add_argument("--src", default=SRC_DIR, help="directory with SQL scripts and parquet files")
+    parser.add_argument("--db", default=DB_PATH, help="database path, a link to the current version")
+    parser.add_argument("--full", action="store_true", help="build the new version from scratch")
+    args = parser.parse_args()
+
+    manifest = refresh_database(args.src, args.db, args.full)
+    if manifest["refresh"].get("changes") == {}:
+        print("No changes")
+        return
+    for table, counts in manifest["refresh"].get("changes", {}).items():
+        print(f"{table:<24}" + "".join(f"{n:>10} {name}" for name, n in counts.items()))
+    for step, seconds in manifest.get("timings", {}).items():
+        print(f"{step:<24}{seconds:>11}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Process-wide cache of query results as Arrow tables, within a memory budget
+
+st.cache_data pickles a result on every miss and unpickles a new copy on every hit, and without
+max_entries it keeps every result it has seen. Here results are kept as Arrow tables, which are
+immutable, so every session gets the same table without a copy. Entries are keyed by the function
+and its bound arguments in a canonical form, so equivalent filters in another order, or as lists
+rather than tuples, share one entry. The least recently used entries are evicted when the tables
+outgrow the budget.
+
+Configured by environment variables:
+    RESULT_CACHE_MB: memory budget of the cached tables, 256 by default
+"""
+import functools
+import hashlib
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pyarrow as pa
+
+from verden_pa_norsk.database import on_reload
+from verden_pa_norsk.instrumentation import query_log
+
+MAX_BYTES = int(float(os.environ.get("RESULT_CACHE_MB", 256)) * 1024**2)
+# results larger than this share of the budget are not cached, so one cannot flush the rest
+MAX_ENTRY_SHARE = 0.25
+
+
+def canonical(value):
+    """Hashable form of an argument, the same for equal dicts, sequences and sets of any order or type"""
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((str(key), canonical(item)) for key, item in value.items())))
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted(canonical(item) for item in value)))
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def cache_key(func, args: tuple, kwargs: dict) -> str:
+    """Key of a call, from the function, its code and its arguments with the defaults filled in"""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    code = hashlib.sha1(func.__code__.co_code + repr(func.__code__.co_consts).encode()).hexdigest()
+    arguments = canonical(dict(bound.arguments))
+    return hashlib.sha1(repr((func.__module__, func.__qualname__, code, arguments)).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self.skipped = 0
+        self._entries: OrderedDict[str, pa.Table] = OrderedDict()
+        # key: set once the call computing it is done, so concurrent misses compute it only once
+        self._pending: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> pa.Table | None:
+        with self._lock:
+            table = self._entries.get(key)
+            if table is not None:
+                self._entries.move_to_end(key)
+            return table
+
+    def put(self, key: str, table: pa.Table):
+        size = table.get_total_buffer_size()
+        with self._lock:
+            if size > self.max_bytes * MAX_ENTRY_SHARE:
+                self.skipped += 1
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.get_total_buffer_size()
+            self._entries[key] = table
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.get_total_buffer_size()
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "skipped": self.skipped,
+            }
+
+    def get_or_compute(self, key: str, compute) -> tuple[pa.Table, bool]:
+        """Cached table of a key, computed on a miss
+
+        Returns:
+            tuple[pa.Table, bool]: the table, and whether it was cached
+        """
+        while True:
+            with self._lock:
+                table = self._entries.get(key)
+                if table is not None:
+                    self._entries.move_to_end(key)
+                    return table, True
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # computed by another call, which may fail, so look again when it is done
+            pending.wait()
+
+        try:
+            table = compute()
+            self.put(key, table)
+            return table, False
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def cached(self, func):
+        """Decorate a function returning a pa.Table, recording hits and misses in the query log
+
+        The undecorated function is available as __wrapped__, and clear empties the whole cache.
+        """
+        name = func.__qualname__
+
+        def compute(args, kwargs):
+            with query_log.cache_scope():
+                return func(*args, **kwargs)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            table, hit = self.get_or_compute(cache_key(func, args, kwargs), lambda: compute(args, kwargs))
+            query_log.record_cache(name, hit, time.perf_counter() - t0)
+            return table
+
+        wrapper.clear = self.clear
+        return wrapper
+
+
+result_cache = ResultCache()
+cache_table = result_cache.cached
+on_reload(result_cache.clear)
+
+query_log.register_gauge("result_cache_bytes", "Memory held by the cached query results", lambda: result_cache.stats()["bytes"])
+query_log.register_gauge("result_cache_entries", "Number of cached query results", lambda: result_cache.stats()["entries"])
@@ -0,0 +1,181 @@
+"""On-disk cache of review search results, shared by every app process
+
+Results are stored in an SQLite file in WAL mode, so concurrent readers and writers in separate
+processes see the same entries. Entries expire after a TTL, and the least recently used entries are
+evicted when the cache outgrows its size budget. Empty results are cached too, with a shorter TTL.
+
+A hit only reads, so readers don't wait for each other on the write lock: the access time of an
+entry is updated at most once per ACCESS_INTERVAL, and hit and miss counts are kept in memory and
+added to the file every FLUSH_INTERVAL seconds. The size of the entries is kept as a running total
+in the counters table, updated by every write.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+CACHE_PATH = "data/review_cache.sqlite"
+TTL = 7 * 24 * 3600
+NEGATIVE_TTL = 24 * 3600
+MAX_BYTES = 200 * 1024 * 1024
+# seconds an access time may lag behind, the resolution of least recently used eviction
+ACCESS_INTERVAL = 3600
+# seconds between writes of the hit and miss counters of a process
+FLUSH_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews(
+    key TEXT PRIMARY KEY,
+    rows TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reviews_accessed ON reviews(accessed);
+CREATE INDEX IF NOT EXISTS reviews_expires ON reviews(expires);
+CREATE TABLE IF NOT EXISTS counters(name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+-- the running total of reviews.size, for a file written before it was kept
+INSERT OR IGNORE INTO counters(name, value) SELECT 'bytes', coalesce(sum(size), 0) FROM reviews;
+"""
+
+
+class ReviewCache:
+    def __init__(
+        self,
+        path: str = CACHE_PATH,
+        ttl: float = TTL,
+        negative_ttl: float = NEGATIVE_TTL,
+        max_bytes: int = MAX_BYTES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        # hits and misses of this process not yet added to the counters table
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        "SQLite connections can't be shared between threads, so each thread opens its own"
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+        return con
+
+    @staticmethod
+    def make_key(*args) -> str:
+        return json.dumps(args, ensure_ascii=False)
+
+    def _count(self, con: sqlite3.Connection, name: str, n: int = 1):
+        con.execute(
+            "INSERT INTO counters(name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    def _count_later(self, name: str):
+        """Count a hit or miss in memory, and add the counts to the file if they are due"""
+        with self._counts_lock:
+            self._counts[name] += 1
+            due = time.monotonic() - self._flushed >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the hit and miss counts of this process to the counters table"""
+        with self._counts_lock:
+            counts, self._counts = self._counts, Counter()
+            self._flushed = time.monotonic()
+        if counts:
+            con = self._connection()
+            with con:
+                con.execute("BEGIN")
+                for name, n in counts.items():
+                    self._count(con, name, n)
+
+    def get(self, key: str) -> list | None:
+        """Get the cached rows for a key, or None on a miss. An empty list is a cached empty result."""
+        con = self._connection()
+        now = time.time()
+        row = con.execute("SELECT rows, expires, accessed FROM reviews WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            self._count_later("misses")
+            return None
+        if now - row[2] >= ACCESS_INTERVAL:
+            con.execute("UPDATE reviews SET accessed = ? WHERE key = ?", (now, key))
+        self._count_later("hits")
+        return json.loads(row[0])
+
+    def peek_many(self, keys: list[str]) -> dict[str, list]:
+        """Get the cached rows for several keys, leaving hit counters and recency untouched"""
+        con = self._connection()
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            found.update(
+                (key, json.loads(rows))
+                for key, rows in con.execute(
+                    f"SELECT key, rows FROM reviews WHERE key IN ({', '.join('?' * len(chunk))}) AND expires >= ?",
+                    (*chunk, time.time()),
+                )
+            )
+        return found
+
+    def set(self, key: str, rows: list, ttl: float | None = None):
+        """Store rows for a key, evicting expired and least recently used entries if over budget
+
+        The entry expires after ttl seconds if given, otherwise after the TTL of a result or an empty result.
+        """
+        con = self._connection()
+        now = time.time()
+        data = json.dumps(rows, ensure_ascii=False, default=str)
+        if ttl is None:
+            ttl = self.ttl if rows else self.negative_ttl
+        # one transaction, so the running total of sizes stays in step with the entries
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            old = con.execute("SELECT size FROM reviews WHERE key = ?", (key,)).fetchone()
+            con.execute(
+                "INSERT OR REPLACE INTO reviews(key, rows, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + ttl, now),
+            )
+            self._count(con, "bytes", len(data) - (old[0] if old else 0))
+            self._evict(con, now)
+
+    def _evict(self, con: sqlite3.Connection, now: float):
+        expired = con.execute("SELECT coalesce(sum(size), 0) FROM reviews WHERE expires < ?", (now,)).fetchone()[0]
+        if expired:
+            con.execute("DELETE FROM reviews WHERE expires < ?", (now,))
+            self._count(con, "bytes", -expired)
+        total = con.execute("SELECT value FROM counters WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # drop the least recently used entries until the rest fits the budget
+        cutoff = con.execute(
+            """SELECT accessed FROM (
+                SELECT accessed, sum(size) OVER (ORDER BY accessed DESC) AS kept FROM reviews
+            ) WHERE kept > ? ORDER BY accessed DESC LIMIT 1""",
+            (self.max_bytes,),
+        ).fetchone()
+        if cutoff is not None:
+            size, deleted = con.execute(
+                "SELECT coalesce(sum(size), 0), count(*) FROM reviews WHERE accessed <= ?", (cutoff[0],)
+            ).fetchone()
+            con.execute("DELETE FROM reviews WHERE accessed <= ?", (cutoff[0],))
+            self._count(con, "bytes", -size)
+            self._count(con, "evictions", deleted)
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counters across all processes, and the current size of the cache"""
+        self.flush()
+        con = self._connection()
+        stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+        stats.update(dict(con.execute("SELECT name, value FROM counters").fetchall()))
+        stats["entries"] = con.execute("SELECT count(*) FROM reviews").fetchone()[0]
+        return stats
@@ -1,11 +1,39 @@
+"""Newspaper reviews of books from the dhlab corpus and concordance API
+
+A heuristic for finding reviews: a corpus of newspapers mentioning author and title near each
+other, and the concordances of title and author in it. The Omtaler page searches api.nb.no
+instead, see verden_pa_norsk.reviews, so the app doesn't call this module. It is kept as the
+dhlab variant of the search, for use from notebooks and scripts.
+"""
+import functools
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
 from dhlab import Corpus, Concordance
 
+CORPUS_LIMIT = 100
+CORPUS_CACHE_SIZE = 256
+# number of newspaper URNs per concordance request
+CHUNK_SIZE = 20
+# the dhlab API allows windows of 1-25 tokens, and at most 1000 concordances per document
+CONC_WINDOW = 25
+CONC_LIMIT = 50
+MAX_HITS = 2000
+WORKERS = 4
+
 
-def build_corpus(author: str, title: str, publication_year: int) -> Corpus:
-    """Get corpus
+@functools.lru_cache(maxsize=CORPUS_CACHE_SIZE)
+def build_corpus(author: str, title: str, publication_year: int, corpus_cls=Corpus) -> Corpus:
+    """Get corpus, cached per book
+
+    The cached corpus is shared between callers and should not be modified.
 
     Args:
         author (str): Author name to search for
+        title (str): book title
+        publication_year (int): year the book was published
+        corpus_cls: dhlab Corpus, or a fake with the same constructor in tests
 
     Returns:
         Corpus: dhlab Corpus object contining newspaper mentioning author
@@ -13,44 +41,96 @@ def build_corpus(author: str, title: str, publication_year: int) -> Corpus:
 
     fulltext = f"NEAR({author} {title}, 1000)"
 
-    corpus = Corpus(
-        doctype="digavis", from_year=publication_year, to_year=publication_year + 2, fulltext=fulltext, limit=100
+    corpus = corpus_cls(
+        doctype="digavis", from_year=publication_year, to_year=publication_year + 2, fulltext=fulltext, limit=CORPUS_LIMIT
     )
     return corpus
 
 
-def get_concs_for_author(corpus: Corpus, title: str, author: str) -> Concordance:
+def build_corpora(books: list[tuple], workers: int = WORKERS, corpus_cls=Corpus) -> dict[tuple, Corpus]:
+    """Build corpora for many books in parallel
+
+    Args:
+        books (list[tuple]): (author, title, publication_year) tuples
+        workers (int): maximum number of concurrent requests
+        corpus_cls: dhlab Corpus, or a fake with the same constructor in tests
+
+    Returns:
+        dict[tuple, Corpus]: corpus per book
+    """
+    books = list(dict.fromkeys(books))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        corpora = executor.map(lambda book: build_corpus(*book, corpus_cls=corpus_cls), books)
+        return dict(zip(books, corpora))
+
+
+def iter_concordances(
+    corpus: Corpus,
+    query: str,
+    chunk_size: int = CHUNK_SIZE,
+    window: int = CONC_WINDOW,
+    limit: int = CONC_LIMIT,
+    concordance_cls=Concordance,
+) -> Iterator[pd.DataFrame]:
+    """Get concordances a chunk of documents at a time
+
+    Args:
+        corpus (Corpus): target corpus
+        query (str): word or fulltext query
+        chunk_size (int): number of documents per request
+        window (int): tokens on either side of a hit
+        limit (int): maximum number of concordances per document
+        concordance_cls: dhlab Concordance, or a fake with the same constructor in tests
+
+    Yields:
+        pd.DataFrame: link, urn and concordance columns for one chunk of documents
+    """
+    urns = list(corpus.frame.urn) if len(corpus.frame) else []
+    for i in range(0, len(urns), chunk_size):
+        concs = concordance_cls(corpus=urns[i : i + chunk_size], query=query, window=window, limit=limit)
+        if len(concs.frame):
+            yield concs.frame
+
+
+def get_concs_for_author(corpus: Corpus, title: str, author: str, max_hits: int = MAX_HITS, concordance_cls=Concordance) -> Concordance:
     """Get concordances for a title and author in a dhlab corpus
 
     Args:
         corpus (Corpus): target corpus
         title (str): book title
         author (str): author name
+        max_hits (int): stop fetching once this many concordances are found
+        concordance_cls: dhlab Concordance, or a fake with the same constructor and from_df in tests
 
     Returns:
         Concordance: author and book collocations
     """
     query = f"{title} AND {author}"  # Contruct query
 
-    colls = Concordance(
-        corpus=corpus,
-        query=query,
-        window=1000,  # Window as high as possible
-        limit=10000000,  # Limit as high as possible
-    )
-    return colls
+    chunks = []
+    hits = 0
+    for chunk in iter_concordances(corpus, query, concordance_cls=concordance_cls):
+        chunks.append(chunk)
+        hits += len(chunk)
+        if hits >= max_hits:
+            break
 
+    frame = pd.concat(chunks, ignore_index=True).head(max_hits) if chunks else pd.DataFrame(columns=["link", "urn", "concordance"])
+    return concordance_cls.from_df(frame)
 
-def get_reviews(author: str, title: str, publication_year: int) -> Concordance:
+
+def get_reviews(author: str, title: str, publication_year: int, corpus_cls=Corpus, concordance_cls=Concordance) -> Concordance:
     """Heuristic to get reviews for a book. Searches concordances for author and title in corpus
 
     Args:
         author (str): author name
         title (str): book title
+        publication_year (int): year the book was published
+        corpus_cls: dhlab Corpus, or a fake with the same constructor in tests
+        concordance_cls: dhlab Concordance, or a fake with the same constructor and from_df in tests
 
     Returns:
         Concordance: resulting concorances. Use style method to render as HTML
     """
-    corpus = build_corpus(author, title, publication_year)
-    #colls = get_concs_for_author(corpus, title, author)
-    return corpus
+    corpus = build_corpus(author, title, publication_year, corpus_cls=corpus_cls)
+    return get_concs_for_author(corpus, title, author, concordance_cls=concordance_cls)
@@ -0,0 +1,178 @@
+"""Newspaper reviews of books, fetched from api.nb.no and kept in the review cache
+
+Full results are cached per book for the Omtaler page, and hit counts for the review column in
+Boksøk. A result missing pages that could not be fetched is cached for as long as an empty result,
+and marked as incomplete. ReviewPrefetcher fetches the first result page for many books in the background, which
+gives the hit count and, for books with a single page of hits, the full result. When the API
+fails, the book is marked as failed in the cache for a while, and the prefetcher backs off.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from verden_pa_norsk.nb_api import iter_reviews
+from verden_pa_norsk.review_cache import ReviewCache
+from verden_pa_norsk.snippets import sanitize_snippets
+
+WORKERS = 4
+# seconds a book whose fetch failed is left uncounted, before a search may queue it again
+FAILURE_TTL = 600
+# seconds the prefetcher stops fetching after a failure, doubled for every failure in a row
+BACKOFF = 10
+MAX_BACKOFF = 600
+
+
+def get_reviews_nb(author, title, publication_year):
+    """Review rows from api.nb.no with sanitized snippets, one result page at a time, see iter_reviews"""
+    for rows, total in iter_reviews(author, title, publication_year):
+        if rows is None:
+            yield rows, total
+            continue
+        for row, snippet in zip(rows, sanitize_snippets(row[3] for row in rows)):
+            row[3] = snippet
+        yield rows, total
+
+
+def review_key(cache: ReviewCache, author: str, title: str, publication_year: int) -> str:
+    return cache.make_key(author, title, int(publication_year))
+
+
+def count_key(cache: ReviewCache, author: str, title: str, publication_year: int) -> str:
+    return cache.make_key("count", author, title, int(publication_year))
+
+
+def failure_key(cache: ReviewCache, author: str, title: str, publication_year: int) -> str:
+    return cache.make_key("failed", author, title, int(publication_year))
+
+
+def partial_key(cache: ReviewCache, author: str, title: str, publication_year: int) -> str:
+    return cache.make_key("partial", author, title, int(publication_year))
+
+
+def set_count(cache: ReviewCache, book: tuple, total: int):
+    # stored as an empty list when there are no hits, to expire as early as other empty results
+    cache.set(count_key(cache, *book), [total] if total else [])
+
+
+def get_cached_reviews(cache: ReviewCache, author, title, publication_year, on_page=None) -> tuple[list[list], int | None, bool]:
+    """Reviews from the cache, fetched from api.nb.no on a miss
+
+    Args:
+        cache (ReviewCache): cache to read from and store results in
+        author (str): author name
+        title (str): book title
+        publication_year (int): year the book was published
+        on_page (callable | None): on a miss, called with the rows fetched so far and the total number
+            of hits after every result page
+
+    Returns:
+        tuple[list[list], int | None, bool]: rows of [url, newspaper title, issue date, snippet html],
+        the total number of hits, None if it is no longer cached, and whether every result page was fetched
+    """
+    book = (author, title, publication_year)
+    key = review_key(cache, *book)
+    rows = cache.get(key)
+    if rows is not None:
+        cached = cache.peek_many([count_key(cache, *book), partial_key(cache, *book)])
+        total = (cached[count_key(cache, *book)] or [0])[0] if count_key(cache, *book) in cached else None
+        return rows, total, partial_key(cache, *book) not in cached
+
+    rows = []
+    total = 0
+    complete = True
+    for page_rows, total in get_reviews_nb(*book):
+        if page_rows is None:
+            complete = False
+            continue
+        rows.extend(page_rows)
+        if on_page is not None:
+            on_page(rows, total)
+    if complete:
+        cache.set(key, rows)
+    else:
+        # fetched again when the marker expires, as for an empty result
+        cache.set(key, rows, ttl=cache.negative_ttl)
+        cache.set(partial_key(cache, *book), [], ttl=cache.negative_ttl)
+    set_count(cache, book, total)
+    return rows, total, complete
+
+
+def _book(book: tuple) -> tuple | None:
+    """(author, title, publication_year) with a plain int year, None if any part is missing"""
+    author, title, publication_year = book
+    if not author or not title or publication_year is None or publication_year != publication_year:
+        return None
+    return author, title, int(publication_year)
+
+
+class ReviewPrefetcher:
+    """Background pool fetching review hit counts for search results
+
+    At most `workers` requests run at once, shared by every session in the process. Books already
+    counted or in flight are skipped, so overlapping searches don't fetch a book twice. A failed
+    fetch, such as a 429 or 5xx from the API after the retries of the session, marks the book as
+    failed for FAILURE_TTL seconds, so it isn't queued again by every search or rerun, and stops
+    all fetches for a backoff period. Books reached during the backoff are marked as failed until
+    it ends.
+    """
+
+    def __init__(self, cache: ReviewCache, workers: int = WORKERS):
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="review-prefetch")
+        self._lock = threading.Lock()
+        self._pending = set()
+        # failures in a row, and the time fetching resumes after the last one
+        self._failures = 0
+        self._resume_at = 0.0
+
+    def submit(self, books: list[tuple]):
+        """Queue (author, title, publication_year) tuples whose hit counts are not cached, and haven't failed lately"""
+        books = list(dict.fromkeys(filter(None, map(_book, books))))
+        cached = self.cache.peek_many(
+            [count_key(self.cache, *book) for book in books] + [failure_key(self.cache, *book) for book in books]
+        )
+        for book in books:
+            if count_key(self.cache, *book) in cached or failure_key(self.cache, *book) in cached:
+                continue
+            with self._lock:
+                if book in self._pending:
+                    continue
+                self._pending.add(book)
+            self._executor.submit(self._fetch, book)
+
+    def _fetch(self, book: tuple):
+        try:
+            with self._lock:
+                backoff = self._resume_at - time.time()
+            if backoff > 0:
+                # left for a search after the backoff
+                self.cache.set(failure_key(self.cache, *book), [], ttl=backoff)
+                return
+            # only the first result page, the rest is fetched if the book is opened in Omtaler
+            rows, total = next(get_reviews_nb(*book))
+            if len(rows) >= total:
+                self.cache.set(review_key(self.cache, *book), rows)
+            set_count(self.cache, book, total)
+            with self._lock:
+                self._failures = 0
+        except Exception:
+            with self._lock:
+                self._failures += 1
+                backoff = min(BACKOFF * 2 ** (self._failures - 1), MAX_BACKOFF)
+                self._resume_at = max(self._resume_at, time.time() + backoff)
+            # left uncounted, and tried again when the book turns up in a search after the marker expires
+            self.cache.set(failure_key(self.cache, *book), [], ttl=max(backoff, FAILURE_TTL))
+        finally:
+            with self._lock:
+                self._pending.discard(book)
+
+    def counts(self, books: list[tuple]) -> list[int | None]:
+        """Review hit counts for books, None where the count is missing"""
+        keys = [count_key(self.cache, *book) if book else None for book in map(_book, books)]
+        cached = self.cache.peek_many([key for key in keys if key])
+        return [(cached[key] or [0])[0] if key in cached else None for key in keys]
+
+    def pending(self, books: list[tuple]) -> bool:
+        """Whether any of the books is queued or being fetched"""
+        with self._lock:
+            return any(book in self._pending for book in map(_book, books))
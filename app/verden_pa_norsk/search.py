@@ -0,0 +1,72 @@
+import re
+import unicodedata
+
+# Free-text fields covered by the index built in data/src/search_index.sql
+SEARCH_FIELDS = ("title", "main_author", "original_title", "publisher")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_TOKEN_SPLIT = re.compile(r"[^\w]+|_+")
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip diacritics the same way as the search_fold macro in the database"""
+    text = text.lower().replace("ø", "o").replace("æ", "ae")
+    return "".join(c for c in unicodedata.normalize("NFD", text) if unicodedata.category(c) != "Mn")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into folded search tokens"""
+    return [token for token in _TOKEN_SPLIT.split(fold(text)) if token]
+
+
+def ranked_hits(queries: dict[str, str]) -> tuple[str, list]:
+    """Build a query ranking translations against free-text input for one or more fields
+
+    Every token has to match the start of a term in its field. Documents are scored with BM25,
+    summed over all tokens.
+
+    Args:
+        queries (dict[str, str]): free-text input keyed by field name, see SEARCH_FIELDS
+
+    Returns:
+        tuple[str, list]: query returning (mmsid, score), and its parameters. The query is empty if
+        the input holds no tokens.
+    """
+    ctes = []
+    params = []
+    for field, text in queries.items():
+        for token in tokenize(text):
+            i = len(ctes)
+            ctes.append(
+                f"""hits_{i} AS (
+                SELECT m.mmsid,
+                    ln(1 + (f.n_documents - df.n + 0.5) / (df.n + 0.5))
+                    * m.tf * {K1 + 1} / (m.tf + {K1} * (1 - {B} + {B} * d.length / f.avg_length)) AS score
+                FROM (
+                    SELECT mmsid, sum(tf) AS tf
+                    FROM search_postings
+                    WHERE field = ? AND term >= ? AND term < ?
+                    GROUP BY mmsid
+                ) m
+                JOIN search_documents d ON d.field = ? AND d.mmsid = m.mmsid
+                JOIN search_fields f ON f.field = ?
+                CROSS JOIN (
+                    SELECT count(DISTINCT mmsid) AS n
+                    FROM search_postings
+                    WHERE field = ? AND term >= ? AND term < ?
+                ) df
+            )"""
+            )
+            upper = token + "\U0010ffff"
+            params.extend([field, token, upper, field, field, field, token, upper])
+
+    if not ctes:
+        return "", []
+
+    score = " + ".join(f"hits_{i}.score" for i in range(len(ctes)))
+    joins = " ".join(f"JOIN hits_{i} USING (mmsid)" for i in range(1, len(ctes)))
+    query = f"WITH {', '.join(ctes)} SELECT mmsid, {score} AS score FROM hits_0 {joins}"
+    return query, params
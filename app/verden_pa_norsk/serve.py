@@ -0,0 +1,98 @@
+"""Start the app after warming up the process, so the first visitor doesn't pay for a cold start
+
+Imports the heavy libraries, opens the database and fills the caches every visitor needs (the
+catalog lookups, the person index, the home page markdown and the default map) before Streamlit
+opens its port, then starts the server in the same process, which keeps the warm caches. The
+time of each step is printed, and shown on the admin view and in the metrics, see
+verden_pa_norsk.instrumentation.
+
+Run from the app directory, with the options of streamlit run:
+
+    python -m verden_pa_norsk.serve --server.port 8501
+"""
+import importlib
+import sys
+import time
+from contextlib import contextmanager
+
+from streamlit import config, logger
+
+APP_SCRIPT = "Hjem.py"
+# the home page, see Hjem.py
+DOC_PATH = "resources/markdown/Document.md"
+HEAVY_MODULES = ("pandas", "duckdb", "requests", "folium", "streamlit_folium")
+# default view of the Kart page
+DEFAULT_YEARS = (1800, 2024)
+DEFAULT_ZOOM = 2
+
+
+@contextmanager
+def step(timings: dict[str, float], name: str):
+    t0 = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - t0
+    print(f"warm-up: {name:<24}{1000 * timings[name]:>8.0f} ms", flush=True)
+
+
+def warm_up() -> dict[str, float]:
+    """Run the warm-up steps and return the seconds each took"""
+    timings = {}
+    # the caches are filled outside a script run, which Streamlit warns about on every call. The
+    # log level is set from the Streamlit config again when the server starts, so the config is
+    # parsed first.
+    config.get_config_options()
+    logger.set_log_level("error")
+
+    for module in HEAVY_MODULES:
+        with step(timings, f"import {module}"):
+            importlib.import_module(module)
+
+    with step(timings, "import verden_pa_norsk"):
+        from verden_pa_norsk import catalog, streamlit_tools
+        from verden_pa_norsk.database import fetch_all
+        from verden_pa_norsk.geo import WORLD_BOUNDS, cluster_places
+        from verden_pa_norsk.instrumentation import query_log
+
+    with step(timings, "database"):
+        fetch_all("SELECT count(*) FROM translations")
+
+    with step(timings, "catalog"):
+        catalog.get_column_names_and_types("translations")
+        catalog.get_available_languages()
+
+    with step(timings, "markdown"):
+        streamlit_tools.get_text_file(DOC_PATH)
+
+    with step(timings, "person index"):
+        streamlit_tools.get_person_index()
+
+    with step(timings, "place cube"):
+        data = streamlit_tools.get_place_cube().city_data(DEFAULT_YEARS)
+
+    with step(timings, "default map"):
+        import folium
+
+        cluster_places(data, DEFAULT_ZOOM, WORLD_BOUNDS)
+        # compiles the templates used to render every map
+        folium.Map(zoom_start=DEFAULT_ZOOM).get_root().render()
+
+    timings["total"] = sum(timings.values())
+    print(f"warm-up: {'total':<24}{1000 * timings['total']:>8.0f} ms", flush=True)
+    for name, seconds in timings.items():
+        query_log.record_startup(name, seconds)
+    return timings
+
+
+def main(args: list[str]):
+    warm_up()
+    from verden_pa_norsk.instrumentation import start_metrics_writer
+
+    start_metrics_writer()
+
+    from streamlit.web import cli
+
+    cli.main(["run", APP_SCRIPT, *args], prog_name="streamlit")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+"""Sanitizing of highlighted search snippets from api.nb.no
+
+Snippets are HTML fragments where the search terms are wrapped in <em>. The sanitizer scans each
+fragment once with a regular expression, keeps the highlighting as <strong> and drops every other
+tag. Text is unescaped and escaped again, so the output is safe to render as HTML.
+"""
+import html
+import re
+from collections.abc import Iterable
+
+# tags, comments, doctypes and processing instructions. A "<" not followed by any of these is text.
+_TOKEN = re.compile(
+    r"<(?P<close>/?)(?P<name>[a-zA-Z][^\s/>]*)(?:\s[^>]*)?/?>"
+    r"|<!--.*?(?:-->|$)"
+    r"|<[!?][^>]*(?:>|$)",
+    re.DOTALL,
+)
+
+# elements whose content is never shown
+_HIDDEN = frozenset(("script", "style", "template", "title"))
+
+
+def _text(text: str) -> str:
+    return html.escape(html.unescape(text), quote=False) if text else ""
+
+
+def sanitize_snippet(snippet: str | None) -> str:
+    """Keep <em> as <strong>, drop all other tags and escape the text
+
+    Highlighting left open at the end of a snippet, as when a snippet is cut off, is closed.
+    """
+    if not snippet:
+        return ""
+    if "<" not in snippet and ">" not in snippet and "&" not in snippet:
+        return snippet
+
+    out = []
+    pos = 0
+    depth = 0
+    hidden = None
+    for match in _TOKEN.finditer(snippet):
+        if hidden is None:
+            out.append(_text(snippet[pos : match.start()]))
+        pos = match.end()
+
+        name = match.group("name")
+        if name is None:
+            continue
+        name = name.lower()
+        closing = bool(match.group("close"))
+
+        if hidden is not None:
+            if closing and name == hidden:
+                hidden = None
+        elif name in _HIDDEN and not closing:
+            hidden = name
+        elif name == "em":
+            if not closing:
+                out.append("<strong>")
+                depth += 1
+            elif depth:
+                out.append("</strong>")
+                depth -= 1
+
+    if hidden is None:
+        out.append(_text(snippet[pos:]))
+    out.append("</strong>" * depth)
+    return "".join(out)
+
+
+def sanitize_snippets(snippets: Iterable[str | None]) -> list[str]:
+    """Sanitize a batch of snippets, see sanitize_snippet"""
+    return [sanitize_snippet(snippet) for snippet in snippets]
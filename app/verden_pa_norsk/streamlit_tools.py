@@ -1,8 +1,265 @@
-import streamlit as st
+import contextlib
+import functools
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
 import duckdb
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+from verden_pa_norsk.database import get_cursor, on_reload
+from verden_pa_norsk.executor import QueryExecutor
+from verden_pa_norsk.instrumentation import query_log
+from verden_pa_norsk.review_cache import ReviewCache
+
+# imported by the getters and widgets that use them, so that a page only imports what it needs
+if TYPE_CHECKING:
+    from verden_pa_norsk.export import Exporter, ExportJob
+    from verden_pa_norsk.metadata import MetadataService
+    from verden_pa_norsk.persons import PersonIndex
+    from verden_pa_norsk.place_cube import PlaceYearCube
+    from verden_pa_norsk.reviews import ReviewPrefetcher
+
+# bounds of every cache_data cache unless given, larger results go to verden_pa_norsk.result_cache
+CACHE_ENTRIES = 500
+CACHE_TTL = 3600
+# seconds between updates of the progress of an export
+EXPORT_REFRESH = 1
+# per thread, whether each cached call in progress was a hit so far
+_cache_calls = threading.local()
+
+
+def load_database(db_path) -> duckdb.DuckDBPyConnection:
+    """Get the current thread's cursor on the shared read-only database, see verden_pa_norsk.database"""
+    return get_cursor(db_path)
 
 
 @st.cache_resource
-def load_database(db_path):
-    con = duckdb.connect(db_path, read_only=True)
-    return con
+def get_review_cache() -> ReviewCache:
+    return ReviewCache()
+
+
+@st.cache_resource
+def get_review_prefetcher() -> "ReviewPrefetcher":
+    """Worker pool shared by all sessions, so the number of concurrent API requests stays bounded"""
+    from verden_pa_norsk.reviews import ReviewPrefetcher
+
+    return ReviewPrefetcher(get_review_cache())
+
+
+@st.cache_resource
+def get_metadata_service() -> "MetadataService":
+    from verden_pa_norsk.metadata import MetadataService
+
+    return MetadataService()
+
+
+@st.cache_resource
+def get_exporter() -> "Exporter":
+    """Export pool shared by all sessions, so the exports in flight stay bounded"""
+    from verden_pa_norsk.export import Exporter
+
+    return Exporter()
+
+
+@st.cache_resource
+def get_place_cube() -> "PlaceYearCube":
+    from verden_pa_norsk.place_cube import PlaceYearCube
+
+    return PlaceYearCube.load()
+
+
+@st.cache_resource
+def get_person_index() -> "PersonIndex":
+    from verden_pa_norsk.persons import PersonIndex
+
+    return PersonIndex.load()
+
+
+@on_reload
+def _clear_catalog_caches():
+    """Drop everything read from the previous version of the database, see verden_pa_norsk.refresh"""
+    st.cache_data.clear()
+    get_metadata_service.clear()
+    get_place_cube.clear()
+    get_person_index.clear()
+
+
+@st.cache_resource
+def get_text_file(file_path: str) -> str:
+    """Contents of a static text file, such as the markdown of the home page, read once per process"""
+    with open(file_path, "r") as file:
+        return file.read()
+
+
+@contextlib.contextmanager
+def _script_run_ctx(ctx):
+    """Run a block on a pooled thread in the script run context of a session, and leave it after"""
+    thread = threading.current_thread()
+    add_script_run_ctx(thread, ctx)
+    try:
+        yield
+    finally:
+        # add_script_run_ctx can't unset it
+        setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+
+
+def get_query_executor() -> QueryExecutor:
+    """Query executor of the current session, see verden_pa_norsk.executor"""
+    if "query_executor" not in st.session_state:
+        st.session_state.query_executor = QueryExecutor(context=lambda: _script_run_ctx(get_script_run_ctx()))
+    return st.session_state.query_executor
+
+
+def _yield_to_streamlit():
+    # Streamlit stops the script for a pending rerun at any access to the session state, as at any st call
+    "query_executor" in st.session_state
+
+
+def run_latest(func, *args, debounce: float = 0.0, **kwargs):
+    """Call a page function that queries the database, giving up its query if the session reruns meanwhile
+
+    Args:
+        func (callable): function to call, usually cached with cache_data
+        debounce (float): seconds to wait for the input to settle when the arguments are new
+
+    Returns:
+        the return value of func
+    """
+    return get_query_executor().run(func, *args, debounce=debounce, check=_yield_to_streamlit, **kwargs)
+
+
+def show_person_suggestions(key: str, role: str, label: str, on_select=None):
+    """Persons matching a text input, as pills that fill in the chosen name
+
+    Args:
+        key (str): key of the text input
+        role (str): role of the persons to suggest, see verden_pa_norsk.persons.ROLES
+        label (str): label of the suggestions
+        on_select (callable | None): called with the chosen name, after the text input is set
+    """
+    text = st.session_state.get(key)
+    if not text:
+        return
+    index = get_person_index()
+    matches = index.complete(text, role)
+    # nothing to suggest once a name is chosen
+    if not matches or any(name == text for _, name, _ in matches):
+        return
+
+    def select():
+        person_id = st.session_state[f"{key}_suggestion"]
+        if person_id is not None:
+            st.session_state[key] = index.names[person_id]
+            if on_select:
+                on_select(index.names[person_id])
+
+    books = {person_id: f"{name} ({n})" for person_id, name, n in matches}
+    st.pills(label, books.keys(), format_func=books.get, key=f"{key}_suggestion", on_change=select)
+
+
+def show_export(query: str, params: list | None, name: str, key: str):
+    """Format choice and export button for the rows of a query, with progress and a download link once written
+
+    The export runs in the background, see verden_pa_norsk.export.Exporter, so the session stays
+    responsive while a large export is written.
+
+    Args:
+        query (str): query for the rows to export, not only those shown
+        params (list | None): parameters of the query
+        name (str): file name without extension
+        key (str): widget key prefix, unique on the page
+    """
+    from verden_pa_norsk.export import FORMATS, XLSX_MAX_ROWS, export_url
+
+    # the job and the link stay until the query or the format changes
+    job_key = f"{key}_job"
+    format_col, button_col, link_col = st.columns([2, 1, 5], vertical_alignment="center")
+    with format_col:
+        file_format = st.selectbox("Format", FORMATS.keys(), format_func=FORMATS.get, key=f"{key}_format", label_visibility="collapsed")
+    export_id = (query, str(params), file_format)
+    submitted = st.session_state.get(job_key)
+    if submitted and submitted[0] != export_id:
+        submitted = None
+    running = submitted is not None and not submitted[1].done()
+    with button_col:
+        clicked = st.button("Eksporter", key=f"{key}_button", disabled=running)
+
+    if clicked and not running:
+        job = get_exporter().submit(query, params, file_format, name)
+        if job is None:
+            with link_col:
+                st.warning("Mange eksporterer akkurat nå. Prøv igjen om litt.")
+            return
+        submitted = st.session_state[job_key] = (export_id, job)
+        running = True
+    if submitted is None:
+        return
+
+    job = submitted[1]
+    with link_col:
+        if running:
+            _show_export_progress(job)
+            return
+        try:
+            path, rows, written_format = job.result()
+        except Exception:
+            st.error("Eksporten feilet.")
+            return
+        if not os.path.exists(path):
+            # removed after EXPORT_TTL
+            return
+        size = os.path.getsize(path) / 1024**2
+        note = f" – lagret som {FORMATS[written_format]}, siden XLSX-eksport er begrenset til {XLSX_MAX_ROWS} rader" if written_format != file_format else ""
+        st.markdown(
+            f'<a href="{export_url(path)}" download="{name}.{written_format}">Last ned {rows} rader ({size:.1f} MB)</a>{note}',
+            unsafe_allow_html=True,
+        )
+
+
+@st.fragment(run_every=EXPORT_REFRESH)
+def _show_export_progress(job: "ExportJob"):
+    # a full rerun shows the link and stops the timer once the export is done
+    if job.done():
+        st.rerun()
+    text = f"Eksporterer {job.rows} av {job.total} rader ..." if job.total is not None else "Eksporterer ..."
+    st.progress(job.progress, text=text)
+
+
+def cache_data(func=None, **kwargs):
+    """st.cache_data, counting cache hits and misses in the query log
+
+    Use like st.cache_data, with or without arguments. The cache holds at most CACHE_ENTRIES
+    entries for CACHE_TTL seconds unless max_entries or ttl are given. The undecorated function is
+    available as __wrapped__.
+    """
+    kwargs = {"max_entries": CACHE_ENTRIES, "ttl": CACHE_TTL, **kwargs}
+
+    def decorate(func):
+        name = func.__qualname__
+
+        @functools.wraps(func)
+        def compute(*args, **kw):
+            # only called on a cache miss
+            _cache_calls.stack[-1] = False
+            with query_log.cache_scope():
+                return func(*args, **kw)
+
+        cached = st.cache_data(**kwargs)(compute)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            stack = _cache_calls.__dict__.setdefault("stack", [])
+            stack.append(True)
+            t0 = time.perf_counter()
+            try:
+                return cached(*args, **kw)
+            finally:
+                query_log.record_cache(name, stack.pop(), time.perf_counter() - t0)
+
+        wrapper.clear = cached.clear
+        return wrapper
+
+    return decorate(func) if func is not None else decorate
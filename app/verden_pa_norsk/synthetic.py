@@ -0,0 +1,353 @@
+"""Generate synthetic catalog data at a multiple of the real catalog size
+
+The generated parquet files follow data/src/schema.sql and are written with the file names
+load.sql expects, next to copies of the SQL scripts, so a synthetic database is built and
+refreshed exactly like the real one. Usage, from the app directory:
+
+    python -m verden_pa_norsk.synthetic [--scale 1 10 100] [--out data/synthetic] [--seed 0]
+
+Each scale is written to <out>/<scale>x/data, laid out like the app's data directory, so the
+benchmarks can run against it from <out>/<scale>x.
+
+Authors, title words and publication places are drawn from the Open Library sources in
+data/src, with frequencies falling off with their rank in the real catalog, close to Zipf's
+law. Translation years cluster around 1990, and first editions precede them by an
+exponentially distributed number of years. All randomness comes from hashing the row number
+with the seed, so the output is the same for the same seed and scale.
+"""
+import argparse
+import glob
+import os
+import re
+import shutil
+import time
+
+import duckdb
+
+from verden_pa_norsk.build import SRC_DIR, build_database
+
+# translations in the real catalog, about the number of fiction mmsids
+BASE_TRANSLATIONS = 120_000
+SCALES = (1, 10, 100)
+OUT_DIR = "data/synthetic"
+
+# reference tables, copied as they are at every scale
+REFERENCE_TABLES = ("iso_639_3_SIL", "languages", "language_nob")
+
+# original languages in order of frequency, the rest of language_nob follows
+TOP_LANGUAGES = ["[eng]", "[swe]", "[dan]", "[ger]", "[fre]", "[rus]", "[ita]", "[spa]", "[dut]", "[fin]", "[pol]", "[jpn]", "[ice]", "[por]", "[cze]"]
+PUBLISHERS = [
+    "Gyldendal", "Cappelen Damm", "Aschehoug", "Cappelen", "Tiden", "Samlaget", "Damm", "Pax",
+    "Oktober", "Bokklubben", "Solum", "Forlaget Oktober", "Kagge", "Vigmostad & Bjørke", "Bazar",
+    "Juritzen", "Font", "Pantagruel", "Lunde", "Genesis",
+]
+GIVEN_NAMES = [
+    "Anne", "Kari", "Ingrid", "Liv", "Astrid", "Solveig", "Ragnhild", "Marit", "Gro", "Tone", "Hilde",
+    "Inger", "Eli", "Sissel", "Torill", "Mette", "Kristin", "Nina", "Silje", "Hanne", "Ole", "Per",
+    "Jan", "Knut", "Arne", "Nils", "Hans", "Lars", "Tor", "Bjørn", "Erik", "Kjell", "Odd", "Geir",
+    "Einar", "Sverre", "Øystein", "Åsmund", "Trond", "Halvor",
+]
+SURNAMES = [
+    "Hansen", "Johansen", "Olsen", "Larsen", "Andersen", "Pedersen", "Nilsen", "Kristiansen",
+    "Jensen", "Karlsen", "Johnsen", "Pettersen", "Eriksen", "Berg", "Haugen", "Hagen", "Johannessen",
+    "Andreassen", "Jacobsen", "Dahl", "Jørgensen", "Halvorsen", "Henriksen", "Lund", "Sørensen",
+    "Jakobsen", "Moen", "Gundersen", "Iversen", "Strand", "Solberg", "Svendsen", "Eide", "Knutsen",
+    "Martinsen", "Paulsen", "Bakken", "Kristoffersen", "Mathisen", "Lie",
+]
+TITLE_WORDS = [
+    "og", "i", "det", "en", "et", "den", "på", "av", "til", "som", "med", "for", "fra", "min", "mitt",
+    "natt", "dag", "hjem", "hus", "huset", "vei", "veien", "by", "byen", "land", "landet", "mor", "far",
+    "barn", "barna", "søster", "bror", "kjærlighet", "død", "døden", "liv", "livet", "krig", "krigen",
+    "fred", "sommer", "vinter", "høst", "vår", "hav", "havet", "skog", "skogen", "fjell", "elv", "sjø",
+    "stjerne", "stjernene", "sol", "måne", "lys", "lyset", "mørke", "mørket", "stillhet", "tid", "tiden",
+    "år", "årene", "siste", "første", "lange", "store", "lille", "gamle", "unge", "hvite", "svarte",
+    "røde", "blå", "grønne", "kvinne", "kvinnen", "mann", "mannen", "pike", "piken", "gutt", "gutten",
+    "konge", "kongen", "dronning", "hemmelighet", "hemmeligheten", "drøm", "drømmen", "sannhet",
+    "løgn", "mord", "mordet", "reise", "reisen", "brev", "bok", "boken", "ord", "sang", "sangen",
+    "hjerte", "hjertet", "øye", "øynene", "hånd", "hender", "vind", "vinden", "regn", "snø", "ild",
+    "vann", "jord", "himmel", "himmelen", "sjel", "skygge", "skyggen", "speil", "dør", "vindu",
+]
+# Dewey codes for fiction, and for the non-fiction that is filtered out by default
+FICTION_DDC = [823.914, 813.54, 839.73, 839.813, 833.914, 843.914, 891.73, 853.914, 863.64, 895.63]
+OTHER_DDC = [306.0, 940.53, 920.0, 158.1, 641.5, 910.4]
+
+
+def load_targets(src_dir: str) -> dict[str, str]:
+    """Parquet file name per table, as read by load.sql"""
+    with open(os.path.join(src_dir, "load.sql"), "r") as file:
+        return dict(re.findall(r"COPY (\w+) FROM 'src/([^']+)'", file.read()))
+
+
+def sql_list(values: list) -> str:
+    return "[" + ", ".join(repr(v) if not isinstance(v, str) else "'" + v.replace("'", "''") + "'" for v in values) + "]"
+
+
+def create_pools(con: duckdb.DuckDBPyConnection, src_dir: str, scale: float):
+    """Ranked pools of authors, words, places, languages and translators, most frequent first"""
+    con.execute(f"CREATE TABLE ol_real AS SELECT * FROM read_parquet('{src_dir}/ol_first_editions.parquet')")
+
+    # real authors by frequency, then combinations of real surnames and given names
+    n_authors = int(25_000 * scale**0.8)
+    con.execute(f"""
+        CREATE TABLE author_pool AS
+        WITH real AS (
+            SELECT author, count(*) AS n FROM ol_real WHERE author LIKE '%_, _%' GROUP BY author
+        ),
+        surnames AS (
+            SELECT DISTINCT split_part(author, ', ', 1) AS surname FROM real ORDER BY hash(surname, 'surname', seed()) LIMIT 2000
+        ),
+        given AS (
+            SELECT DISTINCT split_part(author, ', ', 2) AS given FROM real ORDER BY hash(given, 'given', seed()) LIMIT 2000
+        ),
+        candidates AS (
+            SELECT author, 0 AS source, -n::DOUBLE AS ord FROM real
+            UNION ALL
+            SELECT surname || ', ' || given, 1, hash(surname, given, seed())::DOUBLE FROM surnames, given
+        )
+        SELECT row_number() OVER (ORDER BY source, ord, author) - 1 AS rank, author
+        FROM (SELECT author, min(source) AS source, min(ord) AS ord FROM candidates GROUP BY author)
+        QUALIFY rank < {n_authors}
+    """)
+
+    con.execute("""
+        SET VARIABLE words = (
+            SELECT list(word ORDER BY n DESC, word) FROM (
+                SELECT word, count(*) AS n
+                FROM (SELECT unnest(regexp_split_to_array(lower(title), '[^\\p{L}\\p{N}]+')) AS word FROM ol_real)
+                WHERE length(word) >= 2
+                GROUP BY word
+            )
+        )
+    """)
+    con.execute(f"SET VARIABLE title_words = {sql_list(TITLE_WORDS)}")
+    con.execute(f"SET VARIABLE publishers = {sql_list(PUBLISHERS)}")
+    con.execute(f"SET VARIABLE fiction_ddc = {sql_list(FICTION_DDC)}::DOUBLE[]")
+    con.execute(f"SET VARIABLE other_ddc = {sql_list(OTHER_DDC)}::DOUBLE[]")
+
+    # real places by frequency. Larger catalogs get more geocoded variants of the same places.
+    copies = max(1, round(scale**0.5))
+    con.execute(f"""
+        CREATE TABLE place_pool AS
+        WITH real AS (
+            SELECT publish_places, address, latitude, longitude, count(*) AS n
+            FROM ol_real
+            WHERE address IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+            GROUP BY ALL
+        )
+        SELECT row_number() OVER (ORDER BY k, n DESC, address, latitude, longitude) - 1 AS rank,
+            publish_places, address,
+            CASE WHEN k = 0 THEN latitude ELSE latitude + (u(address, 'lat' || k) - 0.5) / 10 END AS latitude,
+            CASE WHEN k = 0 THEN longitude ELSE longitude + (u(address, 'lon' || k) - 0.5) / 10 END AS longitude
+        FROM real, range({copies}) t(k)
+    """)
+
+    con.execute(f"""
+        CREATE TABLE language_pool AS
+        SELECT row_number() OVER (
+            ORDER BY coalesce(nullif(list_position({sql_list(TOP_LANGUAGES)}, language_code), 0), 1000), hash(language_code, seed())
+        ) - 1 AS rank, language_code
+        FROM read_parquet('{src_dir}/language_nob.parquet')
+    """)
+
+    n_translators = int(5_000 * scale**0.8)
+    con.execute(f"""
+        CREATE TABLE translator_pool AS
+        SELECT row_number() OVER (ORDER BY length(initial), hash(surname, given, initial, seed())) - 1 AS rank,
+            surname || ', ' || given || initial AS name
+        FROM unnest({sql_list(SURNAMES)}) s(surname),
+            unnest({sql_list(GIVEN_NAMES)}) g(given),
+            unnest([''] || [' ' || chr((65 + i)::INTEGER) || '.' FOR i IN range(26)]) i(initial)
+        QUALIFY rank < {n_translators}
+    """)
+
+
+def create_macros(con: duckdb.DuckDBPyConnection, seed: int):
+    con.execute(f"CREATE MACRO seed() AS {int(seed)}")
+    # uniform in [0, 1), from a hash of a key and a salt
+    con.execute("CREATE MACRO u(key, salt) AS hash(key, salt, seed())::DOUBLE / 18446744073709551616.0")
+    # rank in [0, n), drawn with probability close to 1 / (rank + shift). A larger shift flattens the head.
+    con.execute("""CREATE MACRO zipf(key, salt, n, shift) AS
+        least(floor(shift * exp(u(key, salt) * ln((n + shift) / shift)) - shift)::BIGINT, n - 1)""")
+    con.execute("CREATE MACRO normal(key, salt) AS sqrt(-2 * ln(greatest(u(key, salt || 'a'), 1e-12))) * cos(2 * pi() * u(key, salt || 'b'))")
+    con.execute("""CREATE MACRO words(key, salt, vocabulary, n) AS
+        array_to_string([vocabulary[zipf(key, salt || j, len(vocabulary), 1) + 1] FOR j IN range(n)], ' ')""")
+    con.execute("CREATE MACRO capitalize(s) AS upper(s[1]) || s[2:]")
+
+
+def generate_translations(con: duckdb.DuckDBPyConnection, n: int):
+    n_authors = con.execute("SELECT count(*) FROM author_pool").fetchone()[0]
+    n_translators = con.execute("SELECT count(*) FROM translator_pool").fetchone()[0]
+    n_languages = con.execute("SELECT count(*) FROM language_pool").fetchone()[0]
+    con.execute(f"""
+        INSERT INTO translations
+        WITH rows AS (
+            SELECT i,
+                '99' || lpad(i::VARCHAR, 9, '0') || '4702201' AS mmsid,
+                zipf(i, 'author', {n_authors}, 20) AS author_rank,
+                zipf(i, 'translator1', {n_translators}, 5) AS translator1_rank,
+                zipf(i, 'translator2', {n_translators}, 5) AS translator2_rank,
+                zipf(i, 'original_language', {n_languages}, 0.5) AS language_rank,
+                u(i, 'translators') AS n_translators,
+                CASE
+                    WHEN u(i, 'year') < 0.01 THEN NULL
+                    WHEN u(i, 'year_spread') < 0.15 THEN 1800 + floor(u(i, 'year_uniform') * 225)
+                    ELSE least(greatest(round(1990 + 25 * normal(i, 'year_normal')), 1800), 2024)
+                END::INTEGER AS year,
+                u(i, 'ddc') AS ddc
+            FROM range({n}) t(i)
+        )
+        SELECT
+            r.mmsid,
+            a.author AS main_author,
+            CASE
+                WHEN r.n_translators < 0.15 THEN []
+                WHEN r.n_translators < 0.25 THEN [t1.name, t2.name]
+                ELSE [t1.name]
+            END || CASE WHEN u(r.i, 'illustrator') < 0.1 THEN [t2.name] ELSE [] END AS contributors,
+            CASE
+                WHEN r.n_translators < 0.15 THEN []
+                WHEN r.n_translators < 0.25 THEN [t1.name, t2.name]
+                ELSE [t1.name]
+            END AS translators,
+            capitalize(words(r.i, 'title', getvariable('title_words'), 1 + floor(u(r.i, 'title_length') * 4)::INTEGER))
+                || CASE WHEN u(r.i, 'title_colon') < 0.1 THEN ': roman' ELSE '' END AS title,
+            CASE WHEN u(r.i, 'subtitle') < 0.2 THEN ['roman', 'noveller', 'dikt', 'kriminalroman'][1 + floor(u(r.i, 'subtitle_kind') * 4)::INTEGER] END AS subtitle,
+            capitalize(words(r.i, 'original_title', getvariable('words'), 1 + floor(u(r.i, 'original_title_length') * 5)::INTEGER)) AS original_title,
+            getvariable('publishers')[zipf(r.i, 'publisher', len(getvariable('publishers')), 1) + 1] AS publisher,
+            CASE WHEN u(r.i, 'language') < 0.8 THEN 'nob' WHEN u(r.i, 'language') < 0.92 THEN 'nno' ELSE 'nor' END AS "language",
+            l.language_code AS original_language,
+            CASE WHEN r.year IS NULL THEN NULL WHEN u(r.i, 'year_str') < 0.05 THEN '[' || r.year || ']' ELSE r.year::VARCHAR END AS publication_year_str,
+            r.year AS publication_year_int,
+            CASE
+                WHEN r.ddc < 0.8 THEN [getvariable('fiction_ddc')[zipf(r.i, 'ddc_code', len(getvariable('fiction_ddc')), 1) + 1]]
+                WHEN r.ddc < 0.9 THEN []
+                ELSE [getvariable('other_ddc')[1 + floor(u(r.i, 'ddc_code') * len(getvariable('other_ddc')))::INTEGER]]
+            END AS ddc,
+            r.ddc < 0.8 AS ddc800,
+            r.ddc >= 0.8 AND r.ddc < 0.9 AS ddc0
+        FROM rows r
+        JOIN author_pool a ON a.rank = r.author_rank
+        JOIN translator_pool t1 ON t1.rank = r.translator1_rank
+        JOIN translator_pool t2 ON t2.rank = r.translator2_rank
+        JOIN language_pool l ON l.rank = r.language_rank
+        ORDER BY r.i
+    """)
+
+
+def generate_editions(con: duckdb.DuckDBPyConnection):
+    """First editions for about a third of the translations, one to three each"""
+    n_places = con.execute("SELECT count(*) FROM place_pool").fetchone()[0]
+    con.execute(f"""
+        INSERT INTO ol_first_editions
+        WITH matched AS (
+            SELECT mmsid, main_author, original_title, publication_year_int,
+                CASE WHEN u(mmsid, 'editions') < 0.8 THEN 1 WHEN u(mmsid, 'editions') < 0.95 THEN 2 ELSE 3 END AS n_editions
+            FROM translations
+            WHERE u(mmsid, 'matched') < 0.34
+        ),
+        editions AS (
+            SELECT m.*, e.j,
+                CASE WHEN u(mmsid || j, 'undated') < 0.02 OR publication_year_int IS NULL THEN NULL
+                    ELSE greatest(publication_year_int - floor(-12 * ln(greatest(u(mmsid || j, 'lag'), 1e-12))), 1450)::INTEGER
+                END AS publish_year,
+                zipf(mmsid || j, 'place', {n_places}, 1) AS place_rank
+            FROM matched m, range(3) e(j)
+            WHERE e.j < m.n_editions
+        )
+        SELECT
+            e.mmsid,
+            '/works/OL' || (hash(e.mmsid, seed()) % 30000000) || 'W' AS work_key,
+            '/books/OL' || (hash(e.mmsid, e.j, seed()) % 60000000) || 'M' AS edition_key,
+            e.main_author AS author,
+            e.original_title AS title,
+            coalesce(e.publish_year::VARCHAR, 'n.d.') AS raw_publish_date,
+            e.publish_year,
+            [getvariable('publishers')[zipf(e.mmsid || e.j, 'ol_publisher', len(getvariable('publishers')), 1) + 1]] AS publishers,
+            [p.publish_places] AS publish_places_all,
+            p.publish_places,
+            CASE WHEN u(e.mmsid || e.j, 'geocoded') < 0.99 THEN p.address END AS address,
+            CASE WHEN u(e.mmsid || e.j, 'geocoded') < 0.99 THEN p.latitude END AS latitude,
+            CASE WHEN u(e.mmsid || e.j, 'geocoded') < 0.99 THEN p.longitude END AS longitude
+        FROM editions e
+        JOIN place_pool p ON p.rank = e.place_rank
+        ORDER BY e.mmsid, e.j
+    """)
+
+
+def generate_urns(con: duckdb.DuckDBPyConnection):
+    """URNs for the digitized translations, about 60%, a few with two copies"""
+    con.execute("""
+        INSERT INTO urn_mmsid
+        SELECT 'URN:NBN:no-nb_digibok_' || (2008000000000 + hash(mmsid, copy, seed()) % 10000000000) AS urn, mmsid
+        FROM translations, range(2) c(copy)
+        WHERE u(mmsid, 'digitized') < 0.6 AND (copy = 0 OR u(mmsid, 'copies') < 0.05)
+    """)
+
+
+def generate(scale: float, out_dir: str, seed: int = 0, src_dir: str = SRC_DIR, build: bool = True) -> str:
+    """Write synthetic parquet sources and build scripts for one scale, and build the database
+
+    Args:
+        scale (float): catalog size as a multiple of the real catalog
+        out_dir (str): directory for this scale, laid out like the app directory
+        seed (int): seed for all random choices
+        src_dir (str): directory with the real build scripts and parquet sources
+        build (bool): build the database after generating the sources
+
+    Returns:
+        str: path of the data directory, holding src/ and, if built, the database
+    """
+    data_dir = os.path.join(out_dir, "data")
+    gen_src = os.path.join(data_dir, "src")
+    os.makedirs(gen_src, exist_ok=True)
+    targets = load_targets(src_dir)
+
+    # every script, for the build and for verden_pa_norsk.refresh
+    for script in glob.glob(os.path.join(src_dir, "*.sql")):
+        shutil.copy(script, gen_src)
+    for table in REFERENCE_TABLES:
+        shutil.copy(os.path.join(src_dir, targets[table]), gen_src)
+
+    work_path = os.path.join(data_dir, "synthetic.tmp.db")
+    if os.path.exists(work_path):
+        os.remove(work_path)
+    with duckdb.connect(work_path) as con:
+        with open(os.path.join(src_dir, "schema.sql"), "r") as file:
+            con.execute(file.read())
+        create_macros(con, seed)
+        create_pools(con, os.path.abspath(src_dir), scale)
+
+        generate_translations(con, int(BASE_TRANSLATIONS * scale))
+        generate_editions(con)
+        generate_urns(con)
+        con.execute("""
+            INSERT INTO fiction_mmsids
+            SELECT mmsid FROM translations WHERE ddc800 OR (ddc0 AND u(mmsid, 'fiction') < 0.5)
+        """)
+
+        for table in ("translations", "ol_first_editions", "urn_mmsid", "fiction_mmsids"):
+            con.execute(f"COPY {table} TO '{os.path.join(gen_src, targets[table])}' (FORMAT 'parquet')")
+    os.remove(work_path)
+
+    if build:
+        build_database(gen_src, os.path.join(data_dir, "translations_map_data.db"))
+    return data_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Verden på norsk catalogs")
+    parser.add_argument("--scale", type=float, nargs="+", default=list(SCALES), help="catalog sizes, as multiples of the real catalog")
+    parser.add_argument("--out", default=OUT_DIR, help="directory to write one subdirectory per scale to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--src", default=SRC_DIR, help="directory with the real build scripts and sources")
+    parser.add_argument("--no-build", action="store_true", help="only write the parquet sources")
+    args = parser.parse_args()
+
+    for scale in args.scale:
+        t0 = time.perf_counter()
+        data_dir = generate(scale, os.path.join(args.out, f"{scale:g}x"), args.seed, args.src, not args.no_build)
+        print(f"{scale:g}x: {data_dir} ({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()